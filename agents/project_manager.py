@@ -5,12 +5,260 @@ from pathlib import Path
 from typing import List, Dict, Any
 import re
 import sys
+import time
 
 # Добавляем путь к корню проекта
 ROOT = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT))
 
-from session_logger import get_logger
+from session_logger import get_logger, _write_json_atomic
+from core.events import emit
+from core.dialog_catalog import DialogCatalog
+from core.extraction import HybridExtractor, LLM_EXTRACTION_BACKGROUND, get_extraction_service
+from core.keyword_matcher import KeywordMatcher
+
+# Ключевые слова анализа ответов (порядок в таблице задаёт приоритет)
+TYPE_KEYWORDS = {
+    'сайт': 'website',
+    'страниц': 'website',
+    'html': 'website',
+    'парс': 'parser',
+    'бот': 'bot',
+    'скрипт': 'script',
+    'утилит': 'utility',
+    'игр': 'game',
+    'анимац': 'animation'
+}
+
+TECH_KEYWORDS = {
+    'react': 'React',
+    'vue': 'Vue',
+    'angular': 'Angular',
+    'bootstrap': 'Bootstrap',
+    'tailwind': 'Tailwind',
+    'python': 'Python',
+    'javascript': 'JavaScript',
+    'js': 'JavaScript',
+    'jquery': 'jQuery',
+    'canvas': 'Canvas',
+    'gsap': 'GSAP',
+    'three': 'Three.js',
+    'webgl': 'WebGL'
+}
+
+COLOR_KEYWORDS = {
+    'черн': 'черный',
+    'бел': 'белый',
+    'сер': 'серый',
+    'темн': 'темный',
+    'светл': 'светлый',
+    'фиолет': 'фиолетовый',
+    'син': 'синий',
+    'голуб': 'голубой',
+    'красн': 'красный',
+    'зелен': 'зеленый',
+    'желт': 'желтый'
+}
+
+SPEED_KEYWORDS = {
+    'медлен': 'slow',
+    'средн': 'medium',
+    'быстр': 'fast'
+}
+
+STYLE_KEYWORDS = {
+    'абстракт': 'abstract',
+    'геометрич': 'geometric',
+    'органическ': 'organic',
+    'минимал': 'minimal',
+    'футурист': 'futuristic',
+    'дарк': 'dark',
+    'фэнтези': 'fantasy',
+    'киберпанк': 'cyberpunk'
+}
+
+MOOD_KEYWORDS = {
+    'темн': 'dark',
+    'дарк': 'dark',
+    'светл': 'light'
+}
+
+EFFECT_KEYWORDS = {
+    'переход': 'переход',
+    'негатив': 'негатив',
+    'черно-бел': 'черно-белый',
+    'grayscale': 'grayscale',
+    'наведен': 'наведен',
+    'клик': 'клик',
+    'пар': 'пар',
+    'частиц': 'частиц',
+    'свечен': 'свечен'
+}
+
+FORBIDDEN_TRIGGERS = ['не используй', 'без', 'запрещ', 'не надо', 'кроме']
+
+# Один matcher на процесс: все таблицы проверяются за один проход по тексту
+KEYWORD_MATCHER = KeywordMatcher({
+    'type': TYPE_KEYWORDS,
+    'tech': TECH_KEYWORDS,
+    'color': COLOR_KEYWORDS,
+    'speed': SPEED_KEYWORDS,
+    'style': STYLE_KEYWORDS,
+    'mood': MOOD_KEYWORDS,
+    'effect': EFFECT_KEYWORDS,
+    'forbidden': FORBIDDEN_TRIGGERS,
+})
+
+
+def _first_hit(table: dict, found: dict):
+    """Значение первого по порядку таблицы найденного ключа"""
+    return next((value for keyword, value in table.items() if keyword in found), None)
+
+
+def forbidden_items(words: list, hits: dict) -> list:
+    """Слова после запрещающих триггеров ("без jquery" -> "jquery") по номерам слов из KEYWORD_MATCHER.
+
+    Триггер ищется внутри слова, поэтому фразы ("не надо") слов не дают - как и прежний разбор.
+    """
+    items = []
+    for trigger, indices in hits.items():
+        if " " in trigger:
+            continue
+        for index in indices:
+            if index + 1 < len(words) and words[index + 1] not in items:
+                items.append(words[index + 1])
+    return items
+
+
+def _plain(value):
+    """Копия значения в виде, в каком оно попадёт в JSON"""
+    return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+
+def read_dialog(dialog_dir, session_id: str):
+    """Диалог из снапшота dialog_<id>.json и хвоста журнала dialog_<id>.jsonl после него.
+
+    Журнал: строки {'type': 'message', 'role', 'message', 'timestamp'} и {'type': 'requirements', 'delta'}.
+    Недописанная строка (падение во время записи) пропускается. None - диалога нет.
+    """
+    dialog_dir = Path(dialog_dir)
+    snapshot_file = dialog_dir / f"dialog_{session_id}.json"
+    journal_file = dialog_dir / f"dialog_{session_id}.jsonl"
+    if not snapshot_file.exists() and not journal_file.exists():
+        return None
+
+    data = {'session_id': session_id, 'requirements': {}, 'dialog': [], 'timestamp': None, 'offset': 0}
+    if snapshot_file.exists():
+        try:
+            with open(snapshot_file, 'r', encoding='utf-8') as f:
+                data.update(json.load(f))
+        except ValueError:
+            pass
+
+    if journal_file.exists():
+        with open(journal_file, 'rb') as f:
+            f.seek(data['offset'])
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('type') == 'message':
+                    data['dialog'].append({key: entry[key] for key in ('role', 'message', 'timestamp')})
+                elif entry.get('type') == 'requirements':
+                    data['requirements'].update(entry['delta'])
+                data['timestamp'] = entry.get('timestamp', data['timestamp'])
+
+    data['message_count'] = len(data['dialog'])
+    return data
+
+
+# Каталоги диалогов по папке - создаются и заполняются один раз на процесс
+_catalogs = {}
+
+
+def get_dialog_catalog(dialog_dir) -> DialogCatalog:
+    """Каталог папки диалогов; пустой каталог заполняется по уже сохранённым диалогам"""
+    dialog_dir = Path(dialog_dir).resolve()
+    catalog = _catalogs.get(dialog_dir)
+    if catalog is None:
+        catalog = _catalogs[dialog_dir] = DialogCatalog(dialog_dir / "catalog.sqlite3")
+        if catalog.is_empty():
+            session_ids = {path.stem.replace("dialog_", "", 1) for path in dialog_dir.glob("dialog_*.json*")}
+            for session_id in session_ids:
+                data = read_dialog(dialog_dir, session_id)
+                if not data or not data['dialog']:
+                    continue
+                catalog.upsert(
+                    session_id,
+                    created_at=data['dialog'][0]['timestamp'],
+                    updated_at=data['timestamp'] or data['dialog'][-1]['timestamp'],
+                    message_count=data['message_count'],
+                    initial_task=data['requirements'].get('initial_task', ''),
+                )
+    return catalog
+
+
+def analyze_response(response: str, requirements: dict) -> dict:
+    """Обновляет требования по ключевым словам ответа (один проход KEYWORD_MATCHER)"""
+    words = response.lower().split()
+    hits = KEYWORD_MATCHER.scan(words)
+
+    # 1. Определяем тип проекта
+    project_type = _first_hit(TYPE_KEYWORDS, hits['type'])
+    if project_type:
+        requirements['project_type'] = project_type
+
+    # 2. Определяем технологии
+    for keyword, tech in TECH_KEYWORDS.items():
+        if keyword in hits['tech'] and tech not in requirements['technologies']:
+            requirements['technologies'].append(tech)
+
+    # 3. Определяем цвета
+    for keyword, color in COLOR_KEYWORDS.items():
+        if keyword in hits['color'] and color not in requirements['colors']:
+            requirements['colors'].append(color)
+
+    # 4. Определяем скорость анимации
+    speed = _first_hit(SPEED_KEYWORDS, hits['speed'])
+    if speed:
+        requirements['animation_speed'] = speed
+
+    # 5. Определяем стиль (побеждает последний по таблице)
+    for keyword, style in STYLE_KEYWORDS.items():
+        if keyword in hits['style']:
+            requirements['style'] = style
+
+    # 6. Определяем настроение
+    mood = _first_hit(MOOD_KEYWORDS, hits['mood'])
+    if mood:
+        requirements['mood'] = mood
+
+    # 7. Определяем эффекты
+    for keyword, effect_name in EFFECT_KEYWORDS.items():
+        if keyword in hits['effect'] and effect_name not in requirements['features']:
+            requirements['features'].append(effect_name)
+
+    # 8. Определяем запреты
+    for item in forbidden_items(words, hits['forbidden']):
+        if item not in requirements['forbidden']:
+            requirements['forbidden'].append(item)
+
+    # 9. Извлекаем ссылки
+    urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+])+', response)
+    if urls:
+        requirements['examples'].extend(urls)
+
+    # 10. Анализируем длину ответа (для определения детализации)
+    if len(words) > 20:
+        requirements['detailed_response'] = True
+
+    # 11. Удаляем дубликаты
+    requirements['technologies'] = list(set(requirements['technologies']))
+    requirements['colors'] = list(set(requirements['colors']))
+    requirements['features'] = list(set(requirements['features']))
+    requirements['forbidden'] = list(set(requirements['forbidden']))
+    return requirements
 
 
 class ProjectManager:
@@ -37,20 +285,18 @@ class ProjectManager:
         # Инициализируем логгер
         self.logger = get_logger()
 
-        # Категории для анализа ответов
-        self.categories = {
-            'type': ['сайт', 'страниц', 'html', 'парс', 'бот', 'скрипт', 'утилит', 'приложени'],
-            'tech': ['react', 'vue', 'angular', 'bootstrap', 'tailwind', 'python', 'js', 'javascript'],
-            'color': ['черн', 'бел', 'сер', 'темн', 'светл', 'фиолет', 'син', 'красн', 'зелен'],
-            'animation': ['медлен', 'средн', 'быстр', 'движ', 'анимац'],
-            'style': ['абстракт', 'геометрич', 'органическ', 'минимал', 'футурист', 'дарк', 'фэнтези'],
-            'effect': ['переход', 'негатив', 'черно-бел', 'grayscale', 'hover', 'клик'],
-            'forbidden': ['не используй', 'без', 'запрещ', 'не надо', 'кроме']
-        }
-
         # Папка для сохранения диалогов
         self.dialog_dir = Path(__file__).parent.parent / "dialog_history"
         self.dialog_dir.mkdir(exist_ok=True)
+        # Журнал диалога: сообщения и изменения требований дописываются по строке
+        self._saved_requirements = {}
+        # Каталог для списка «История»
+        self.catalog = get_dialog_catalog(self.dialog_dir)
+        # Ключевые слова сразу, LLM - только при низкой уверенности или незнакомых терминах (в фоне)
+        self.extractor = HybridExtractor(
+            analyze_response, KEYWORD_MATCHER.known,
+            service=get_extraction_service() if LLM_EXTRACTION_BACKGROUND else None,
+        )
 
     def start_dialog(self, initial_task: str):
         """Начинает диалог с пользователем"""
@@ -77,18 +323,21 @@ class ProjectManager:
 
         self._add_to_history("system", welcome_message)
         self._save_dialog()
+        self._update_catalog()
         return welcome_message
 
     def _add_to_history(self, role: str, message: str):
         """Добавляет сообщение в историю диалога и логгер"""
         timestamp = datetime.now()
 
-        # Добавляем в историю
-        self.dialog_history.append({
+        # Добавляем в историю и журнал
+        entry = {
             'role': role,
             'message': message,
             'timestamp': timestamp.isoformat()
-        })
+        }
+        self.dialog_history.append(entry)
+        self._append_journal({'type': 'message', **entry})
 
         # Сохраняем в логгер
         if role == 'user':
@@ -97,13 +346,19 @@ class ProjectManager:
             self.logger.log_chat("Менеджер", message[:200])
 
         self.logger.log(f"[ДИАЛОГ] {role}: {message[:100]}...")
+        emit("dialog.message", None, session_id=self.session_id, role=role, chars=len(message))
 
     def process_response(self, user_response: str) -> Dict[str, Any]:
         """Обрабатывает ответ пользователя и обновляет требования"""
         self._add_to_history("user", user_response)
 
         # Анализируем ответ
-        self._analyze_response_deep(user_response)
+        started = time.perf_counter()
+        self.apply_pending_extraction(save=False)
+        extraction = self.extractor.extract(user_response, self.requirements, dialog_id=self.session_id)
+        emit("dialog.analyzed", None, session_id=self.session_id, duration=round(time.perf_counter() - started, 6),
+             project_type=self.requirements['project_type'], escalated=extraction['escalated'],
+             pending=extraction['pending'], reason=extraction['reason'], confidence=extraction['confidence'])
 
         # Сохраняем диалог
         self._save_dialog()
@@ -112,7 +367,7 @@ class ProjectManager:
         if self._is_ready_to_proceed():
             final_spec = self._generate_final_spec()
             self._add_to_history("system", f"✅ **Отлично! У меня достаточно информации.**\n\n```\n{final_spec}\n```")
-            self._save_dialog()
+            self._snapshot_dialog()
             return {
                 'status': 'ready',
                 'spec': final_spec,
@@ -131,142 +386,37 @@ class ProjectManager:
             }
         else:
             final_spec = self._generate_final_spec()
+            self._snapshot_dialog()
             return {
                 'status': 'ready',
                 'spec': final_spec,
                 'dialog': self.dialog_history
             }
 
+    def apply_pending_extraction(self, save: bool = True) -> list:
+        """Применяет готовые фоновые LLM-результаты диалога; возвращает изменённые поля"""
+        service = self.extractor.service
+        if service is None:
+            return []
+        changed = []
+        for job in service.poll(self.session_id):
+            for name in self.extractor.apply(job, self.requirements):
+                if name not in changed:
+                    changed.append(name)
+        if changed:
+            emit("dialog.refined", None, session_id=self.session_id, fields=changed)
+            if save:
+                self._save_dialog()
+        return changed
+
+    def extraction_pending(self) -> bool:
+        """Идёт ли для диалога фоновое LLM-извлечение"""
+        service = self.extractor.service
+        return service is not None and service.pending(self.session_id)
+
     def _analyze_response_deep(self, response: str):
         """Глубокий анализ ответа пользователя"""
-        response_lower = response.lower()
-
-        # 1. Определяем тип проекта
-        type_keywords = {
-            'сайт': 'website',
-            'страниц': 'website',
-            'html': 'website',
-            'парс': 'parser',
-            'бот': 'bot',
-            'скрипт': 'script',
-            'утилит': 'utility',
-            'игр': 'game',
-            'анимац': 'animation'
-        }
-
-        for keyword, proj_type in type_keywords.items():
-            if keyword in response_lower:
-                self.requirements['project_type'] = proj_type
-                break
-
-        # 2. Определяем технологии
-        tech_keywords = {
-            'react': 'React',
-            'vue': 'Vue',
-            'angular': 'Angular',
-            'bootstrap': 'Bootstrap',
-            'tailwind': 'Tailwind',
-            'python': 'Python',
-            'javascript': 'JavaScript',
-            'js': 'JavaScript',
-            'jquery': 'jQuery',
-            'canvas': 'Canvas',
-            'gsap': 'GSAP',
-            'three': 'Three.js',
-            'webgl': 'WebGL'
-        }
-
-        for keyword, tech in tech_keywords.items():
-            if keyword in response_lower and tech not in self.requirements['technologies']:
-                self.requirements['technologies'].append(tech)
-
-        # 3. Определяем цвета
-        color_patterns = {
-            'черн': 'черный',
-            'бел': 'белый',
-            'сер': 'серый',
-            'темн': 'темный',
-            'светл': 'светлый',
-            'фиолет': 'фиолетовый',
-            'син': 'синий',
-            'голуб': 'голубой',
-            'красн': 'красный',
-            'зелен': 'зеленый',
-            'желт': 'желтый'
-        }
-
-        for pattern, color in color_patterns.items():
-            if pattern in response_lower and color not in self.requirements['colors']:
-                self.requirements['colors'].append(color)
-
-        # 4. Определяем скорость анимации
-        if 'медлен' in response_lower:
-            self.requirements['animation_speed'] = 'slow'
-        elif 'средн' in response_lower:
-            self.requirements['animation_speed'] = 'medium'
-        elif 'быстр' in response_lower:
-            self.requirements['animation_speed'] = 'fast'
-
-        # 5. Определяем стиль
-        style_keywords = {
-            'абстракт': 'abstract',
-            'геометрич': 'geometric',
-            'органическ': 'organic',
-            'минимал': 'minimal',
-            'футурист': 'futuristic',
-            'дарк': 'dark',
-            'фэнтези': 'fantasy',
-            'киберпанк': 'cyberpunk'
-        }
-
-        for keyword, style in style_keywords.items():
-            if keyword in response_lower:
-                self.requirements['style'] = style
-
-        # 6. Определяем настроение
-        if 'темн' in response_lower or 'дарк' in response_lower:
-            self.requirements['mood'] = 'dark'
-        elif 'светл' in response_lower:
-            self.requirements['mood'] = 'light'
-
-        # 7. Определяем эффекты
-        effect_keywords = [
-            'переход', 'негатив', 'черно-бел', 'grayscale',
-            'наведен', 'клик', 'пар', 'частиц', 'свечен'
-        ]
-
-        for effect in effect_keywords:
-            if effect in response_lower:
-                effect_name = effect.replace('черно-бел', 'черно-белый')
-                if effect_name not in self.requirements['features']:
-                    self.requirements['features'].append(effect_name)
-
-        # 8. Определяем запреты
-        for word in self.categories['forbidden']:
-            if word in response_lower:
-                # Пытаемся понять что именно запрещено
-                words = response_lower.split()
-                for i, w in enumerate(words):
-                    if word in w and i + 1 < len(words):
-                        forbidden_item = words[i + 1]
-                        if forbidden_item not in self.requirements['forbidden']:
-                            self.requirements['forbidden'].append(forbidden_item)
-
-        # 9. Извлекаем ссылки
-        urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+])+', response)
-        if urls:
-            self.requirements['examples'].extend(urls)
-
-        # 10. Анализируем длину ответа (для определения детализации)
-        word_count = len(response.split())
-        if word_count > 20:
-            self.requirements['detailed_response'] = True
-
-        # 11. Удаляем дубликаты
-        self.requirements['technologies'] = list(set(self.requirements['technologies']))
-        self.requirements['colors'] = list(set(self.requirements['colors']))
-        self.requirements['features'] = list(set(self.requirements['features']))
-        self.requirements['forbidden'] = list(set(self.requirements['forbidden']))
+        analyze_response(response, self.requirements)
 
     def _generate_smart_question(self) -> str:
         """Генерирует умный вопрос на основе того, чего не хватает"""
@@ -377,32 +527,68 @@ class ProjectManager:
 
         return spec
 
-    def _save_dialog(self):
-        """Сохраняет историю диалога в файл"""
-        filename = self.dialog_dir / f"dialog_{self.session_id}.json"
+    @property
+    def _journal_file(self) -> Path:
+        return self.dialog_dir / f"dialog_{self.session_id}.jsonl"
+
+    def _append_journal(self, entry: dict):
+        with open(self._journal_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+    def _update_catalog(self, completed: bool = False):
+        """Метаданные диалога в каталоге: время, число сообщений, начало задачи, готовность.
+
+        Пишется при старте диалога и в снапшоте, а не на каждое сообщение - это запись в SQLite.
+        """
+        self.catalog.upsert(
+            self.session_id,
+            created_at=self.dialog_history[0]['timestamp'] if self.dialog_history else None,
+            updated_at=datetime.now().isoformat(),
+            message_count=len(self.dialog_history),
+            initial_task=self.requirements.get('initial_task', ''),
+            ready=self._is_ready_to_proceed(),
+            completed=completed,
+        )
 
-        # Подготавливаем данные для сохранения
-        data = {
+    def _save_dialog(self):
+        """Дописывает в журнал изменившиеся поля требований (сообщения пишет _add_to_history)"""
+        requirements = _plain(self.requirements)
+        delta = {key: value for key, value in requirements.items() if self._saved_requirements.get(key) != value}
+        if delta:
+            self._append_journal({'type': 'requirements', 'delta': delta, 'timestamp': datetime.now().isoformat()})
+            self._saved_requirements = requirements
+
+    def _snapshot_dialog(self):
+        """Компактный снапшот dialog_<id>.json с позицией в журнале - загрузка читает только хвост после неё"""
+        self._save_dialog()
+        offset = self._journal_file.stat().st_size if self._journal_file.exists() else 0
+        _write_json_atomic(self.dialog_dir / f"dialog_{self.session_id}.json", {
             'session_id': self.session_id,
             'requirements': self.requirements,
             'dialog': self.dialog_history,
             'timestamp': datetime.now().isoformat(),
-            'message_count': len(self.dialog_history)
-        }
+            'message_count': len(self.dialog_history),
+            'offset': offset,
+        })
+        self._update_catalog(completed=True)
 
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+    def finish_dialog(self) -> str:
+        """Завершает диалог досрочно: ТЗ по собранным требованиям и снапшот"""
+        self.apply_pending_extraction(save=False)
+        final_spec = self._generate_final_spec()
+        self._snapshot_dialog()
+        return final_spec
 
     def load_previous_dialog(self, session_id: str):
-        """Загружает предыдущий диалог"""
-        filename = self.dialog_dir / f"dialog_{session_id}.json"
-        if filename.exists():
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.requirements = data['requirements']
-                self.dialog_history = data['dialog']
-                return True
-        return False
+        """Загружает предыдущий диалог (снапшот + хвост журнала) и продолжает его журнал"""
+        data = read_dialog(self.dialog_dir, session_id)
+        if data is None:
+            return False
+        self.session_id = session_id
+        self.requirements = data['requirements']
+        self.dialog_history = data['dialog']
+        self._saved_requirements = _plain(self.requirements)
+        return True
 
     def get_summary(self) -> Dict[str, Any]:
         """Возвращает краткое описание текущего состояния"""
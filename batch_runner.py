@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.append(str(ROOT))
+
+from core.crew_runner import get_tuning_profile, validate_result
+from core.async_runner import arun_crew, run_cancellable
+
+
+class BatchRunner:
+    """Прогоняет JSONL-файл задач через конвейер агентов пулом воркеров"""
+
+    def __init__(self, input_file, output_file, workers=None, task_timeout=900,
+                 pipeline="full", retry_failed=False):
+        self.input_file = Path(input_file)
+        self.output_file = Path(output_file)
+        # По умолчанию столько воркеров, сколько слотов у сервера Ollama (или сколько намерил бенчмарк)
+        self.workers = workers or int(
+            os.environ.get("OLLAMA_NUM_PARALLEL") or get_tuning_profile().get('ollama_num_parallel') or 4
+        )
+        self.task_timeout = task_timeout
+        self.pipeline = pipeline
+        self.retry_failed = retry_failed
+        self._write_lock = threading.Lock()
+
+    def load_tasks(self):
+        """Читает задачи: {"id": ..., "task": ..., "spec": ..., "pipeline": ...}"""
+        tasks = []
+        with open(self.input_file, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                item.setdefault('id', str(line_no))
+                item['id'] = str(item['id'])
+                tasks.append(item)
+        return tasks
+
+    def load_done(self):
+        """id задач, которые уже есть в выходном файле (для продолжения после перезапуска)"""
+        done = set()
+        if not self.output_file.exists():
+            return done
+        with open(self.output_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Недописанная строка после падения - задачу просто прогоним заново
+                    continue
+                if record.get('status') == 'ok' or not self.retry_failed:
+                    done.add(str(record.get('id')))
+        return done
+
+    def _write_record(self, record):
+        with self._write_lock:
+            with open(self.output_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run_task(self, item):
+        """Выполняет одну задачу с таймаутом и возвращает запись результата"""
+        timings = {}
+        outcome = {}
+
+        def on_event(event_type, data):
+            if event_type == "stage_end":
+                timings[data['stage']] = round(data['duration'], 2)
+
+        started = time.time()
+        try:
+            # Таймаут отменяет корутину и обрывает текущий запрос - слот Ollama сразу свободен
+            result = run_cancellable(
+                arun_crew(
+                    item['task'],
+                    item.get('spec'),
+                    on_event=on_event,
+                    pipeline=item.get('pipeline', self.pipeline),
+                ),
+                timeout=self.task_timeout,
+            )
+            outcome['result'] = result
+        except TimeoutError:
+            outcome['timeout'] = True
+        except (Exception, asyncio.CancelledError) as e:
+            outcome['error'] = str(e) or type(e).__name__
+
+        record = {
+            'id': item['id'],
+            'task': item['task'],
+            'duration': round(time.time() - started, 2),
+            'timings': timings,
+            'finished_at': datetime.now().isoformat(),
+        }
+
+        if outcome.get('timeout'):
+            record['status'] = 'timeout'
+            record['error'] = f"Превышен таймаут {self.task_timeout} сек"
+        elif 'error' in outcome:
+            record['status'] = 'error'
+            record['error'] = outcome['error']
+        else:
+            result_text = str(outcome.get('result'))
+            record['status'] = 'ok'
+            record['result'] = result_text
+            record['issues'] = validate_result(result_text, item['task'])
+
+        return record
+
+    def _process(self, item):
+        print(f"▶️ [{item['id']}] {item['task'][:60]}")
+        record = self.run_task(item)
+        self._write_record(record)
+        print(f"{'✅' if record['status'] == 'ok' else '❌'} [{item['id']}] {record['status']} "
+              f"за {record['duration']} сек")
+        return record
+
+    def run(self):
+        """Запускает все незавершённые задачи"""
+        tasks = self.load_tasks()
+        done = self.load_done()
+        pending = [item for item in tasks if item['id'] not in done]
+
+        print(f"📦 Задач: {len(tasks)}, уже выполнено: {len(tasks) - len(pending)}, "
+              f"в очереди: {len(pending)}, воркеров: {self.workers}")
+
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            records = list(executor.map(self._process, pending))
+
+        ok = sum(1 for r in records if r['status'] == 'ok')
+        print(f"\n✅ Готово: {ok}/{len(records)} успешно за {time.time() - started:.1f} сек")
+        print(f"📄 Результаты: {self.output_file}")
+        return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный запуск задач AI Office из JSONL")
+    parser.add_argument("input", help="JSONL с задачами")
+    parser.add_argument("-o", "--output", help="JSONL с результатами (по умолчанию <input>.results.jsonl)")
+    parser.add_argument("-w", "--workers", type=int, help="Размер пула (по умолчанию OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("-t", "--timeout", type=int, default=900, help="Таймаут одной задачи, сек")
+    parser.add_argument("--pipeline", choices=["full", "auto"], default="full", help="Режим конвейера")
+    parser.add_argument("--retry-failed", action="store_true", help="Перезапустить задачи с ошибкой/таймаутом")
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.input).with_suffix('.results.jsonl'))
+    runner = BatchRunner(args.input, output, args.workers, args.timeout, args.pipeline, args.retry_failed)
+    runner.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+import re
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from agents.project_manager import FORBIDDEN_TRIGGERS, analyze_response
+
+# Фрагменты для синтетических брифов (вставленные пользователем длинные ТЗ)
+BRIEF_FRAGMENTS = [
+    "Нужен одностраничный сайт для студии дизайна с тёмной темой и фиолетовыми акцентами.",
+    "Анимация должна быть медленной и плавной, частицы плывут за курсором, при наведении свечение.",
+    "Используй canvas и немного javascript, без jquery и без bootstrap, кроме tailwind ничего не подключай.",
+    "Стиль абстрактный, местами геометрический, переходы между секциями через черно-белый фильтр.",
+    "Примеры: https://example.com/portfolio и https://dribbble.com/shots/123, посмотри на них.",
+    "Запрещено использовать тяжёлые библиотеки, страница должна грузиться быстро даже на телефоне.",
+    "Цвета: чёрный фон, белый текст, серые разделители, немного синего и зелёного в иконках.",
+    "Потом хотим добавить парсер отзывов и бота для заявок, но это позже, сейчас только сайт.",
+]
+
+
+def make_brief(words: int, seed: int = 0) -> str:
+    """Синтетический бриф примерно из words слов"""
+    rng = random.Random(seed)
+    parts, count = [], 0
+    while count < words:
+        fragment = rng.choice(BRIEF_FRAGMENTS)
+        parts.append(fragment)
+        count += len(fragment.split())
+    return " ".join(parts)
+
+
+def empty_requirements() -> dict:
+    return {'project_type': 'unknown', 'technologies': [], 'forbidden': [], 'features': [], 'colors': [],
+            'examples': [], 'animation_speed': 'medium', 'mood': 'dark', 'style': 'abstract'}
+
+
+def legacy_analyze(response: str, requirements: dict) -> dict:
+    """Прежний ProjectManager._analyze_response_deep: отдельный проход на каждое ключевое слово"""
+    response_lower = response.lower()
+
+    # 1. Определяем тип проекта
+    type_keywords = {
+        'сайт': 'website',
+        'страниц': 'website',
+        'html': 'website',
+        'парс': 'parser',
+        'бот': 'bot',
+        'скрипт': 'script',
+        'утилит': 'utility',
+        'игр': 'game',
+        'анимац': 'animation'
+    }
+
+    for keyword, proj_type in type_keywords.items():
+        if keyword in response_lower:
+            requirements['project_type'] = proj_type
+            break
+
+    # 2. Определяем технологии
+    tech_keywords = {
+        'react': 'React',
+        'vue': 'Vue',
+        'angular': 'Angular',
+        'bootstrap': 'Bootstrap',
+        'tailwind': 'Tailwind',
+        'python': 'Python',
+        'javascript': 'JavaScript',
+        'js': 'JavaScript',
+        'jquery': 'jQuery',
+        'canvas': 'Canvas',
+        'gsap': 'GSAP',
+        'three': 'Three.js',
+        'webgl': 'WebGL'
+    }
+
+    for keyword, tech in tech_keywords.items():
+        if keyword in response_lower and tech not in requirements['technologies']:
+            requirements['technologies'].append(tech)
+
+    # 3. Определяем цвета
+    color_patterns = {
+        'черн': 'черный',
+        'бел': 'белый',
+        'сер': 'серый',
+        'темн': 'темный',
+        'светл': 'светлый',
+        'фиолет': 'фиолетовый',
+        'син': 'синий',
+        'голуб': 'голубой',
+        'красн': 'красный',
+        'зелен': 'зеленый',
+        'желт': 'желтый'
+    }
+
+    for pattern, color in color_patterns.items():
+        if pattern in response_lower and color not in requirements['colors']:
+            requirements['colors'].append(color)
+
+    # 4. Определяем скорость анимации
+    if 'медлен' in response_lower:
+        requirements['animation_speed'] = 'slow'
+    elif 'средн' in response_lower:
+        requirements['animation_speed'] = 'medium'
+    elif 'быстр' in response_lower:
+        requirements['animation_speed'] = 'fast'
+
+    # 5. Определяем стиль
+    style_keywords = {
+        'абстракт': 'abstract',
+        'геометрич': 'geometric',
+        'органическ': 'organic',
+        'минимал': 'minimal',
+        'футурист': 'futuristic',
+        'дарк': 'dark',
+        'фэнтези': 'fantasy',
+        'киберпанк': 'cyberpunk'
+    }
+
+    for keyword, style in style_keywords.items():
+        if keyword in response_lower:
+            requirements['style'] = style
+
+    # 6. Определяем настроение
+    if 'темн' in response_lower or 'дарк' in response_lower:
+        requirements['mood'] = 'dark'
+    elif 'светл' in response_lower:
+        requirements['mood'] = 'light'
+
+    # 7. Определяем эффекты
+    effect_keywords = [
+        'переход', 'негатив', 'черно-бел', 'grayscale',
+        'наведен', 'клик', 'пар', 'частиц', 'свечен'
+    ]
+
+    for effect in effect_keywords:
+        if effect in response_lower:
+            effect_name = effect.replace('черно-бел', 'черно-белый')
+            if effect_name not in requirements['features']:
+                requirements['features'].append(effect_name)
+
+    # 8. Определяем запреты
+    for word in FORBIDDEN_TRIGGERS:
+        if word in response_lower:
+            # Пытаемся понять что именно запрещено
+            words = response_lower.split()
+            for i, w in enumerate(words):
+                if word in w and i + 1 < len(words):
+                    forbidden_item = words[i + 1]
+                    if forbidden_item not in requirements['forbidden']:
+                        requirements['forbidden'].append(forbidden_item)
+
+    # 9. Извлекаем ссылки
+    urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+])+', response)
+    if urls:
+        requirements['examples'].extend(urls)
+
+    # 10. Анализируем длину ответа (для определения детализации)
+    word_count = len(response.split())
+    if word_count > 20:
+        requirements['detailed_response'] = True
+
+    # 11. Удаляем дубликаты
+    requirements['technologies'] = list(set(requirements['technologies']))
+    requirements['colors'] = list(set(requirements['colors']))
+    requirements['features'] = list(set(requirements['features']))
+    requirements['forbidden'] = list(set(requirements['forbidden']))
+    return requirements
+
+
+def _normalized(requirements: dict) -> dict:
+    return {key: sorted(value) if isinstance(value, list) else value for key, value in requirements.items()}
+
+
+def measure(analyze, text: str, runs: int) -> float:
+    """Медианное время одного анализа, мс"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        analyze(text, empty_requirements())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run_benchmark(sizes, runs: int) -> list:
+    rows = []
+    for words in sizes:
+        text = make_brief(words, seed=words)
+        legacy = legacy_analyze(text, empty_requirements())
+        compiled = analyze_response(text, empty_requirements())
+        if _normalized(legacy) != _normalized(compiled):
+            raise AssertionError(f"Результаты разошлись на брифе из {words} слов")
+        legacy_ms = measure(legacy_analyze, text, runs)
+        compiled_ms = measure(analyze_response, text, runs)
+        rows.append({
+            'words': words,
+            'chars': len(text),
+            'legacy_ms': round(legacy_ms, 3),
+            'compiled_ms': round(compiled_ms, 3),
+            'speedup': round(legacy_ms / compiled_ms, 2) if compiled_ms else None,
+        })
+    return rows
+
+
+def format_table(rows) -> str:
+    lines = [
+        "| Слов | Символов | Прежний, мс | Один проход, мс | Ускорение |",
+        "|------|----------|-------------|-----------------|-----------|",
+    ]
+    for row in rows:
+        lines.append(f"| {row['words']} | {row['chars']} | {row['legacy_ms']} | {row['compiled_ms']} | "
+                     f"x{row['speedup']} |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Анализ ответа менеджером: поиск по словам против одного прохода")
+    parser.add_argument("--sizes", default="20,200,2000,20000", help="Размеры брифов в словах через запятую")
+    parser.add_argument("--runs", type=int, default=20, help="Повторов на размер")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    print(format_table(run_benchmark(sizes, args.runs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_HTML = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <title>Кофейня</title>
+    <style>
+        body { background-color: #121212; color: #eee; font-family: sans-serif; }
+        h1 { animation: glow 2s infinite alternate; }
+        @keyframes glow { from { opacity: 0.6; } to { opacity: 1; } }
+    </style>
+</head>
+<body>
+    <h1>Кофейня</h1>
+    <p>Лучший кофе в городе.</p>
+    <script>document.querySelector('h1').title = 'hello';</script>
+</body>
+</html>"""
+
+# Ответы по ролям агентов (маркер ищется в промпте); остальное - DEFAULT_OUTPUT
+CANNED_OUTPUTS = {
+    "You are Translator.": "Техническое задание: одностраничный сайт с тёмной темой, анимацией заголовка, "
+                           "адаптивной вёрсткой и блоком контактов.",
+    "You are Planner.": "1. Структура HTML\n2. Стили тёмной темы\n3. Анимация заголовка\n4. Проверка вёрстки",
+    "You are Developer.": f"```html\n{CANNED_HTML}\n```",
+    "You are Reviewer.": f"```html\n{CANNED_HTML}\n```",
+}
+DEFAULT_OUTPUT = "OK"
+
+
+class MockLLMServer:
+    """Заглушка Ollama для бенчмарков без модели.
+
+    OpenAI-совместимые /v1/chat/completions (обычный и SSE-поток) и /v1/models,
+    а также /api/generate и /api/tags. latency - задержка до первого токена, сек;
+    tokens_per_sec - скорость выдачи; max_parallel - слотов генерации (как OLLAMA_NUM_PARALLEL),
+    лишние запросы ждут в очереди. Ответы выбираются по роли агента в промпте.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, tokens_per_sec=50.0, max_parallel=None,
+                 outputs=None, model="mock"):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.outputs = outputs or CANNED_OUTPUTS
+        self.model = model
+        self._slots = threading.BoundedSemaphore(max_parallel) if max_parallel else None
+        self._lock = threading.Lock()
+        self.requests = []
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        """Адрес для OPENAI_API_BASE"""
+        return f"{self.url}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def reset(self):
+        """Возвращает и очищает журнал запросов"""
+        with self._lock:
+            requests, self.requests = self.requests, []
+        return requests
+
+    def pick_output(self, prompt: str, crewai: bool) -> str:
+        text = next((out for role, out in self.outputs.items() if role in prompt), DEFAULT_OUTPUT)
+        if crewai:
+            # Формат ReAct, который ожидает парсер CrewAI
+            text = f"Thought: I now can give a great answer\nFinal Answer: {text}"
+        return text
+
+    def tokens(self, text: str, max_tokens: int = None):
+        """Режет ответ на «токены» по ~4 символа"""
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        return pieces[:max_tokens] if max_tokens else pieces
+
+    def generate(self, prompt: str, max_tokens: int = None, on_token=None):
+        """Имитирует генерацию: ждёт слот, выдерживает latency и скорость; возвращает (токены, тайминги)"""
+        queued = time.perf_counter()
+        if self._slots:
+            self._slots.acquire()
+        try:
+            started = time.perf_counter()
+            time.sleep(self.latency)
+            pieces = self.tokens(self.pick_output(prompt, "Final Answer:" in prompt), max_tokens)
+            first_token = None
+            for piece in pieces:
+                if self.tokens_per_sec:
+                    time.sleep(1.0 / self.tokens_per_sec)
+                if first_token is None:
+                    first_token = time.perf_counter()
+                if on_token:
+                    on_token(piece)
+            finished = time.perf_counter()
+        finally:
+            if self._slots:
+                self._slots.release()
+
+        timings = {
+            'queue_sec': started - queued,
+            'ttft_sec': (first_token or finished) - queued,
+            'service_sec': finished - queued,
+            'prompt_tokens': len(prompt) // 4,
+            'completion_tokens': len(pieces),
+        }
+        with self._lock:
+            self.requests.append(timings)
+        return pieces, timings
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, data, status=200):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _start_stream(self, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+            def _chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.startswith("/api/tags"):
+                    self._json({'models': [{'name': server.model, 'model': server.model, 'digest': "mock"}]})
+                elif self.path.startswith("/v1/models"):
+                    self._json({'object': 'list', 'data': [{'id': server.model, 'object': 'model'}]})
+                else:
+                    self._json({'error': 'not found'}, 404)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                if self.path.startswith("/v1/chat/completions"):
+                    self._chat(body)
+                elif self.path.startswith("/api/generate"):
+                    self._generate(body)
+                else:
+                    self._json({'error': 'not found'}, 404)
+
+            def _chat(self, body):
+                prompt = "\n".join(str(m.get('content') or "") for m in body.get('messages') or [])
+                model = body.get('model', server.model)
+
+                if not body.get('stream'):
+                    pieces, timings = server.generate(prompt, body.get('max_tokens'))
+                    self._json({
+                        'id': 'chatcmpl-mock', 'object': 'chat.completion', 'model': model,
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': "".join(pieces)},
+                                     'finish_reason': 'stop'}],
+                        'usage': {'prompt_tokens': timings['prompt_tokens'],
+                                  'completion_tokens': timings['completion_tokens'],
+                                  'total_tokens': timings['prompt_tokens'] + timings['completion_tokens']},
+                    })
+                    return
+
+                self._start_stream('text/event-stream')
+
+                def send(data):
+                    self._chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+                def on_token(piece):
+                    send({'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'model': model,
+                          'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+
+                _, timings = server.generate(prompt, body.get('max_tokens'), on_token)
+                final = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'model': model,
+                         'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+                if (body.get('stream_options') or {}).get('include_usage'):
+                    final['usage'] = {'prompt_tokens': timings['prompt_tokens'],
+                                      'completion_tokens': timings['completion_tokens']}
+                send(final)
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+            def _generate(self, body):
+                options = body.get('options') or {}
+                model = body.get('model', server.model)
+                stream = body.get('stream', True)
+
+                def ollama_stats(timings):
+                    ns = 1_000_000_000
+                    return {
+                        'done': True,
+                        'total_duration': int(timings['service_sec'] * ns),
+                        'load_duration': 0,
+                        'prompt_eval_count': timings['prompt_tokens'],
+                        'prompt_eval_duration': int(server.latency * ns),
+                        'eval_count': timings['completion_tokens'],
+                        'eval_duration': int((timings['service_sec'] - timings['ttft_sec']) * ns),
+                    }
+
+                if not stream:
+                    pieces, timings = server.generate(body.get('prompt', ""), options.get('num_predict'))
+                    self._json({'model': model, 'response': "".join(pieces), **ollama_stats(timings)})
+                    return
+
+                self._start_stream('application/x-ndjson')
+
+                def on_token(piece):
+                    line = json.dumps({'model': model, 'response': piece, 'done': False}, ensure_ascii=False)
+                    self._chunk((line + "\n").encode('utf-8'))
+
+                _, timings = server.generate(body.get('prompt', ""), options.get('num_predict'), on_token)
+                self._chunk((json.dumps({'model': model, 'response': "", **ollama_stats(timings)}) + "\n").encode())
+                self._chunk(b"")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Ollama/OpenAI API для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка до первого токена, сек")
+    parser.add_argument("--tps", type=float, default=50.0, help="Скорость выдачи, токен/сек")
+    parser.add_argument("--parallel", type=int, help="Слотов генерации (по умолчанию без ограничения)")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.latency, args.tps, args.parallel)
+    print(f"🧪 Заглушка LLM: OPENAI_API_BASE={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from core import crew_runner
+from core.async_runner import arun_crew, run_cancellable
+from bench.mock_llm import MockLLMServer
+
+SAMPLE_TASKS = [
+    "Создай сайт-визитку кофейни с тёмной темой и анимацией заголовка",
+    "Сделай страницу портфолио фотографа с тёмным фоном",
+    "Нужен лендинг для курса по Python с анимацией кнопок",
+    "Создай HTML страницу с таймером обратного отсчёта",
+]
+
+
+def run_one(task, executor, use_cache=False):
+    """Один прогон конвейера; возвращает время задачи и длительности этапов"""
+    stages = {}
+
+    def on_event(event_type, data):
+        if event_type == "stage_end":
+            stages[data['stage']] = data['duration']
+
+    started = time.perf_counter()
+    if executor == "async":
+        run_cancellable(arun_crew(task, on_event=on_event, use_cache=use_cache))
+    else:
+        crew_runner.run_crew(task, on_event=on_event, use_cache=use_cache)
+    return {'wall_sec': time.perf_counter() - started, 'stages': stages}
+
+
+def run_level(concurrency, task_count, executor, mock):
+    """Прогон task_count задач пулом из concurrency воркеров"""
+    tasks = [SAMPLE_TASKS[i % len(SAMPLE_TASKS)] for i in range(task_count)]
+    mock.reset()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        runs = list(pool.map(lambda task: run_one(task, executor), tasks))
+    elapsed = time.perf_counter() - started
+    llm_requests = mock.reset()
+
+    stage_names = [stage for stage in crew_runner.PIPELINE_STAGES if any(stage in r['stages'] for r in runs)]
+    stage_sec = [sum(r['stages'].values()) for r in runs]
+    llm_sec = sum(req['service_sec'] for req in llm_requests) / len(runs)
+
+    return {
+        'concurrency': concurrency,
+        'tasks': len(runs),
+        'elapsed_sec': round(elapsed, 3),
+        'tasks_per_min': round(len(runs) / elapsed * 60, 2),
+        'task_wall_sec': round(statistics.mean(r['wall_sec'] for r in runs), 3),
+        'stage_wall_sec': {
+            stage: round(statistics.mean(r['stages'][stage] for r in runs if stage in r['stages']), 3)
+            for stage in stage_names
+        },
+        'llm_requests': len(llm_requests),
+        'llm_sec': round(llm_sec, 3),
+        'llm_queue_sec': round(sum(req['queue_sec'] for req in llm_requests) / len(runs), 3),
+        # Обвязка этапов (CrewAI/клиент, кэш, события) сверх времени генерации
+        'stage_overhead_sec': round(statistics.mean(stage_sec) - llm_sec, 3),
+        # Всё вне этапов: отчёт, сохранение артефактов, проверка, превью, копирование проекта
+        'pipeline_overhead_sec': round(statistics.mean(r['wall_sec'] - s for r, s in zip(runs, stage_sec)), 3),
+    }
+
+
+def run_suite(levels, tasks_per_level, executors, latency, tokens_per_sec, max_parallel, verbose=False):
+    """Полный прогон: для каждого исполнителя и уровня параллелизма"""
+    results = {}
+    with MockLLMServer(latency=latency, tokens_per_sec=tokens_per_sec, max_parallel=max_parallel) as mock, \
+            tempfile.TemporaryDirectory(prefix="ai_office_bench_") as workspace:
+        # Конвейер пишет в отдельную временную папку и ходит в заглушку вместо Ollama
+        os.environ["OPENAI_API_BASE"] = mock.base_url
+        crew_runner.TEMP_PATH = Path(workspace) / "temp"
+        crew_runner.PROJECTS_PATH = Path(workspace) / "projects"
+
+        for executor in executors:
+            if executor != "async":
+                crew_runner.STAGE_EXECUTOR = executor
+            results[executor] = []
+            for concurrency in levels:
+                print(f"🔄 {executor}: параллельно {concurrency}...")
+                output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                with output:
+                    level = run_level(concurrency, tasks_per_level or max(4, concurrency * 2), executor, mock)
+                results[executor].append(level)
+                print(f"   {level['tasks_per_min']} задач/мин, задача {level['task_wall_sec']} сек")
+    return results
+
+
+def format_table(results):
+    lines = [
+        "| Исполнитель | Параллельно | Задач/мин | Задача, сек | LLM, сек | Очередь LLM, сек | "
+        "Обвязка этапов, сек | Вне этапов, сек |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for executor, levels in results.items():
+        for level in levels:
+            lines.append(f"| {executor} | {level['concurrency']} | {level['tasks_per_min']} | "
+                         f"{level['task_wall_sec']} | {level['llm_sec']} | {level['llm_queue_sec']} | "
+                         f"{level['stage_overhead_sec']} | {level['pipeline_overhead_sec']} |")
+
+    lines += ["", "| Исполнитель | Параллельно | " + " | ".join(crew_runner.PIPELINE_STAGES) + " |",
+              "|---|---|" + "---|" * len(crew_runner.PIPELINE_STAGES)]
+    for executor, levels in results.items():
+        for level in levels:
+            stages = [str(level['stage_wall_sec'].get(stage, "—")) for stage in crew_runner.PIPELINE_STAGES]
+            lines.append(f"| {executor} | {level['concurrency']} | " + " | ".join(stages) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера AI Office на заглушке LLM")
+    parser.add_argument("--levels", default="1,2,4", help="Уровни параллелизма через запятую")
+    parser.add_argument("--tasks", type=int, help="Задач на уровень (по умолчанию max(4, 2×параллельно))")
+    parser.add_argument("--executors", default="direct,async", help="direct, crew, async через запятую")
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка заглушки до первого токена, сек")
+    parser.add_argument("--tps", type=float, default=200.0, help="Скорость заглушки, токен/сек")
+    parser.add_argument("--parallel", type=int, help="Слотов генерации заглушки (как OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--verbose", action="store_true", help="Показывать лог конвейера")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",")]
+    executors = [executor.strip() for executor in args.executors.split(",") if executor.strip()]
+    results = run_suite(levels, args.tasks, executors, args.latency, args.tps, args.parallel, args.verbose)
+
+    print("\n" + format_table(results))
+
+    filename = f"benchmark_pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'mock': {'latency': args.latency, 'tokens_per_sec': args.tps, 'max_parallel': args.parallel},
+            'results': results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"📄 Результаты: {filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+class RecordingProxy:
+    """Прозрачный прокси перед OpenAI-совместимым API: считает запросы, размер промптов,
+    токены из usage и время ответа апстрима.
+
+    Клиент обращается к proxy.base_url (.../v1) вместо OPENAI_API_BASE.
+    """
+
+    def __init__(self, upstream: str, timeout: float = 300.0):
+        self.upstream = upstream.rstrip("/")
+        self.calls = []
+        self._lock = threading.Lock()
+        self._client = httpx.Client(timeout=httpx.Timeout(timeout, connect=10.0))
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._client.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        with self._lock:
+            calls, self.calls = self.calls, []
+        return calls
+
+    def _record(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def _handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                messages = body.get('messages') or []
+                streaming = bool(body.get('stream'))
+                if streaming:
+                    # Просим usage в последнем чанке потока, иначе токены промпта не узнать
+                    body.setdefault('stream_options', {'include_usage': True})
+
+                call = {
+                    'path': self.path,
+                    'stream': streaming,
+                    'messages': len(messages),
+                    'prompt_chars': sum(len(str(m.get('content') or "")) for m in messages),
+                    'prompt_tokens': None,
+                    'completion_tokens': None,
+                }
+                path = self.path[3:] if self.path.startswith("/v1") else self.path
+                started = time.perf_counter()
+
+                with proxy._client.stream("POST", proxy.upstream + path, json=body,
+                                          headers={'Authorization': self.headers.get('Authorization', '')}) as response:
+                    self.send_response(response.status_code)
+                    self.send_header('Content-Type', response.headers.get('Content-Type', 'application/json'))
+                    self.end_headers()
+
+                    data = b""
+                    for chunk in response.iter_bytes():
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                        data += chunk
+
+                call['upstream_sec'] = time.perf_counter() - started
+                call.update(_usage(data, streaming))
+                proxy._record(call)
+
+        return Handler
+
+
+def _usage(data: bytes, streaming: bool) -> dict:
+    """prompt_tokens/completion_tokens из ответа (обычного или SSE)"""
+    text = data.decode('utf-8', errors='replace')
+    chunks = [line[5:].strip() for line in text.splitlines() if line.startswith("data:")] if streaming else [text]
+    for chunk in reversed(chunks):
+        try:
+            usage = json.loads(chunk).get('usage')
+        except (ValueError, AttributeError):
+            continue
+        if usage:
+            return {
+                'prompt_tokens': usage.get('prompt_tokens'),
+                'completion_tokens': usage.get('completion_tokens'),
+            }
+    return {}
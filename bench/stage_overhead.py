@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from core.crew_runner import AGENT_SPECS, _run_stage, build_stage_task, create_agent, stage_prompt
+from bench.mock_llm import MockLLMServer
+from bench.recording_proxy import RecordingProxy
+
+SAMPLE_TASK = "Создай одностраничный сайт-визитку кофейни с тёмной темой и анимацией заголовка"
+
+
+def _prompt_tokens(call):
+    """Токены промпта из usage, иначе оценка ~4 символа на токен"""
+    if call.get('prompt_tokens') is not None:
+        return call['prompt_tokens']
+    return call['prompt_chars'] // 4
+
+
+def measure_stage(stage, executor, proxy, runs, max_tokens):
+    """Прогоняет этап runs раз выбранным исполнителем (без кэша) и собирает замеры"""
+    agent = create_agent(*AGENT_SPECS[stage], max_tokens=max_tokens)
+    task = build_stage_task(stage, agent, stage_prompt(stage, SAMPLE_TASK))
+
+    samples = []
+    for _ in range(runs):
+        proxy.reset()
+        started = time.perf_counter()
+        _run_stage(stage, agent, task, use_cache=False, executor=executor)
+        wall = time.perf_counter() - started
+        calls = proxy.reset()
+
+        upstream = sum(call['upstream_sec'] for call in calls)
+        samples.append({
+            'wall_sec': wall,
+            'llm_calls': len(calls),
+            'prompt_tokens': sum(_prompt_tokens(call) for call in calls),
+            'completion_tokens': sum(call.get('completion_tokens') or 0 for call in calls),
+            'upstream_sec': upstream,
+            'python_sec': wall - upstream,
+        })
+
+    return {key: round(statistics.mean(s[key] for s in samples), 3) for key in samples[0]}
+
+
+def run_benchmark(stages, runs, max_tokens, upstream):
+    """Сравнивает CrewAI и прямой запрос к Ollama по каждому этапу"""
+    results = {}
+    with RecordingProxy(upstream) as proxy:
+        # create_agent и клиент быстрого пути берут адрес API из окружения
+        os.environ["OPENAI_API_BASE"] = proxy.base_url
+        for stage in stages:
+            print(f"🔄 {stage}...")
+            crew = measure_stage(stage, "crew", proxy, runs, max_tokens)
+            direct = measure_stage(stage, "direct", proxy, runs, max_tokens)
+            results[stage] = {
+                'crew': crew,
+                'direct': direct,
+                'removed': {key: round(crew[key] - direct[key], 3) for key in crew},
+            }
+    os.environ["OPENAI_API_BASE"] = upstream
+    return results
+
+
+def format_table(results):
+    lines = [
+        "| Этап | Исполнитель | Вызовов LLM | Токены промпта | Токены ответа | Всего, сек | LLM, сек | Python, сек |",
+        "|------|-------------|-------------|----------------|---------------|------------|----------|-------------|",
+    ]
+    for stage, data in results.items():
+        for executor in ("crew", "direct", "removed"):
+            row = data[executor]
+            lines.append(f"| {stage} | {executor} | {row['llm_calls']} | {row['prompt_tokens']} | "
+                         f"{row['completion_tokens']} | {row['wall_sec']:.2f} | {row['upstream_sec']:.2f} | "
+                         f"{row['python_sec']:.3f} |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Накладные расходы CrewAI на этап против прямого запроса к Ollama")
+    parser.add_argument("--stages", default="translator,planner", help="Этапы через запятую")
+    parser.add_argument("--runs", type=int, default=3, help="Повторов на этап и исполнителя")
+    parser.add_argument("--max-tokens", type=int, default=200, help="Лимит токенов ответа")
+    parser.add_argument("--upstream", default=os.environ["OPENAI_API_BASE"], help="Адрес OpenAI-совместимого API")
+    parser.add_argument("--mock", action="store_true", help="Вместо Ollama - локальная заглушка bench.mock_llm")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    if args.mock:
+        with MockLLMServer() as mock:
+            results = run_benchmark(stages, args.runs, args.max_tokens, mock.base_url)
+    else:
+        results = run_benchmark(stages, args.runs, args.max_tokens, args.upstream)
+
+    table = format_table(results)
+    print("\n" + table)
+
+    filename = f"benchmark_stage_overhead_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'model': os.environ.get("OPENAI_MODEL_NAME"),
+            'runs': args.runs,
+            'max_tokens': args.max_tokens,
+            'stages': results,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"📄 Результаты: {filename}")
+
+
+if __name__ == "__main__":
+    main()
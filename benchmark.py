@@ -1,14 +1,142 @@
 import os
 import time
 import json
+import uuid
+import argparse
 import subprocess
 import platform
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import requests
 import psutil
 import cpuinfo
 
+from benchmark_history import BenchmarkHistory, compare_with_reference, machine_fingerprint
+
+# Фиксированный набор промптов для замеров параллельной работы
+PARALLEL_PROMPTS = [
+    "Write a Python function to calculate factorial",
+    "Explain what is AI in one sentence",
+    "Write an HTML page with a centered heading",
+    "List three CSS properties for a dark theme",
+]
+
+
+# Сколько раз повторять каждый тестовый промпт: история сравнивает запуски по разбросу повторов
+BENCHMARK_REPEATS = 5
+
+# Размеры промптов (в токенах) для замера масштабирования по длине контекста
+PROMPT_SCALING_SIZES = [256, 1024, 2048, 4096]
+# Запас окна контекста над целевой длиной: оценка ~4 символа на токен неточна
+PROMPT_SCALING_CTX_MARGIN = 1.25
+
+# Откуда брать реальные тексты этапов (plan_*.md, developer_code_*.py, review_*.md)
+WORKSPACE_PATH = Path(__file__).resolve().parent / "workspace"
+
+# Заполнитель синтетических промптов - типичный план этапа planner
+SYNTHETIC_PLAN = """1. Create a single HTML file with <!DOCTYPE html>, <head> and <body>.
+2. Add a <style> block: dark theme (background-color: #121212, color: #eeeeee), responsive layout with flexbox.
+3. Header section with animated title: @keyframes glow, animation: glow 2s infinite alternate.
+4. Main section with three cards: each card has an icon, a title and a short description.
+5. Contact form: name, email, message fields, submit button with hover transition.
+6. Footer with copyright and social links.
+7. JavaScript: validate the form before submit, show an alert on success.
+8. No frameworks, no external libraries, all code in one file.
+"""
+
+
+# Профиль настроек для run_crew (читает core/crew_runner.py)
+TUNING_PROFILE_PATH = WORKSPACE_PATH / "tuning_profile.json"
+
+# Потолок токенов ответа по этапам и лимит времени тяжёлых этапов (как STAGE_TIMEOUTS в crew_runner)
+STAGE_TOKEN_CEILING = {"translator": 512, "planner": 1024, "developer": 2000, "reviewer": 2000}
+STAGE_TIME_BUDGET_SEC = {"translator": 60, "planner": 90, "developer": 180, "reviewer": 120}
+
+# Минимум токенов, который модель тяжёлого этапа должна успеть выдать за его лимит времени
+MIN_CODE_TOKENS = 1000
+
+
+class OllamaProcessSampler:
+    """Фоновый поток, который с заданным интервалом снимает RSS и CPU% процессов Ollama
+    (сервер и раннеры моделей) - в отличие от virtual_memory() не зависит от других программ.
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.samples = []
+        self._processes = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _is_ollama(proc):
+        name = (proc.info.get('name') or "").lower()
+        cmdline = " ".join(proc.info.get('cmdline') or []).lower()
+        return "ollama" in name or "ollama" in cmdline.split(" ", 1)[0]
+
+    def _refresh(self):
+        """Раннеры стартуют при загрузке модели, поэтому список процессов обновляется на каждом шаге"""
+        alive = {}
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                if self._is_ollama(proc):
+                    alive[proc.pid] = self._processes.get(proc.pid) or proc
+                    if proc.pid not in self._processes:
+                        proc.cpu_percent(None)  # первый вызов только запоминает точку отсчёта
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self._processes = alive
+
+    def sample(self):
+        self._refresh()
+        rss, cpu = 0, 0.0
+        for proc in list(self._processes.values()):
+            try:
+                rss += proc.memory_info().rss
+                cpu += proc.cpu_percent(None)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self.samples.append({'rss_gb': rss / (1024 ** 3), 'cpu_percent': cpu})
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._refresh()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.sample()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def summary(self):
+        """Пик и среднее RSS/CPU за время замера"""
+        if not self.samples:
+            return {}
+        rss = [s['rss_gb'] for s in self.samples]
+        cpu = [s['cpu_percent'] for s in self.samples]
+        return {
+            'peak_rss_gb': round(max(rss), 3),
+            'mean_rss_gb': round(sum(rss) / len(rss), 3),
+            'peak_cpu_percent': round(max(cpu), 1),
+            'mean_cpu_percent': round(sum(cpu) / len(cpu), 1),
+        }
+
 
 class SystemBenchmark:
     def __init__(self):
@@ -77,7 +205,9 @@ class SystemBenchmark:
                 self.results['ollama'] = {
                     'running': True,
                     'ping_ms': round(ping_time * 1000, 2),
+                    'version': self.get_ollama_version(),
                     'models_installed': [m.get('name') for m in models],
+                    'model_digests': {m.get('name'): m.get('digest') for m in models},
                     'models_count': len(models)
                 }
                 print(f"✅ Ollama запущена (пинг: {self.results['ollama']['ping_ms']} мс)")
@@ -91,8 +221,160 @@ class SystemBenchmark:
             print("❌ Ollama не запущена")
             return False
 
-    def benchmark_model(self, model_name, test_prompts):
-        """Тестирует производительность модели"""
+    def unload_model(self, model_name):
+        """Выгружает модель из памяти Ollama (keep_alive=0), чтобы следующий запрос был холодным"""
+        try:
+            requests.post(
+                "http://localhost:11434/api/generate",
+                json={"model": model_name, "keep_alive": 0},
+                timeout=30
+            )
+        except Exception:
+            pass
+
+    def _stream_generate(self, model_name, prompt, num_predict=100, timeout=300, num_ctx=None):
+        """Потоковый запрос /api/generate: время до первого токена и разбивка по этапам Ollama.
+
+        load - загрузка модели, prefill - обработка промпта (prompt_eval_*), decode - генерация (eval_*).
+        num_ctx - окно контекста; без него Ollama берёт своё по умолчанию и молча обрезает длинный промпт.
+        """
+        start = time.time()
+        ttft = None
+        final = {}
+        options = {"num_predict": num_predict, "temperature": 0.1}
+        if num_ctx:
+            options["num_ctx"] = num_ctx
+        with requests.post(
+            "http://localhost:11434/api/generate",
+            json={
+                "model": model_name,
+                "prompt": prompt,
+                "stream": True,
+                "options": options
+            },
+            stream=True,
+            timeout=timeout
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if ttft is None and chunk.get('response'):
+                    ttft = time.time() - start
+                if chunk.get('done'):
+                    final = chunk
+                    break
+        elapsed = time.time() - start
+
+        ns = 1_000_000_000
+        prefill_tokens = final.get('prompt_eval_count', 0)
+        prefill_sec = final.get('prompt_eval_duration', 0) / ns
+        decode_tokens = final.get('eval_count', 0)
+        decode_sec = final.get('eval_duration', 0) / ns
+        return {
+            'time_sec': round(elapsed, 3),
+            'ttft_sec': round(ttft if ttft is not None else elapsed, 3),
+            'load_sec': round(final.get('load_duration', 0) / ns, 3),
+            'prefill_tokens': prefill_tokens,
+            'prefill_sec': round(prefill_sec, 3),
+            'prefill_tokens_per_sec': round(prefill_tokens / prefill_sec, 2) if prefill_sec > 0 else 0,
+            'decode_tokens': decode_tokens,
+            'decode_sec': round(decode_sec, 3),
+            'decode_tokens_per_sec': round(decode_tokens / decode_sec, 2) if decode_sec > 0 else 0,
+        }
+
+    def benchmark_model_streaming(self, model_name, test_prompts, repeats=1):
+        """Потоковый замер: TTFT и раздельные скорости prefill/decode, холодный старт отдельно от тёплых.
+
+        Каждый промпт прогоняется repeats раз - по повторам видно шум замера для истории.
+        """
+        print(f"\n🔄 Потоковое тестирование модели {model_name}...")
+
+        results = {
+            'model': model_name,
+            'streaming': True,
+            'cold': None,
+            'tests': [],
+            'warm': {},
+            'avg_time': 0,
+            'avg_tokens_per_sec': 0,
+        }
+
+        # Холодный старт: модель выгружена, в замер попадает загрузка
+        self.unload_model(model_name)
+        try:
+            with OllamaProcessSampler() as sampler:
+                results['cold'] = self._stream_generate(model_name, test_prompts[0])
+            results['cold'].update(sampler.summary())
+            cold = results['cold']
+            print(f"  ❄️ Холодный старт: TTFT {cold['ttft_sec']} сек (загрузка {cold['load_sec']} сек)")
+        except Exception as e:
+            print(f"    ❌ Ошибка: {e}")
+            results['cold'] = {'error': str(e)}
+
+        for i, prompt in enumerate(test_prompts, 1):
+            for repeat in range(repeats):
+                print(f"  Тест {i}/{len(test_prompts)}, повтор {repeat + 1}/{repeats}...")
+                try:
+                    with OllamaProcessSampler() as sampler:
+                        test_result = self._stream_generate(model_name, prompt)
+                    test_result.update(sampler.summary())
+                    test_result['prompt'] = prompt[:50] + "..."
+                    test_result['repeat'] = repeat
+                    results['tests'].append(test_result)
+                    print(f"    ✅ TTFT {test_result['ttft_sec']} сек, prefill {test_result['prefill_tokens_per_sec']} "
+                          f"токен/сек, decode {test_result['decode_tokens_per_sec']} токен/сек")
+                except Exception as e:
+                    print(f"    ❌ Ошибка: {e}")
+                    results['tests'].append({'prompt': prompt[:50], 'repeat': repeat, 'error': str(e)})
+
+        warm = [t for t in results['tests'] if 'error' not in t]
+        if warm:
+            def avg(key):
+                return round(sum(t[key] for t in warm) / len(warm), 3)
+
+            results['warm'] = {
+                'ttft_sec': avg('ttft_sec'),
+                'load_sec': avg('load_sec'),
+                'prefill_tokens_per_sec': avg('prefill_tokens_per_sec'),
+                'decode_tokens_per_sec': avg('decode_tokens_per_sec'),
+            }
+            results['avg_time'] = avg('time_sec')
+            results['avg_tokens_per_sec'] = results['warm']['decode_tokens_per_sec']
+
+        results['memory'] = self._process_footprint(results['tests'] + [results['cold'] or {}])
+        return results
+
+    @staticmethod
+    def _process_footprint(tests):
+        """Пик и среднее памяти/CPU процессов Ollama по всем тестам модели"""
+        measured = [t for t in tests if 'peak_rss_gb' in t]
+        if not measured:
+            return {}
+        return {
+            'peak_rss_gb': max(t['peak_rss_gb'] for t in measured),
+            'mean_rss_gb': round(sum(t['mean_rss_gb'] for t in measured) / len(measured), 3),
+            'peak_cpu_percent': max(t['peak_cpu_percent'] for t in measured),
+            'mean_cpu_percent': round(sum(t['mean_cpu_percent'] for t in measured) / len(measured), 1),
+        }
+
+    @staticmethod
+    def get_ollama_version():
+        """Версия сервера Ollama (/api/version)"""
+        try:
+            return requests.get("http://localhost:11434/api/version", timeout=5).json().get('version')
+        except Exception:
+            return None
+
+    def benchmark_model(self, model_name, test_prompts, stream=False):
+        """Тестирует производительность модели (stream=True - с TTFT и разбивкой prefill/decode).
+
+        Повторы промптов (repeats) - только у benchmark_model_streaming.
+        """
+        if stream:
+            return self.benchmark_model_streaming(model_name, test_prompts)
+
         print(f"\n🔄 Тестирование модели {model_name}...")
 
         results = {
@@ -100,7 +382,7 @@ class SystemBenchmark:
             'tests': [],
             'avg_time': 0,
             'avg_tokens_per_sec': 0,
-            'memory_usage': []
+            'memory': {}
         }
 
         total_time = 0
@@ -109,8 +391,7 @@ class SystemBenchmark:
         for i, prompt in enumerate(test_prompts, 1):
             print(f"  Тест {i}/{len(test_prompts)}...")
 
-            mem_before = psutil.virtual_memory().used / (1024 ** 3)
-
+            sampler = OllamaProcessSampler().start()
             start = time.time()
             try:
                 response = requests.post(
@@ -128,20 +409,19 @@ class SystemBenchmark:
                 )
 
                 elapsed = time.time() - start
+                sampler.stop()
 
                 if response.status_code == 200:
                     result = response.json()
                     tokens = result.get('eval_count', 0)
                     tokens_per_sec = tokens / elapsed if elapsed > 0 else 0
 
-                    mem_after = psutil.virtual_memory().used / (1024 ** 3)
-
                     test_result = {
                         'prompt': prompt[:50] + "...",
                         'time_sec': round(elapsed, 2),
                         'tokens': tokens,
                         'tokens_per_sec': round(tokens_per_sec, 2),
-                        'memory_delta_gb': round(mem_after - mem_before, 2)
+                        **sampler.summary()
                     }
 
                     results['tests'].append(test_result)
@@ -151,6 +431,7 @@ class SystemBenchmark:
                     print(f"    ✅ {elapsed:.1f} сек, {tokens_per_sec:.1f} токен/сек")
 
             except Exception as e:
+                sampler.stop()
                 print(f"    ❌ Ошибка: {e}")
                 results['tests'].append({
                     'prompt': prompt[:50],
@@ -162,76 +443,240 @@ class SystemBenchmark:
             if total_tokens > 0:
                 results['avg_tokens_per_sec'] = round(total_tokens / total_time, 2)
 
+        results['memory'] = self._process_footprint(results['tests'])
         return results
 
-    def test_parallel_performance(self, model_name):
-        """Тестирует производительность при параллельных запросах"""
-        print(f"\n🔄 Тестирование параллельной работы ({model_name})...")
-
-        results = {
-            'parallel_1': 0,
-            'parallel_2': 0,
-            'parallel_4': 0,
-            'recommended': 1
-        }
-
+    @staticmethod
+    def _percentile(values, pct):
+        """Перцентиль по методу ближайшего ранга"""
+        if not values:
+            return 0
+        ordered = sorted(values)
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def _timed_generate(self, model_name, prompt, num_predict=64, timeout=300):
+        """Один запрос /api/generate: задержка и число сгенерированных токенов"""
         start = time.time()
         try:
-            requests.post(
+            response = requests.post(
                 "http://localhost:11434/api/generate",
                 json={
                     "model": model_name,
-                    "prompt": "Say 'test'",
-                    "stream": False
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": {
+                        "num_predict": num_predict,
+                        "temperature": 0.1
+                    }
                 },
-                timeout=30
+                timeout=timeout
             )
-            results['parallel_1'] = time.time() - start
-        except:
-            results['parallel_1'] = 999
+            ok = response.status_code == 200
+            tokens = response.json().get('eval_count', 0) if ok else 0
+        except Exception:
+            ok, tokens = False, 0
+        return {'latency': time.time() - start, 'tokens': tokens, 'ok': ok}
+
+    @staticmethod
+    def get_server_num_parallel():
+        """OLLAMA_NUM_PARALLEL запущенного сервера: (значение или None, откуда взято).
+
+        API его не отдаёт - читаем окружение процесса «ollama serve» (на этой машине и при наличии прав).
+        """
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                if not OllamaProcessSampler._is_ollama(proc) or "serve" not in (proc.info.get('cmdline') or []):
+                    continue
+                value = proc.environ().get('OLLAMA_NUM_PARALLEL')
+                if value:
+                    return int(value), f"окружение ollama serve (pid {proc.pid})"
+                return None, "ollama serve без OLLAMA_NUM_PARALLEL - значение сервера по умолчанию (1 или 4)"
+            except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+                continue
+        return None, "не удалось определить (сервер на другой машине или нет доступа к процессу)"
+
+    def test_parallel_performance(self, model_name, levels=None, requests_per_level=None, flat_gain=0.1):
+        """Прогон по уровням параллелизма 1, 2, 4, 8... на фиксированном наборе промптов.
+
+        Для каждого уровня - p50/p95/p99 задержки и суммарная скорость (токен/сек).
+        Точка насыщения - первый уровень, где прирост скорости меньше flat_gain (10%);
+        рекомендуемый OLLAMA_NUM_PARALLEL - предыдущий уровень.
+        Замер имеет смысл, только если сервер запущен с OLLAMA_NUM_PARALLEL не ниже верхнего уровня:
+        сверх лимита запросы встают в очередь и скорость упирается в сам лимит.
+        """
+        print(f"\n🔄 Тестирование параллельной работы ({model_name})...")
+        server_limit, limit_source = self.get_server_num_parallel()
+        print(f"  🔧 OLLAMA_NUM_PARALLEL сервера: {server_limit or '?'} ({limit_source})")
 
-        if self.results['cpu']['threads'] >= 4:
-            import threading
+        if levels is None:
+            max_level = max(2, self.results['cpu'].get('threads') or 2)
+            levels = [1]
+            while levels[-1] * 2 <= min(max_level, 16):
+                levels.append(levels[-1] * 2)
 
-            def send_request():
-                try:
-                    requests.post(
-                        "http://localhost:11434/api/generate",
-                        json={
-                            "model": model_name,
-                            "prompt": "Say 'test'",
-                            "stream": False
-                        },
-                        timeout=30
-                    )
-                except:
-                    pass
+        results = {
+            'levels': [],
+            'saturation_level': None,
+            'recommended': 1,
+            'server_num_parallel': server_limit,
+            'server_num_parallel_source': limit_source,
+            'limited_by_server': False,
+        }
+        if server_limit and max(levels) > server_limit:
+            print(f"  ⚠️ Уровни выше x{server_limit} встанут в очередь сервера - для честного замера "
+                  f"перезапустите 'ollama serve' с OLLAMA_NUM_PARALLEL={max(levels)}")
 
-            start = time.time()
-            threads = []
-            for _ in range(2):
-                t = threading.Thread(target=send_request)
-                t.start()
-                threads.append(t)
+        # Прогрев, чтобы загрузка модели не попала в замер первого уровня
+        self._timed_generate(model_name, "Say 'test'", num_predict=1)
 
-            for t in threads:
-                t.join(timeout=35)
+        previous = None
+        for level in levels:
+            count = requests_per_level or max(level * 2, len(PARALLEL_PROMPTS))
+            prompts = [PARALLEL_PROMPTS[i % len(PARALLEL_PROMPTS)] for i in range(count)]
 
-            results['parallel_2'] = time.time() - start
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=level) as executor:
+                samples = list(executor.map(lambda prompt: self._timed_generate(model_name, prompt), prompts))
+            elapsed = time.time() - start
+
+            ok_samples = [s for s in samples if s['ok']]
+            latencies = [s['latency'] for s in ok_samples]
+            tokens_per_sec = sum(s['tokens'] for s in ok_samples) / elapsed if elapsed > 0 else 0
+
+            level_result = {
+                'parallel': level,
+                'requests': count,
+                'errors': count - len(ok_samples),
+                'p50_sec': round(self._percentile(latencies, 50), 2),
+                'p95_sec': round(self._percentile(latencies, 95), 2),
+                'p99_sec': round(self._percentile(latencies, 99), 2),
+                'tokens_per_sec': round(tokens_per_sec, 2),
+                'above_server_limit': bool(server_limit and level > server_limit),
+            }
+            results['levels'].append(level_result)
+            print(f"  x{level}: p50 {level_result['p50_sec']} сек, p95 {level_result['p95_sec']} сек, "
+                  f"{level_result['tokens_per_sec']} токен/сек")
+
+            if previous is not None and results['saturation_level'] is None:
+                gain = (tokens_per_sec - previous['tokens_per_sec']) / previous['tokens_per_sec'] \
+                    if previous['tokens_per_sec'] else 0
+                if gain < flat_gain:
+                    results['saturation_level'] = level
+                    results['recommended'] = previous['parallel']
+                    print(f"  📉 Насыщение на x{level} (прирост {gain:.0%})")
+                    if level_result['above_server_limit']:
+                        # Плато из-за очереди сервера, а не из-за железа - рекомендация повторяет лимит
+                        results['limited_by_server'] = True
+                        print(f"  ⚠️ Насыщение выше лимита сервера x{server_limit}: это его очередь, "
+                              f"а не предел железа")
+                    break
+            if ok_samples:
+                results['recommended'] = level
+            previous = level_result
+
+        print(f"  ✅ Рекомендуемый OLLAMA_NUM_PARALLEL: {results['recommended']}")
+        return results
 
-        if results['parallel_2'] < results['parallel_1'] * 1.5:
-            results['recommended'] = 2
-        if results['parallel_4'] < results['parallel_1'] * 2:
-            results['recommended'] = 4
+    @staticmethod
+    def load_stage_texts(workspace_path=WORKSPACE_PATH):
+        """Реальные выходы этапов из сохранённых запусков (для промптов как в run_crew)"""
+        texts = []
+        for pattern in ("plan_*.md", "developer_code_*.py", "review_*.md"):
+            for path in sorted(Path(workspace_path).glob(f"**/{pattern}"))[-5:]:
+                try:
+                    texts.append(path.read_text(encoding='utf-8'))
+                except OSError:
+                    continue
+        return texts
+
+    @staticmethod
+    def build_stage_prompt(tokens, texts=None):
+        """Промпт этапа ревьюера длиной ~tokens токенов (~4 символа на токен).
+
+        Уникальная метка в начале не даёт Ollama переиспользовать KV-кэш предыдущего промпта.
+        """
+        body = "\n\n".join(texts) if texts else SYNTHETIC_PLAN
+        target_chars = tokens * 4
+        while len(body) < target_chars:
+            body += "\n\n" + body
+        header = f"[run {uuid.uuid4().hex[:8]}] Review this code and fix all errors. Return ONLY the fixed code.\n\n"
+        return header + body[:max(0, target_chars - len(header))]
+
+    @staticmethod
+    def _ascii_chart(rows, label_key, value_key, unit, width=40):
+        """Горизонтальная ASCII-диаграмма"""
+        top = max((row[value_key] for row in rows), default=0) or 1
+        lines = []
+        for row in rows:
+            bar = "█" * max(1, round(row[value_key] / top * width)) if row[value_key] else ""
+            lines.append(f"{str(row[label_key]):>6} | {bar} {row[value_key]} {unit}")
+        return "\n".join(lines)
+
+    def test_prompt_scaling(self, model_name, sizes=None, use_recorded=True, num_predict=32):
+        """Задержка и скорость в зависимости от длины промпта (256, 1k, 2k, 4k токенов).
+
+        Промпты собираются из реальных выходов этапов в workspace, если они есть, иначе синтетические.
+        Ответ короткий (num_predict), чтобы время определялось обработкой промпта.
+        Окно контекста (num_ctx) одно на весь замер и вмещает самый длинный промпт (смена num_ctx
+        перезагружает модель), графики строятся по фактическому числу токенов промпта (prefill_tokens).
+        """
+        sizes = sizes or PROMPT_SCALING_SIZES
+        texts = self.load_stage_texts() if use_recorded else []
+        print(f"\n🔄 Масштабирование по длине промпта ({model_name}, "
+              f"{'реальные этапы' if texts else 'синтетика'})...")
+
+        num_ctx = int(max(sizes) * PROMPT_SCALING_CTX_MARGIN) + num_predict
+
+        # Прогрев с тем же num_ctx, чтобы загрузка модели не попала в замер
+        try:
+            self._stream_generate(model_name, "Say 'test'", num_predict=1, num_ctx=num_ctx)
+        except Exception:
+            pass
 
-        return results
+        rows = []
+        for size in sizes:
+            try:
+                result = self._stream_generate(model_name, self.build_stage_prompt(size, texts), num_predict,
+                                               num_ctx=num_ctx)
+            except Exception as e:
+                print(f"  ❌ {size}: {e}")
+                rows.append({'target_tokens': size, 'num_ctx': num_ctx, 'error': str(e)})
+                continue
+            result['target_tokens'] = size
+            result['num_ctx'] = num_ctx
+            rows.append(result)
+            print(f"  {size:>5} токенов (фактически {result['prefill_tokens']}): TTFT {result['ttft_sec']} сек, "
+                  f"всего {result['time_sec']} сек, prefill {result['prefill_tokens_per_sec']} токен/сек")
+
+        ok_rows = [row for row in rows if 'error' not in row]
+        if ok_rows:
+            print("\n  Время до первого токена:")
+            print(self._ascii_chart(ok_rows, 'prefill_tokens', 'ttft_sec', "сек"))
+            print("\n  Скорость prefill:")
+            print(self._ascii_chart(ok_rows, 'prefill_tokens', 'prefill_tokens_per_sec', "токен/сек"))
+
+        return {'source': 'recorded' if texts else 'synthetic', 'num_ctx': num_ctx, 'sizes': rows}
 
     def get_recommendations(self):
         """Формирует рекомендации на основе тестов"""
         mem_gb = self.results['memory']['total_gb']
         cpu_cores = self.results['cpu']['cores']
 
-        if mem_gb >= 32:
+        # Модель по измеренному следу процессов Ollama: самая быстрая из тех, что умещаются
+        # в 75% ОЗУ; без замеров - по фиксированным порогам
+        budget_gb = mem_gb * 0.75
+        measured = {
+            model: data for model, data in self.results.get('models', {}).items()
+            if data.get('memory', {}).get('peak_rss_gb') and data.get('avg_tokens_per_sec')
+        }
+        fitting = {model: data for model, data in measured.items() if data['memory']['peak_rss_gb'] <= budget_gb}
+
+        if fitting:
+            model = max(fitting, key=lambda name: fitting[name]['avg_tokens_per_sec'])
+            self.results['recommendations']['model'] = model
+            self.results['recommendations']['model_footprint_gb'] = fitting[model]['memory']['peak_rss_gb']
+        elif mem_gb >= 32:
             self.results['recommendations']['model'] = 'llama2:13b'
         elif mem_gb >= 16:
             self.results['recommendations']['model'] = 'codellama:7b'
@@ -240,10 +685,12 @@ class SystemBenchmark:
         else:
             self.results['recommendations']['model'] = 'phi3:mini'
 
-        self.results['recommendations']['parallel'] = min(cpu_cores, 4)
+        # Параллелизм - из замера насыщения, без замера - по числу ядер
+        parallel = self.results.get('parallel', {}).get('recommended') or min(cpu_cores, 4)
+        self.results['recommendations']['parallel'] = parallel
 
         self.results['recommendations']['ollama_settings'] = {
-            'OLLAMA_NUM_PARALLEL': str(min(cpu_cores, 4)),
+            'OLLAMA_NUM_PARALLEL': str(parallel),
             'OLLAMA_MAX_LOADED_MODELS': '2',
             'OLLAMA_KEEP_ALIVE': '10m',
             'OLLAMA_HOST': '0.0.0.0'
@@ -256,6 +703,64 @@ class SystemBenchmark:
             'cache': 'True'
         }
 
+    def build_tuning_profile(self):
+        """Машиночитаемый профиль для run_crew: модель и лимит токенов по этапам, параллелизм, CrewAI.
+
+        Лёгкие этапы (translator, planner) - самая быстрая модель из умещающихся в память.
+        Тяжёлые (developer, reviewer) - самая крупная из тех, что успевают выдать MIN_CODE_TOKENS
+        за лимит времени этапа. Лимит токенов - сколько модель успевает сгенерировать за 80% лимита времени.
+        """
+        recommendations = self.results['recommendations']
+        budget_gb = self.results['memory']['total_gb'] * 0.75
+        measured = {
+            model: data for model, data in self.results.get('models', {}).items()
+            if data.get('avg_tokens_per_sec') and data.get('memory', {}).get('peak_rss_gb', 0) <= budget_gb
+        }
+
+        def speed(model):
+            return measured.get(model, {}).get('avg_tokens_per_sec') or 0
+
+        fastest = max(measured, key=speed) if measured else recommendations['model']
+
+        stages = {}
+        for stage, ceiling in STAGE_TOKEN_CEILING.items():
+            time_budget = STAGE_TIME_BUDGET_SEC[stage]
+            model = fastest
+            if stage in ("developer", "reviewer"):
+                capable = [m for m in measured if speed(m) * time_budget >= MIN_CODE_TOKENS]
+                if capable:
+                    model = max(capable, key=lambda m: measured[m].get('memory', {}).get('peak_rss_gb', 0))
+            max_tokens = ceiling
+            if speed(model):
+                max_tokens = max(128, min(ceiling, int(speed(model) * time_budget * 0.8)))
+            stages[stage] = {'model': model, 'max_tokens': max_tokens}
+
+        decode = speed(fastest)
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'fingerprint': machine_fingerprint(self.results),
+            'ollama_version': self.results.get('ollama', {}).get('version'),
+            'model': fastest,
+            'max_tokens': max(stage['max_tokens'] for stage in stages.values()),
+            'temperature': float(recommendations['crewai_settings']['temperature']),
+            'ollama_num_parallel': recommendations['parallel'],
+            # Локальная Ollama не ограничивает частоту запросов - ограничение CrewAI только тормозит
+            'max_rpm': None,
+            # На медленной машине лишняя итерация агента стоит минуты
+            'max_iter': 3 if decode >= 10 else 2,
+            'stages': stages,
+        }
+
+    def save_tuning_profile(self, path=TUNING_PROFILE_PATH):
+        """Сохраняет профиль настроек, который run_crew подхватит при запуске"""
+        profile = self.build_tuning_profile()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2, ensure_ascii=False)
+        print(f"⚙️ Профиль настроек: {path}")
+        return profile
+
     def save_results(self):
         """Сохраняет результаты в файл"""
         filename = f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -275,6 +780,7 @@ class SystemBenchmark:
 ## 🚀 Рекомендации
 
 ### Лучшая модель: **{self.results['recommendations']['model']}**
+Память процессов Ollama: **{self.results['recommendations'].get('model_footprint_gb', '—')} GB**
 Параллельных запросов: **{self.results['recommendations']['parallel']}**
 
 ### Настройки Ollama:
@@ -291,13 +797,64 @@ cache={self.results['recommendations']['crewai_settings']['cache']}
 
 """
 
+        if self.results.get('parallel', {}).get('levels'):
+            report += "\n## ⚡ Параллельные запросы\n\n"
+            report += "| Параллельно | p50, сек | p95, сек | p99, сек | Токен/сек | Ошибок |\n"
+            report += "|---|---|---|---|---|---|\n"
+            for level in self.results['parallel']['levels']:
+                report += (f"| {level['parallel']} | {level['p50_sec']} | {level['p95_sec']} | {level['p99_sec']} | "
+                           f"{level['tokens_per_sec']} | {level['errors']} |\n")
+            saturation = self.results['parallel']['saturation_level']
+            report += f"\nНасыщение: {'x' + str(saturation) if saturation else 'не достигнуто'}\n"
+            server_limit = self.results['parallel'].get('server_num_parallel')
+            report += (f"\nOLLAMA_NUM_PARALLEL сервера во время замера: {server_limit or '?'} "
+                       f"({self.results['parallel'].get('server_num_parallel_source', 'не определялся')})\n")
+            report += ("\n> Замер осмыслен, только если 'ollama serve' запущен с OLLAMA_NUM_PARALLEL не ниже "
+                       "верхнего уровня замера: сверх лимита запросы ждут в очереди и скорость не растёт.\n")
+            if self.results['parallel'].get('limited_by_server'):
+                report += ("\n⚠️ Насыщение совпало с лимитом сервера - рекомендация повторяет текущую настройку. "
+                           "Перезапустите сервер с большим OLLAMA_NUM_PARALLEL и повторите замер.\n")
+
+        if self.results.get('prompt_scaling'):
+            report += "\n## 📏 Длина промпта\n\n"
+            for model, data in self.results['prompt_scaling'].items():
+                rows = [row for row in data['sizes'] if 'error' not in row]
+                if not rows:
+                    continue
+                report += f"### {model} ({data['source']})\n\n"
+                report += ("| Prefill токенов | Цель | num_ctx | TTFT, сек | Всего, сек | Prefill, токен/сек "
+                           "| Decode, токен/сек |\n")
+                report += "|---|---|---|---|---|---|---|\n"
+                for row in rows:
+                    report += (f"| {row['prefill_tokens']} | {row['target_tokens']} | {row.get('num_ctx', '—')} | "
+                               f"{row['ttft_sec']} | "
+                               f"{row['time_sec']} | {row['prefill_tokens_per_sec']} | "
+                               f"{row['decode_tokens_per_sec']} |\n")
+                report += "\n```\n" + self._ascii_chart(rows, 'prefill_tokens', 'ttft_sec', "сек") + "\n```\n\n"
+
         if self.results.get('models'):
             report += "\n## 📈 Результаты тестов\n\n"
             for model, data in self.results['models'].items():
                 if data.get('avg_tokens_per_sec'):
                     report += f"### {model}\n"
                     report += f"- Среднее время: {data['avg_time']} сек\n"
-                    report += f"- Скорость: {data['avg_tokens_per_sec']} токен/сек\n\n"
+                    report += f"- Скорость: {data['avg_tokens_per_sec']} токен/сек\n"
+                    if data.get('memory'):
+                        report += (f"- Память Ollama: пик {data['memory']['peak_rss_gb']} GB, "
+                                   f"среднее {data['memory']['mean_rss_gb']} GB\n"
+                                   f"- CPU Ollama: пик {data['memory']['peak_cpu_percent']}%, "
+                                   f"среднее {data['memory']['mean_cpu_percent']}%\n")
+                    report += "\n"
+                if data.get('streaming') and data.get('warm'):
+                    cold = data.get('cold') or {}
+                    warm = data['warm']
+                    report += "| Старт | TTFT, сек | Загрузка, сек | Prefill, токен/сек | Decode, токен/сек |\n"
+                    report += "|---|---|---|---|---|\n"
+                    if 'error' not in cold:
+                        report += (f"| ❄️ холодный | {cold['ttft_sec']} | {cold['load_sec']} | "
+                                   f"{cold['prefill_tokens_per_sec']} | {cold['decode_tokens_per_sec']} |\n")
+                    report += (f"| 🔥 тёплый | {warm['ttft_sec']} | {warm['load_sec']} | "
+                               f"{warm['prefill_tokens_per_sec']} | {warm['decode_tokens_per_sec']} |\n\n")
 
         report_file = filename.replace('.json', '_report.md')
         with open(report_file, 'w', encoding='utf-8') as f:
@@ -311,6 +868,16 @@ cache={self.results['recommendations']['crewai_settings']['cache']}
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк системы для AI Office")
+    parser.add_argument("--prompt-scaling", action="store_true",
+                        help="Замер задержки по длине промпта (как в этапах run_crew)")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in PROMPT_SCALING_SIZES),
+                        help="Размеры промптов в токенах через запятую")
+    parser.add_argument("--synthetic", action="store_true", help="Только синтетические промпты")
+    parser.add_argument("--repeats", type=int, default=BENCHMARK_REPEATS,
+                        help="Повторов каждого тестового промпта (для сравнения с историей нужно не меньше 2)")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("🔬 БЕНЧМАРК СИСТЕМЫ ДЛЯ AI OFFICE")
     print("=" * 60)
@@ -342,15 +909,29 @@ def main():
         print(f"ТЕСТИРОВАНИЕ: {model}")
         print('=' * 40)
 
-        model_results = benchmark.benchmark_model(model, test_prompts)
+        model_results = benchmark.benchmark_model_streaming(model, test_prompts, repeats=args.repeats)
         benchmark.results['models'][model] = model_results
 
-        if len(models_to_test) == 1:
+        if model == models_to_test[0]:
             parallel_results = benchmark.test_parallel_performance(model)
             benchmark.results['parallel'] = parallel_results
 
+        if args.prompt_scaling:
+            sizes = [int(size) for size in args.sizes.split(",")]
+            benchmark.results.setdefault('prompt_scaling', {})[model] = benchmark.test_prompt_scaling(
+                model, sizes, use_recorded=not args.synthetic
+            )
+
     benchmark.get_recommendations()
     json_file, report_file = benchmark.save_results()
+    benchmark.save_tuning_profile()
+
+    history = BenchmarkHistory()
+    entry = history.append(benchmark.results)
+    print(f"\n🗂️ Запуск {entry['id']} добавлен в историю: {history.history_file}")
+    comparison = compare_with_reference(history, entry)
+    if comparison:
+        print(comparison)
 
     print("\n" + "=" * 60)
     print("✅ БЕНЧМАРК ЗАВЕРШЕН")
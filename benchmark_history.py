@@ -0,0 +1,328 @@
+import argparse
+import hashlib
+import json
+import math
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+HISTORY_PATH = ROOT / "workspace" / "benchmarks"
+
+# Метрики для сравнения: (ключ, больше - лучше, подпись)
+METRICS = [
+    ('decode_tokens_per_sec', True, "Decode, токен/сек"),
+    ('prefill_tokens_per_sec', True, "Prefill, токен/сек"),
+    ('ttft_sec', False, "TTFT, сек"),
+    ('time_sec', False, "Время ответа, сек"),
+    ('memory_gb', False, "Память Ollama, GB"),
+]
+
+# Меньше замеров на сторону (после нормировки по промптам) - разницу не отличить от шума, итог n/a
+MIN_SAMPLES = 4
+
+
+def machine_fingerprint(results: dict) -> str:
+    """Отпечаток машины: процессор, ядра, память, ОС"""
+    system = results.get('system', {})
+    cpu = results.get('cpu', {})
+    parts = [
+        cpu.get('brand'), cpu.get('cores'), cpu.get('threads'),
+        results.get('memory', {}).get('total_gb'),
+        system.get('os'), system.get('machine'), system.get('hostname'),
+    ]
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:12]
+
+
+def extract_samples(model_results: dict) -> dict:
+    """Выборки метрик модели по промптам: {метрика: {промпт: [значения повторов]}}.
+
+    Разные промпты дают разные TTFT и скорости, поэтому сравнивать можно только повторы одного промпта.
+    """
+    samples = {key: {} for key, _, _ in METRICS}
+
+    def add(key, prompt, value):
+        samples[key].setdefault(prompt, []).append(value)
+
+    for test in model_results.get('tests', []):
+        if 'error' in test:
+            continue
+        prompt = test.get('prompt', '')
+        if 'decode_tokens_per_sec' in test:
+            add('decode_tokens_per_sec', prompt, test['decode_tokens_per_sec'])
+            add('prefill_tokens_per_sec', prompt, test['prefill_tokens_per_sec'])
+            add('ttft_sec', prompt, test['ttft_sec'])
+        elif 'tokens_per_sec' in test:
+            add('decode_tokens_per_sec', prompt, test['tokens_per_sec'])
+        add('time_sec', prompt, test['time_sec'])
+        if 'peak_rss_gb' in test:
+            add('memory_gb', prompt, test['peak_rss_gb'])
+    return {key: groups for key, groups in samples.items() if groups}
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+def _flatten(groups):
+    return [value for values in groups.values() for value in values] if isinstance(groups, dict) else groups
+
+
+def normalized_samples(old: dict, new: dict):
+    """Повторы общих промптов, делённые на старое среднее своего промпта: (старые, новые).
+
+    Нормировка убирает разницу между промптами - t-тест видит только шум повторов.
+    Промпты без повторов (меньше 2 замеров с какой-либо стороны) не участвуют.
+    """
+    a, b = [], []
+    for prompt in sorted(set(old) & set(new)):
+        if len(old[prompt]) < 2 or len(new[prompt]) < 2:
+            continue
+        base = _mean(old[prompt])
+        if not base:
+            continue
+        a += [value / base for value in old[prompt]]
+        b += [value / base for value in new[prompt]]
+    return a, b
+
+
+def _betacf(a, b, x):
+    """Цепная дробь для неполной бета-функции (Numerical Recipes)"""
+    tiny = 1e-30
+    qab, qap, qam = a + b, a + 1, a - 1
+    c, d = 1.0, 1 - qab * x / qap
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 200):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        d = 1 / (d if abs(d) > tiny else tiny)
+        c = 1 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 3e-12:
+            break
+    return h
+
+
+def _betainc(a, b, x):
+    """Регуляризованная неполная бета-функция I_x(a, b)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1 - front * _betacf(b, a, 1 - x) / b
+
+
+def welch_t_test(a, b):
+    """t-тест Уэлча: (t, двусторонний p-value); None, если выборки слишком малы"""
+    if len(a) < 2 or len(b) < 2:
+        return None
+    mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+    var_a = sum((x - mean_a) ** 2 for x in a) / (len(a) - 1)
+    var_b = sum((x - mean_b) ** 2 for x in b) / (len(b) - 1)
+    se_a, se_b = var_a / len(a), var_b / len(b)
+    if se_a + se_b == 0:
+        return (0.0, 1.0) if mean_a == mean_b else (math.inf, 0.0)
+    t = (mean_b - mean_a) / math.sqrt(se_a + se_b)
+    df = (se_a + se_b) ** 2 / (se_a ** 2 / (len(a) - 1) + se_b ** 2 / (len(b) - 1))
+    p_value = _betainc(df / 2, 0.5, df / (df + t * t))
+    return t, p_value
+
+
+class BenchmarkHistory:
+    """История бенчмарков (history.jsonl) и закреплённый эталон (baseline.json)"""
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = Path(path)
+        self.history_file = self.path / "history.jsonl"
+        self.baseline_file = self.path / "baseline.json"
+
+    def append(self, results: dict) -> dict:
+        """Добавляет результаты SystemBenchmark в историю и возвращает запись"""
+        ollama = results.get('ollama', {})
+        entry = {
+            'id': datetime.now().strftime("%Y%m%d_%H%M%S"),
+            'timestamp': results.get('timestamp'),
+            'fingerprint': machine_fingerprint(results),
+            'ollama_version': ollama.get('version'),
+            'cpu': results.get('cpu', {}).get('brand'),
+            'models': {
+                model: {
+                    'digest': (ollama.get('model_digests') or {}).get(model),
+                    'samples': extract_samples(data),
+                }
+                for model, data in results.get('models', {}).items()
+            },
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.history_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return entry
+
+    def load(self) -> list:
+        entries = []
+        if not self.history_file.exists():
+            return entries
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def get(self, entry_id):
+        return next((entry for entry in self.load() if entry['id'] == entry_id), None)
+
+    def pin(self, entry_id=None) -> dict:
+        """Закрепляет запись (по умолчанию последнюю) как эталон"""
+        entries = self.load()
+        entry = self.get(entry_id) if entry_id else (entries[-1] if entries else None)
+        if entry is None:
+            raise ValueError(f"Запись {entry_id or '(последняя)'} не найдена")
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.baseline_file, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, indent=2, ensure_ascii=False)
+        return entry
+
+    def baseline(self):
+        if not self.baseline_file.exists():
+            return None
+        with open(self.baseline_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def previous(self, entry):
+        """Предыдущая запись на той же машине"""
+        earlier = [e for e in self.load() if e['fingerprint'] == entry['fingerprint'] and e['id'] < entry['id']]
+        return earlier[-1] if earlier else None
+
+    @staticmethod
+    def compare(old: dict, new: dict, alpha: float = 0.05) -> list:
+        """Сравнивает две записи по общим моделям; verdict - regression/improvement/same/n/a.
+
+        Тест идёт по повторам одних и тех же промптов (normalized_samples), change_pct - средняя
+        относительная разница по промптам. Меньше MIN_SAMPLES замеров на сторону (в том числе записи
+        без повторов) - n/a.
+        """
+        rows = []
+        for model in sorted(set(old['models']) & set(new['models'])):
+            old_model, new_model = old['models'][model], new['models'][model]
+            for key, higher_is_better, label in METRICS:
+                old_groups = old_model['samples'].get(key)
+                new_groups = new_model['samples'].get(key)
+                if not old_groups or not new_groups:
+                    continue
+                mean_a, mean_b = _mean(_flatten(old_groups)), _mean(_flatten(new_groups))
+
+                # Записи старого формата - плоский список по разным промптам, повторов в них нет
+                grouped = isinstance(old_groups, dict) and isinstance(new_groups, dict)
+                a, b = normalized_samples(old_groups, new_groups) if grouped else ([], [])
+                test = welch_t_test(a, b) if min(len(a), len(b)) >= MIN_SAMPLES else None
+                p_value = test[1] if test else None
+                change_pct = round((_mean(b) / _mean(a) - 1) * 100, 1) if a and b else None
+
+                if p_value is None:
+                    verdict = 'n/a'
+                elif p_value >= alpha:
+                    verdict = 'same'
+                else:
+                    # Направление - по тем же нормализованным выборкам, что и тест (знак change_pct)
+                    verdict = 'improvement' if (_mean(b) > _mean(a)) == higher_is_better else 'regression'
+
+                rows.append({
+                    'model': model,
+                    'metric': key,
+                    'label': label,
+                    'old': round(mean_a, 3),
+                    'new': round(mean_b, 3),
+                    'change_pct': change_pct,
+                    'n': [len(a), len(b)],
+                    'p_value': round(p_value, 4) if p_value is not None else None,
+                    'verdict': verdict,
+                    'digest_changed': old_model.get('digest') != new_model.get('digest'),
+                })
+        return rows
+
+
+def format_comparison(old: dict, new: dict, rows: list) -> str:
+    icons = {'regression': "🔴", 'improvement': "🟢", 'same': "⚪", 'n/a': "❔"}
+    lines = [f"📊 {old['id']} → {new['id']}"]
+    if old.get('fingerprint') != new.get('fingerprint'):
+        lines.append("⚠️ Разные машины - сравнение ориентировочное")
+    if old.get('ollama_version') != new.get('ollama_version'):
+        lines.append(f"🔄 Ollama: {old.get('ollama_version')} → {new.get('ollama_version')}")
+    lines.append("")
+    lines.append("| Модель | Метрика | Было | Стало | Δ, % | n | p | Итог |")
+    lines.append("|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        model = row['model'] + (" (перезагружена)" if row['digest_changed'] else "")
+        change = "—" if row['change_pct'] is None else f"{row['change_pct']:+.1f}"
+        p_value = "—" if row['p_value'] is None else row['p_value']
+        samples = "/".join(str(n) for n in row.get('n', ())) or "—"
+        lines.append(f"| {model} | {row['label']} | {row['old']} | {row['new']} | {change} | {samples} | {p_value} | "
+                     f"{icons[row['verdict']]} {row['verdict']} |")
+    return "\n".join(lines) + "\n"
+
+
+def compare_with_reference(history: BenchmarkHistory, entry: dict):
+    """Сравнение с эталоном, а без него - с предыдущим запуском на этой машине"""
+    reference = history.baseline() or history.previous(entry)
+    if reference is None or reference['id'] == entry['id']:
+        return None
+    return format_comparison(reference, entry, history.compare(reference, entry))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="История бенчмарков AI Office")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="Записи истории")
+
+    compare_parser = subparsers.add_parser("compare", help="Сравнить два запуска")
+    compare_parser.add_argument("old", nargs="?", help="id старого запуска (по умолчанию эталон или предыдущий)")
+    compare_parser.add_argument("new", nargs="?", help="id нового запуска (по умолчанию последний)")
+    compare_parser.add_argument("--alpha", type=float, default=0.05, help="Уровень значимости")
+
+    pin_parser = subparsers.add_parser("pin", help="Закрепить запуск как эталон")
+    pin_parser.add_argument("id", nargs="?", help="id запуска (по умолчанию последний)")
+
+    args = parser.parse_args()
+    history = BenchmarkHistory()
+
+    if args.command == "list":
+        baseline = history.baseline() or {}
+        for entry in history.load():
+            mark = "📌" if entry['id'] == baseline.get('id') else "  "
+            print(f"{mark} {entry['id']}  {entry['fingerprint']}  Ollama {entry.get('ollama_version')}  "
+                  f"{', '.join(entry['models'])}")
+
+    elif args.command == "pin":
+        entry = history.pin(args.id)
+        print(f"📌 Эталон: {entry['id']}")
+
+    elif args.command == "compare":
+        entries = history.load()
+        new = history.get(args.new) if args.new else (entries[-1] if entries else None)
+        if new is None:
+            print("❌ Нет записи для сравнения")
+            return
+        old = history.get(args.old) if args.old else (history.baseline() or history.previous(new))
+        if old is None:
+            print("❌ Нет эталона или предыдущего запуска")
+            return
+        print(format_comparison(old, new, history.compare(old, new, args.alpha)))
+
+
+if __name__ == "__main__":
+    main()
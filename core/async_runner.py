@@ -0,0 +1,345 @@
+import asyncio
+import contextlib
+import os
+import time
+from pathlib import Path
+
+from core.checkpoints import CheckpointStore
+from core.crew_runner import (
+    AGENT_SPECS,
+    DEVELOPER_RETRY_PROMPT,
+    STAGE_EXPECTED_OUTPUT,
+    STAGE_START_LOGS,
+    candidate_seed,
+    ensure_not_running,
+    final_output,
+    finish_run,
+    get_stage_cache,
+    llm_settings,
+    load_run,
+    needs_developer_retry,
+    new_run,
+    render_stage_prompt,
+    report_error,
+    report_resume,
+    report_stage_result,
+    report_stage_start,
+    score_candidate,
+    stage_cache_key,
+    stage_llm,
+    stage_messages,
+    stage_prompt,
+    stage_system_prompt,
+)
+from core.events import emit, task_context, INFO, WARNING, ERROR
+from core.ollama_client import AsyncOllamaClient
+
+# Сообщение отмены корутины, которой run_cancellable обрывает запуск по таймауту
+TIMEOUT_CANCEL_MSG = "timeout"
+
+
+async def arun_stage(stage, description, client, agent_stage=None, expected_output=None, max_tokens=None,
+                     temperature=None, seed=None, use_cache=True, on_event=None, model=None):
+    """Выполняет этап одним потоковым запросом к Ollama.
+
+    agent_stage - чья роль используется (для developer#N и developer_retry это developer).
+    Отмена корутины обрывает запрос и освобождает слот модели.
+    """
+    agent_stage = agent_stage or stage
+    expected_output = expected_output or STAGE_EXPECTED_OUTPUT[agent_stage]
+    role, goal, backstory = AGENT_SPECS[agent_stage]
+
+    model, settings = llm_settings(max_tokens, temperature, seed, model)
+    key = stage_cache_key(
+        description, expected_output,
+        {'role': role, 'goal': goal, 'backstory': backstory},
+        model, settings,
+    )
+    stage_cache = get_stage_cache()
+
+    started = time.time()
+    if on_event:
+        on_event("stage_start", {'stage': stage})
+
+    if use_cache:
+        cached = stage_cache.get(key)
+        if cached is not None:
+            emit("stage.end", f"⚡ {stage}: ответ взят из кэша", stage=stage, cached=True,
+                 duration=round(time.time() - started, 3), chars=len(cached))
+            if on_event:
+                on_event("token", {'stage': stage, 'text': cached})
+                on_event("stage_end", {'stage': stage, 'duration': time.time() - started,
+                                       'cached': True, 'chars': len(cached)})
+            return cached
+
+    def on_token(text):
+        if on_event:
+            on_event("token", {'stage': stage, 'text': text})
+
+    messages = stage_messages(stage_system_prompt(agent_stage), description, expected_output)
+    usage = {}
+
+    try:
+        output = await client.chat(
+            messages,
+            model=model,
+            temperature=settings['temperature'],
+            max_tokens=settings['max_tokens'],
+            seed=settings['seed'],
+            on_token=on_token,
+            on_usage=usage.update,
+        )
+    except asyncio.CancelledError:
+        duration = time.time() - started
+        emit("stage.end", f"⛔ {stage}: генерация прервана", level=WARNING, stage=stage, executor="async",
+             model=model, cached=False, cancelled=True, duration=round(duration, 3), chars=0)
+        if on_event:
+            on_event("stage_end", {'stage': stage, 'duration': duration,
+                                   'cached': False, 'chars': 0, 'cancelled': True})
+        raise
+
+    duration = time.time() - started
+    emit("stage.end", None, level=INFO, stage=stage, executor="async", model=model, cached=False,
+         cancelled=False, duration=round(duration, 3), chars=len(output),
+         prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'))
+    if on_event:
+        on_event("stage_end", {'stage': stage, 'duration': duration,
+                               'cached': False, 'chars': len(output), 'cancelled': False})
+
+    if use_cache and output.strip():
+        stage_cache.put(key, output, {'stage': stage, 'role': role})
+    return output
+
+
+async def atranslate(final_task, client, **kwargs):
+    """Этап переводчика: задача -> техническая спецификация"""
+    return await arun_stage("translator", stage_prompt("translator", final_task), client, **kwargs)
+
+
+async def aplan(spec, client, **kwargs):
+    """Этап планировщика: спецификация -> план"""
+    return await arun_stage("planner", stage_prompt("planner", spec), client, **kwargs)
+
+
+async def adevelop(plan, client, **kwargs):
+    """Этап разработчика: план -> HTML"""
+    return await arun_stage("developer", stage_prompt("developer", plan), client, **kwargs)
+
+
+async def areview(code, client, **kwargs):
+    """Этап ревьюера: HTML -> исправленный HTML"""
+    return await arun_stage("reviewer", stage_prompt("reviewer", code), client, **kwargs)
+
+
+async def adevelop_candidates(description, task, count, client, max_tokens=None, use_cache=True, on_event=None,
+                              model=None, seeds=None):
+    """Параллельные кандидаты разработчика; как только один проходит все проверки, остальные отменяются.
+
+    С seeds (candidate_seed) кэш этапов не используется - ключ с seed запуска другой раз не совпадёт.
+    """
+    base_temperature = float(os.environ["OPENAI_TEMPERATURE"])
+    use_cache = use_cache and not seeds
+    emit("candidates.start", f"🎲 Запуск {count} кандидатов разработчика параллельно...", count=count)
+
+    tasks = {
+        asyncio.create_task(arun_stage(
+            f"developer#{index + 1}", description, client,
+            agent_stage="developer",
+            max_tokens=max_tokens,
+            temperature=min(1.0, base_temperature + index * 0.2),
+            seed=seeds[index] if seeds else None,
+            use_cache=use_cache,
+            on_event=on_event,
+            model=model,
+        )): index
+        for index in range(count)
+    }
+
+    best_text, best_score, best_index = None, None, None
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            perfect = False
+            for finished in done:
+                index = tasks[finished]
+                if finished.cancelled():
+                    continue
+                if finished.exception():
+                    emit("candidate.error", f"⚠️ Кандидат {index + 1} упал: {finished.exception()}", level=WARNING,
+                         stage=f"developer#{index + 1}", error=str(finished.exception()))
+                    continue
+
+                text = finished.result()
+                score, issues = score_candidate(text, task)
+                emit("candidate.scored", f"🎲 Кандидат {index + 1}: {len(issues)} проблем",
+                     stage=f"developer#{index + 1}", issues=len(issues))
+                if best_score is None or score > best_score:
+                    best_text, best_score, best_index = text, score, index
+                if score == 0:
+                    perfect = True
+
+            if perfect:
+                emit("candidate.accepted", f"✅ Кандидат {best_index + 1} прошёл все проверки, остальные отменяются",
+                     stage=f"developer#{best_index + 1}")
+                break
+    finally:
+        for unfinished in pending:
+            unfinished.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if best_index is not None:
+        emit("candidates.selected", f"🏆 Выбран кандидат {best_index + 1}", stage=f"developer#{best_index + 1}")
+    return best_text
+
+
+@contextlib.asynccontextmanager
+async def _arunning(checkpoints):
+    """checkpoints.running() для event loop: run.json и run.lock пишутся в отдельном потоке"""
+    running = checkpoints.running()
+    await asyncio.to_thread(running.__enter__)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(running.__exit__, None, None, None)
+
+
+async def _aexecute_run(manifest, outputs, use_cache=True, on_event=None, client=None):
+    """Выполняет незавершённые этапы прямыми запросами к Ollama, сохраняя чекпоинт после каждого.
+
+    Запись на диск (чекпоинты, отчёт, статус) идёт через asyncio.to_thread - event loop не блокируется.
+    """
+    final_task = manifest['final_task']
+    developer_candidates = manifest['developer_candidates']
+    task_temp_dir = Path(manifest['task_dir'])
+    report_file = task_temp_dir / "execution_report.md"
+    checkpoints = CheckpointStore(task_temp_dir)
+
+    own_client = client is None
+    client = client or AsyncOllamaClient()
+
+    run_started = time.time()
+    with task_context(manifest['task_timestamp']):
+        async with _arunning(checkpoints):
+            try:
+                for stage in manifest['stages']:
+                    if stage in outputs:
+                        emit("stage.checkpoint", f"♻️ {stage}: результат взят из чекпоинта", stage=stage)
+                        continue
+
+                    await asyncio.to_thread(report_stage_start, report_file, stage)
+                    emit("stage.begin", STAGE_START_LOGS[stage], stage=stage)
+                    started = time.time()
+
+                    description = render_stage_prompt(manifest, stage, outputs)
+                    model, max_tokens = stage_llm(manifest, stage)
+                    if stage == "developer" and developer_candidates > 1:
+                        result = await adevelop_candidates(
+                            description, final_task, developer_candidates, client,
+                            max_tokens, use_cache, on_event, model,
+                            seeds=[candidate_seed(manifest, i) for i in range(developer_candidates)],
+                        )
+                    else:
+                        result = await arun_stage(stage, description, client, max_tokens=max_tokens,
+                                                  use_cache=use_cache, on_event=on_event, model=model)
+
+                    if stage == "translator":
+                        if not result:
+                            emit("stage.empty", "❌ Переводчик вернул пустой результат", level=WARNING, stage=stage)
+                            result = final_task  # запасной вариант
+                        emit("stage.spec", f"📝 Техническое задание: {str(result)[:100]}...", stage=stage)
+
+                    if stage == "developer" and needs_developer_retry(result):
+                        emit("stage.retry", "⚠️ Разработчик не выдал HTML, пробую еще раз...", level=WARNING, stage=stage)
+                        result = await arun_stage(
+                            "developer_retry", DEVELOPER_RETRY_PROMPT, client,
+                            agent_stage="developer",
+                            expected_output="<!DOCTYPE html> ... </html>",
+                            max_tokens=max_tokens,
+                            # Промпт повтора не зависит от задачи - из кэша пришёл бы ответ на чужую задачу
+                            use_cache=False,
+                            on_event=on_event,
+                            model=model,
+                        )
+
+                    outputs[stage] = result
+                    await asyncio.to_thread(checkpoints.save, stage, description, result, started, time.time(),
+                                            llm_settings(max_tokens, model=model)[0])
+                    await asyncio.to_thread(report_stage_result, report_file, stage, result)
+
+                final_result = await asyncio.to_thread(
+                    finish_run, outputs, final_task, manifest['user_task'], manifest['requirements'],
+                    task_temp_dir, report_file, manifest['task_timestamp'], manifest['project_base_name']
+                )
+                await asyncio.to_thread(checkpoints.mark_completed)
+                emit("run.end", None, duration=round(time.time() - run_started, 3), stages=manifest['stages'])
+                return final_result
+
+            except asyncio.CancelledError as e:
+                # Отмена по таймауту (run_cancellable) - запуск можно продолжить, отмена пользователем - нет
+                if e.args[:1] == (TIMEOUT_CANCEL_MSG,):
+                    emit("run.timeout", "⏱️ Выполнение прервано по таймауту", level=WARNING)
+                    report_error(report_file, "⏱️ ПРЕРВАНО ПО ТАЙМАУТУ")
+                    await asyncio.to_thread(checkpoints.set_status, 'timeout')
+                else:
+                    emit("run.cancelled", "⛔ Выполнение отменено", level=WARNING)
+                    report_error(report_file, "⛔ ОТМЕНЕНО")
+                    await asyncio.to_thread(checkpoints.set_status, 'cancelled')
+                raise
+            except Exception as e:
+                emit("run.error", f"❌ КРИТИЧЕСКАЯ ОШИБКА: {str(e)}", level=ERROR, error=str(e))
+                report_error(report_file)
+                await asyncio.to_thread(checkpoints.set_status, 'failed', str(e))
+                raise
+            finally:
+                if own_client:
+                    await client.aclose()
+
+
+async def arun_crew(user_task: str, technical_spec: str = None, requirements=None, use_cache: bool = True,
+                    on_event=None, pipeline: str = "full", developer_candidates: int = 1, client=None):
+    """Асинхронный аналог run_crew: этапы идут прямыми запросами к Ollama, отмена обрывает текущий запрос"""
+    # new_run создаёт папку задачи и чистит старые (auto_cleanup) - это диск, не event loop
+    manifest = await asyncio.to_thread(new_run, user_task, technical_spec, requirements, pipeline, developer_candidates)
+    return await _aexecute_run(manifest, {}, use_cache, on_event, client)
+
+
+async def aresume_crew(task_dir, use_cache: bool = True, on_event=None, client=None):
+    """Асинхронный аналог resume_crew: продолжает запуск с первого незавершённого этапа"""
+    manifest, outputs = await asyncio.to_thread(load_run, task_dir)
+    if manifest.get('completed'):
+        emit("run.completed", f"✅ Запуск {task_dir} уже завершён", task_id=manifest['task_timestamp'])
+        return final_output(outputs)
+    await asyncio.to_thread(ensure_not_running, task_dir)
+
+    emit("run.resume", f"♻️ Продолжение {task_dir}: готово этапов {len(outputs)}/{len(manifest['stages'])}",
+         task_id=manifest['task_timestamp'], done=len(outputs), total=len(manifest['stages']))
+    await asyncio.to_thread(report_resume, Path(manifest['task_dir']) / "execution_report.md")
+    return await _aexecute_run(manifest, outputs, use_cache, on_event, client)
+
+
+def run_cancellable(coro, should_stop=None, timeout: float = None, poll_interval: float = 0.2):
+    """Выполняет корутину в собственном event loop (из обычного потока).
+
+    Если should_stop() вернул True - корутина отменяется и поднимается asyncio.CancelledError,
+    если истёк timeout - TimeoutError. В обоих случаях текущий запрос к Ollama обрывается.
+    """
+
+    async def supervisor():
+        task = asyncio.create_task(coro)
+        started = time.monotonic()
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+
+            stop_requested = should_stop is not None and should_stop()
+            timed_out = timeout is not None and time.monotonic() - started > timeout
+            if stop_requested or timed_out:
+                task.cancel(TIMEOUT_CANCEL_MSG if timed_out and not stop_requested else None)
+                await asyncio.gather(task, return_exceptions=True)
+                if timed_out:
+                    raise TimeoutError(f"Превышен таймаут {timeout} сек")
+                raise asyncio.CancelledError()
+
+    return asyncio.run(supervisor())
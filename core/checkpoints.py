@@ -0,0 +1,157 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Выполняющийся запуск обновляет run.lock с этим интервалом; lock старше RUN_STALE_SEC - процесс умер
+RUN_HEARTBEAT_SEC = 15
+RUN_STALE_SEC = 60
+# Конечные статусы: запуск больше не выполняется (в run.json пишется finished_at)
+TERMINAL_STATUSES = ('completed', 'cancelled', 'failed', 'timeout')
+# Не предлагаются к продолжению: завершённые и отменённые пользователем (упавшие и по таймауту - предлагаются)
+NOT_RESUMABLE_STATUSES = ('completed', 'cancelled')
+# Сколько последних папок задач просматривает find_incomplete_runs
+RESUMABLE_SCAN_LIMIT = 50
+
+
+def _write_json_atomic(path: Path, data: dict):
+    """Пишет JSON через временный файл - при падении остаётся старая версия, а не обрывок"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def inputs_hash(description: str) -> str:
+    """Хэш входа этапа (отрендеренного описания Task)"""
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class CheckpointStore:
+    """Чекпоинты этапов run_crew в папке задачи: run.json + checkpoints/<stage>.json"""
+
+    def __init__(self, task_dir):
+        self.task_dir = Path(task_dir)
+        self.manifest_file = self.task_dir / "run.json"
+        self.checkpoint_dir = self.task_dir / "checkpoints"
+        self.lock_file = self.task_dir / "run.lock"
+
+    def save_manifest(self, manifest: dict):
+        """Параметры запуска, по которым resume_crew восстановит конвейер"""
+        self.task_dir.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(self.manifest_file, manifest)
+
+    def load_manifest(self) -> dict:
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def exists(self) -> bool:
+        return self.manifest_file.exists()
+
+    def save(self, stage: str, description: str, output, started: float, finished: float, model: str = None):
+        """Сохраняет результат завершённого этапа"""
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(self.checkpoint_dir / f"{stage}.json", {
+            'stage': stage,
+            'inputs_hash': inputs_hash(description),
+            'output': None if output is None else str(output),
+            'model': model,
+            'started_at': datetime.fromtimestamp(started).isoformat(),
+            'finished_at': datetime.fromtimestamp(finished).isoformat(),
+            'duration': round(finished - started, 3),
+        })
+
+    def load(self, stage: str):
+        """Чекпоинт этапа или None"""
+        path = self.checkpoint_dir / f"{stage}.json"
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_valid(self, stage: str, description: str) -> bool:
+        """Чекпоинт есть и построен из того же входа"""
+        checkpoint = self.load(stage)
+        return checkpoint is not None and checkpoint.get('inputs_hash') == inputs_hash(description)
+
+    def set_status(self, status: str, error: str = None):
+        """Статус запуска в run.json: running / completed / cancelled / failed / timeout"""
+        manifest = self.load_manifest()
+        manifest['status'] = status
+        if status == 'completed':
+            manifest['completed'] = True
+        if status in TERMINAL_STATUSES:
+            manifest['finished_at'] = datetime.now().isoformat()
+        if error is not None:
+            manifest['error'] = error
+        self.save_manifest(manifest)
+
+    def mark_completed(self):
+        self.set_status('completed')
+
+    @contextlib.contextmanager
+    def running(self):
+        """Пока блок выполняется, run.lock обновляется фоновым потоком - другие вкладки и процессы
+        видят, что запуск идёт, а после падения процесса lock устаревает сам"""
+        self.set_status('running')
+        stop = threading.Event()
+
+        def touch():
+            self.lock_file.write_text(str(os.getpid()), encoding='utf-8')
+
+        def heartbeat():
+            while not stop.wait(RUN_HEARTBEAT_SEC):
+                touch()
+
+        touch()
+
+        thread = threading.Thread(target=heartbeat, name="run-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self.lock_file.unlink(missing_ok=True)
+
+    def is_running(self) -> bool:
+        try:
+            return time.time() - self.lock_file.stat().st_mtime < RUN_STALE_SEC
+        except OSError:
+            return False
+
+
+def find_incomplete_runs(temp_path, limit: int = 10, scan_limit: int = RESUMABLE_SCAN_LIMIT) -> list:
+    """Прерванные запуски, которые можно продолжить (новые сверху, не больше limit).
+
+    Пропускаются завершённые и отменённые пользователем запуски, а также идущие сейчас (свежий run.lock);
+    упавшие и прерванные по таймауту предлагаются.
+    Просматриваются только scan_limit последних папок задач.
+    """
+    runs = []
+    temp_path = Path(temp_path)
+    if not temp_path.exists():
+        return runs
+    with os.scandir(temp_path) as entries:
+        # В имени папки task_<timestamp> - сортировка по имени идёт по времени
+        names = sorted((entry.name for entry in entries if entry.name.startswith("task_") and entry.is_dir()),
+                       reverse=True)
+    for name in names[:scan_limit]:
+        store = CheckpointStore(temp_path / name)
+        try:
+            manifest = store.load_manifest()
+        except (OSError, ValueError):
+            continue
+        if manifest.get('completed') or manifest.get('status') in NOT_RESUMABLE_STATUSES or store.is_running():
+            continue
+        runs.append({'task_dir': str(store.task_dir), **manifest})
+        if len(runs) >= limit:
+            break
+    return runs
@@ -1,38 +1,152 @@
 import os
+import sys
+import json
 import shutil
 import zipfile
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from crewai import Crew, Task, Process, Agent
+from crewai import Crew, Task, Process, Agent, LLM
 import traceback
+import threading
+import contextvars
 import time
 import re
+import zlib
+import colorsys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
 
 load_dotenv()
 
 # Пути
 ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from core.stage_cache import StageCache
+from core.complexity import ComplexityAnalyzer
+from core.checkpoints import CheckpointStore
+from core.ollama_client import OllamaClient
+from core.events import emit, task_context, INFO, WARNING, ERROR
+
 BACKUP_PATH = Path("C:/Users/Aki/Desktop/Need/Need/MyProject_AI-office/Backup")
 WORKSPACE_PATH = ROOT / "workspace"
 PROJECTS_PATH = WORKSPACE_PATH / "projects"
 TEMP_PATH = WORKSPACE_PATH / "temp"
+CACHE_PATH = WORKSPACE_PATH / "cache" / "stages"
+# Профиль настроек, который пишет benchmark.py (AI_OFFICE_TUNING_PROFILE - другой путь)
+TUNING_PROFILE_PATH = Path(os.environ.get("AI_OFFICE_TUNING_PROFILE", WORKSPACE_PATH / "tuning_profile.json"))
+
+
+def load_tuning_profile(path=TUNING_PROFILE_PATH) -> dict:
+    """Профиль, измеренный бенчмарком на этой машине; {} - если его нет или он повреждён"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-# Оптимизированные настройки для Ryzen 7
+
+# Оптимизированные настройки для Ryzen 7 (перекрываются профилем бенчмарка)
+_tuning_profile = load_tuning_profile()
 os.environ["OPENAI_API_KEY"] = "ollama"
 os.environ["OPENAI_API_BASE"] = "http://localhost:11434/v1"
-os.environ["OPENAI_MODEL_NAME"] = "tinyllama"
-os.environ["OPENAI_MAX_TOKENS"] = "2000"
-os.environ["OPENAI_TEMPERATURE"] = "0.3"
+os.environ["OPENAI_MODEL_NAME"] = str(_tuning_profile.get('model') or "tinyllama")
+os.environ["OPENAI_MAX_TOKENS"] = str(_tuning_profile.get('max_tokens') or 2000)
+os.environ["OPENAI_TEMPERATURE"] = str(_tuning_profile.get('temperature', 0.3))
 
-# Кэш для агентов
-_agent_cache = {}
+# Кэш для агентов (LRU: seed кандидатов свой на каждый запуск, без предела кэш бы только рос)
+AGENT_CACHE_SIZE = 32
+_agent_cache = OrderedDict()
 
+# Этапы конвейера в порядке выполнения
+PIPELINE_STAGES = ["translator", "planner", "developer", "reviewer"]
 
-def log_step(message):
-    """Выводит шаг выполнения с временной меткой"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {message}")
+# Роли агентов по этапам: (role, goal, backstory)
+AGENT_SPECS = {
+    "translator": (
+        "Translator",
+        """You are a prompt engineer. Your ONLY task is to convert user requests into EXACT technical specifications.
+
+            Rules:
+            1. Remove all natural language, keep only technical requirements
+            2. Specify EXACT output format (HTML, CSS, JS)
+            3. Forbid frameworks and libraries
+            4. Require single file output
+            5. Demand specific features
+
+            Example input: "Сделай красивый сайт с анимацией"
+            Example output: "Create ONE HTML file with: CSS animations, dark theme, grayscale effect. NO frameworks, NO external libraries. All code in one file."
+            """,
+        "You are a strict technical translator. You convert vague requests into precise specifications."
+    ),
+    "planner": (
+        "Planner",
+        "Create detailed technical plan. Must include specific steps and requirements.",
+        "You are Ася - senior technical planner. Always provide detailed plans."
+    ),
+    "developer": (
+        "Developer",
+        "Write complete, working code. Include all necessary HTML, CSS, JavaScript.",
+        "You are Джун-и - full-stack developer. Always provide runnable code."
+    ),
+    "reviewer": (
+        "Reviewer",
+        "Check code thoroughly. Verify it works and meets requirements.",
+        "You are Кай - strict code reviewer. Never approve incomplete code."
+    ),
+}
+
+# Заголовки этапов в execution_report.md
+STAGE_TITLES = {
+    "translator": "🔤 Переводчик",
+    "planner": "📋 Планировщик (Ася)",
+    "developer": "💻 Разработчик (Джун-и)",
+    "reviewer": "🔍 Ревьюер (Кай)",
+}
+
+STAGE_START_LOGS = {
+    "translator": "🔄 Запуск переводчика...",
+    "planner": "📋 Запуск планировщика...",
+    "developer": "💻 Запуск разработчика...",
+    "reviewer": "🔍 Запуск ревьюера...",
+}
+
+STAGE_EXPECTED_OUTPUT = {
+    "translator": "Technical specification with exact requirements",
+    "planner": "Detailed technical plan with specific code structure",
+    "developer": "Complete HTML code with CSS and JavaScript",
+    "reviewer": "Fixed and working HTML code",
+}
+
+# Таймауты Task (сек) для долгих этапов
+STAGE_TIMEOUTS = {
+    "developer": 180,
+    "reviewer": 120,
+}
+
+DEVELOPER_RETRY_PROMPT = """
+YOU MUST OUTPUT ONLY HTML CODE. NO TEXT. NO EXPLANATIONS.
+START YOUR RESPONSE WITH: <!DOCTYPE html>
+Create a dark-themed page with moving abstract pattern.
+YOUR ENTIRE RESPONSE MUST BE THE HTML CODE.
+"""
+
+# Дисковый кэш ответов этапов (AI_OFFICE_STAGE_CACHE=0 - отключить)
+_stage_cache = StageCache(
+    CACHE_PATH,
+    max_entries=int(os.environ.get("AI_OFFICE_STAGE_CACHE_MAX_ENTRIES", "500")),
+    enabled=os.environ.get("AI_OFFICE_STAGE_CACHE", "1") != "0",
+)
+
+# Исполнитель этапов: direct - один запрос к Ollama (CrewAI - запасной путь), crew - всегда через Crew
+STAGE_EXECUTOR = os.environ.get("AI_OFFICE_STAGE_EXECUTOR", "direct")
+
+# Общий HTTP-клиент быстрого пути (создаётся при первом запросе)
+_ollama_client = None
+_ollama_client_lock = threading.Lock()
 
 
 def auto_cleanup(max_age_hours: int = 24):
@@ -46,7 +160,7 @@ def auto_cleanup(max_age_hours: int = 24):
                     age = now - item.stat().st_mtime
                     if age > max_age_hours * 3600:
                         shutil.rmtree(item, ignore_errors=True)
-                        log_step(f"🧹 Удалена старая папка: {item.name}")
+                        emit("cleanup.removed", f"🧹 Удалена старая папка: {item.name}", path=str(item))
 
         # Чистим старые проекты (можно оставить, но с пометкой)
         if PROJECTS_PATH.exists():
@@ -55,19 +169,18 @@ def auto_cleanup(max_age_hours: int = 24):
                     age = now - item.stat().st_mtime
                     if age > max_age_hours * 24 * 7:  # Неделя
                         shutil.rmtree(item, ignore_errors=True)
-                        log_step(f"🗑️ Удален старый проект: {item.name}")
+                        emit("cleanup.removed", f"🗑️ Удален старый проект: {item.name}", path=str(item))
     except Exception as e:
-        log_step(f"⚠️ Ошибка при очистке: {e}")
+        emit("cleanup.error", f"⚠️ Ошибка при очистке: {e}", level=WARNING, error=str(e))
 
 
 def create_backup(async_mode=True):
     """Создаёт бекап асинхронно"""
     if async_mode:
-        import threading
         thread = threading.Thread(target=_create_backup_sync)
         thread.daemon = True
         thread.start()
-        log_step("🔄 Бекап запущен в фоне")
+        emit("backup.scheduled", "🔄 Бекап запущен в фоне")
         return {"success": True, "async": True}
     else:
         return _create_backup_sync()
@@ -76,7 +189,7 @@ def create_backup(async_mode=True):
 def _create_backup_sync():
     """Синхронное создание бекапа"""
     try:
-        log_step("Создание бекапа...")
+        emit("backup.start", "Создание бекапа...")
         BACKUP_PATH.mkdir(parents=True, exist_ok=True)
 
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -87,12 +200,12 @@ def _create_backup_sync():
         if PROJECTS_PATH.exists():
             projects_backup = backup_dir / "projects"
             shutil.copytree(PROJECTS_PATH, projects_backup, dirs_exist_ok=True)
-            log_step(f"✅ Проекты сохранены")
+            emit("backup.projects", "✅ Проекты сохранены")
 
-        log_step(f"✅ Бекап завершён: {backup_name}")
+        emit("backup.done", f"✅ Бекап завершён: {backup_name}", name=backup_name)
         return {"success": True, "backup_dir": str(backup_dir), "timestamp": timestamp}
     except Exception as e:
-        log_step(f"❌ Ошибка бекапа: {str(e)}")
+        emit("backup.error", f"❌ Ошибка бекапа: {str(e)}", level=ERROR, error=str(e))
         return {"success": False, "error": str(e)}
 
 
@@ -104,20 +217,35 @@ def cleanup_temp_files(project_files=None):
     if TEMP_PATH.exists():
         try:
             shutil.rmtree(TEMP_PATH, ignore_errors=True)
-            log_step("🧹 Временные файлы очищены")
+            emit("cleanup.temp", "🧹 Временные файлы очищены")
         except:
             pass
 
 
-def create_agent(role, goal, backstory):
-    """Создаёт агента с кэшированием"""
-    cache_key = f"{role}_{goal[:50]}"
+def create_agent(role, goal, backstory, max_tokens=None, temperature=None, seed=None, model=None):
+    """Создаёт агента с кэшированием.
+
+    max_tokens, temperature, seed и model - собственные параметры LLM агента (иначе берутся из окружения).
+    """
+    cache_key = f"{role}_{goal[:50]}_{max_tokens}_{temperature}_{seed}_{model}"
 
     if cache_key in _agent_cache:
-        log_step(f"⚡ Агент {role} взят из кэша")
+        _agent_cache.move_to_end(cache_key)
+        emit("agent.cached", f"⚡ Агент {role} взят из кэша", role=role)
         return _agent_cache[cache_key]
 
-    log_step(f"🤖 Создание агента: {role}")
+    emit("agent.create", f"🤖 Создание агента: {role}", role=role)
+
+    agent_kwargs = {}
+    if max_tokens or temperature is not None or seed is not None or model:
+        agent_kwargs['llm'] = LLM(
+            model=f"openai/{model or os.environ['OPENAI_MODEL_NAME']}",
+            base_url=os.environ["OPENAI_API_BASE"],
+            api_key=os.environ["OPENAI_API_KEY"],
+            temperature=temperature if temperature is not None else float(os.environ["OPENAI_TEMPERATURE"]),
+            max_tokens=max_tokens or int(os.environ["OPENAI_MAX_TOKENS"]),
+            seed=seed,
+        )
 
     agent = Agent(
         role=role,
@@ -125,14 +253,329 @@ def create_agent(role, goal, backstory):
         backstory=backstory,
         verbose=False,
         allow_delegation=False,
-        max_rpm=10,
-        max_iter=3,
+        max_rpm=_tuning_profile.get('max_rpm', 10),
+        max_iter=_tuning_profile.get('max_iter', 3),
+        **agent_kwargs,
     )
 
     _agent_cache[cache_key] = agent
+    while len(_agent_cache) > AGENT_CACHE_SIZE:
+        _agent_cache.popitem(last=False)
     return agent
 
 
+def get_tuning_profile():
+    """Профиль настроек, загруженный при старте"""
+    return _tuning_profile
+
+
+def stage_llm_plan(stages, stage_max_tokens=None):
+    """Модель и лимит токенов по этапам из профиля; лимит сложности (auto) тоже учитывается"""
+    tuned_stages = _tuning_profile.get('stages') or {}
+    plan = {}
+    for stage in stages:
+        tuned = tuned_stages.get(stage) or {}
+        limits = [limit for limit in (stage_max_tokens, tuned.get('max_tokens')) if limit]
+        plan[stage] = {'model': tuned.get('model'), 'max_tokens': min(limits) if limits else None}
+    return plan
+
+
+def stage_llm(manifest, stage):
+    """(model, max_tokens) этапа запуска; модель из манифеста (повтор с --model) важнее профиля"""
+    planned = (manifest.get('stage_llm') or {}).get(stage)
+    if planned is None:
+        return manifest.get('model'), manifest.get('stage_max_tokens')
+    return manifest.get('model') or planned['model'], planned['max_tokens']
+
+
+def get_stage_cache():
+    """Возвращает дисковый кэш этапов (для статистики и очистки)"""
+    return _stage_cache
+
+
+def get_ollama_client():
+    """Общий клиент Ollama для прямых запросов этапов"""
+    global _ollama_client
+    with _ollama_client_lock:
+        if _ollama_client is None:
+            _ollama_client = OllamaClient()
+        return _ollama_client
+
+
+def llm_settings(max_tokens=None, temperature=None, seed=None, model=None):
+    """Модель и параметры сэмплинга с подстановкой значений из окружения"""
+    model = model or os.environ.get("OPENAI_MODEL_NAME", "")
+    settings = {
+        'temperature': float(temperature if temperature is not None else os.environ["OPENAI_TEMPERATURE"]),
+        'max_tokens': int(max_tokens or os.environ["OPENAI_MAX_TOKENS"]),
+        'seed': seed,
+    }
+    return model, settings
+
+
+def _llm_settings(agent):
+    """Модель и параметры сэмплинга, с которыми агент реально обращается к LLM"""
+    llm = getattr(agent, 'llm', None)
+    model, settings = llm_settings(
+        getattr(llm, 'max_tokens', None),
+        getattr(llm, 'temperature', None),
+        getattr(llm, 'seed', None),
+    )
+    # Модель из LLM-объекта имеет префикс провайдера (openai/...)
+    llm_model = getattr(llm, 'model', None)
+    if isinstance(llm_model, str) and llm_model:
+        model = llm_model.split("/", 1)[-1]
+    return model, settings
+
+
+def stage_cache_key(description, expected_output, agent_spec, model, settings):
+    """Ключ кэша этапа - общий для Crew и прямых запросов к Ollama"""
+    return StageCache.make_key(description + "\n" + str(expected_output), agent_spec, model, settings)
+
+
+def _requirements_dict(requirements) -> dict:
+    """Приводит требования (ProjectRequirements или dict) к словарю"""
+    if requirements is None:
+        return {}
+    if hasattr(requirements, 'to_dict'):
+        return requirements.to_dict()
+    if isinstance(requirements, dict):
+        return requirements
+    return {}
+
+
+def _has_requirements(requirements: dict) -> bool:
+    """Есть ли в требованиях что-то, по чему ComplexityAnalyzer может судить о сложности"""
+    return any(requirements.get(name) for name in
+               ('technologies', 'features', 'style', 'animation_speed', 'forbidden'))
+
+
+def plan_stages(pipeline: str = "full", requirements=None):
+    """Определяет список этапов и лимит токенов на этап.
+
+    full - все четыре этапа без ограничений, auto - по уровню ComplexityAnalyzer.
+    Без требований (не было диалога с менеджером) auto оценить сложность не может и идёт как full.
+    """
+    if pipeline not in ("full", "auto"):
+        raise ValueError(f"Неизвестный режим конвейера: {pipeline}")
+
+    requirements = _requirements_dict(requirements)
+    if pipeline == "auto" and not _has_requirements(requirements):
+        emit("pipeline.plan", "🧮 Требований нет - сложность не оценить, полный конвейер",
+             complexity=None, stages=list(PIPELINE_STAGES))
+        return list(PIPELINE_STAGES), None
+    if pipeline == "full":
+        return list(PIPELINE_STAGES), None
+
+    level = ComplexityAnalyzer.analyze(requirements)
+    stages = [stage for stage in PIPELINE_STAGES if stage in level.required_agents]
+    emit("pipeline.plan", f"🧮 Сложность: {level.name} → этапы: {', '.join(stages)}, до {level.max_tokens} токенов",
+         complexity=level.name, stages=stages, max_tokens=level.max_tokens)
+    return stages, level.max_tokens
+
+
+def _kickoff_crew(stage, agent, task, on_event=None, cancel_event=None):
+    """Этап через одноагентный Crew; возвращает (текст или None, прерван ли)"""
+    if on_event is None and cancel_event is None:
+        stage_crew = Crew(
+            agents=[agent],
+            tasks=[task],
+            verbose=False
+        )
+        return str(stage_crew.kickoff()), False
+
+    # Потоковый режим: токены уходят в колбэк по мере генерации
+    stage_crew = Crew(
+        agents=[agent],
+        tasks=[task],
+        verbose=False,
+        stream=True
+    )
+    streaming = stage_crew.kickoff()
+    for chunk in streaming:
+        if cancel_event is not None and cancel_event.is_set():
+            return None, True
+        if chunk.content and on_event:
+            on_event("token", {'stage': stage, 'text': chunk.content})
+    result = streaming.result
+    return (str(result) if result is not None else None), False
+
+
+def _direct_chat(stage, agent, task, model, settings, on_event=None, cancel_event=None, on_usage=None):
+    """Этап одним потоковым запросом к Ollama с role/goal/backstory агента в системном промпте"""
+
+    def on_token(text):
+        if on_event:
+            on_event("token", {'stage': stage, 'text': text})
+
+    output = get_ollama_client().chat(
+        stage_messages(agent_system_prompt(agent.role, agent.goal, agent.backstory),
+                       task.description, task.expected_output),
+        model=model,
+        temperature=settings['temperature'],
+        max_tokens=settings['max_tokens'],
+        seed=settings['seed'],
+        on_token=on_token,
+        should_stop=cancel_event.is_set if cancel_event is not None else None,
+        on_usage=on_usage,
+    )
+    if cancel_event is not None and cancel_event.is_set():
+        return None, True
+    return output, False
+
+
+def _run_stage(stage, agent, task, use_cache=True, on_event=None, cancel_event=None, executor=None):
+    """Выполняет один этап, повторные запросы берутся из дискового кэша.
+
+    executor - direct (один запрос к Ollama, при сетевой ошибке - через Crew) или crew,
+    по умолчанию STAGE_EXECUTOR. Агенты с инструментами всегда идут через Crew.
+    on_event(event_type, data) получает события stage_start, token и stage_end.
+    cancel_event (threading.Event) прекращает чтение потока - этап вернёт None.
+    """
+    model, settings = _llm_settings(agent)
+    key = stage_cache_key(
+        task.description, task.expected_output,
+        {'role': agent.role, 'goal': agent.goal, 'backstory': agent.backstory},
+        model, settings,
+    )
+
+    started = time.time()
+    if on_event:
+        on_event("stage_start", {'stage': stage})
+
+    if use_cache:
+        cached = _stage_cache.get(key)
+        if cached is not None:
+            emit("stage.end", f"⚡ {stage}: ответ взят из кэша", stage=stage, cached=True,
+                 duration=round(time.time() - started, 3), chars=len(cached))
+            if on_event:
+                on_event("token", {'stage': stage, 'text': cached})
+                on_event("stage_end", {'stage': stage, 'duration': time.time() - started,
+                                       'cached': True, 'chars': len(cached)})
+            return cached
+
+    executor = executor or STAGE_EXECUTOR
+    output, cancelled = None, False
+    usage = {}
+    if executor == "direct" and not getattr(agent, 'tools', None):
+        try:
+            output, cancelled = _direct_chat(stage, agent, task, model, settings, on_event, cancel_event,
+                                             on_usage=usage.update)
+        except httpx.HTTPError as e:
+            emit("stage.fallback", f"⚠️ {stage}: прямой запрос к Ollama не удался ({e}), выполняю через CrewAI",
+                 level=WARNING, stage=stage, error=str(e))
+            executor = "crew"
+    else:
+        executor = "crew"
+
+    if executor == "crew":
+        output, cancelled = _kickoff_crew(stage, agent, task, on_event, cancel_event)
+
+    duration = time.time() - started
+    if on_event:
+        on_event("stage_end", {'stage': stage, 'duration': duration,
+                               'cached': False, 'chars': len(output or ''), 'cancelled': cancelled})
+    emit("stage.end", f"⛔ {stage}: генерация прервана" if cancelled else None,
+         level=WARNING if cancelled else INFO, stage=stage, executor=executor, model=model, cached=False,
+         cancelled=cancelled, duration=round(duration, 3), chars=len(output or ''),
+         prompt_tokens=usage.get('prompt_tokens'), completion_tokens=usage.get('completion_tokens'))
+
+    if output is None:
+        return None
+    if use_cache and output.strip():
+        _stage_cache.put(key, output, {'stage': stage, 'role': agent.role})
+    return output
+
+
+# Значение background/background-color и CSS-переменные (--name: value), на которые оно может ссылаться
+BACKGROUND_RE = re.compile(r"background(?:-color)?\s*:\s*([^;}]+)", re.I)
+CSS_VAR_RE = re.compile(r"(--[\w-]+)\s*:\s*([^;}]+)")
+CSS_COLOR_RE = re.compile(r"#[0-9a-f]{3,8}\b|(?:rgba?|hsla?)\([^)]*\)|\b[a-z]+\b", re.I)
+# Фон тёмный, если относительная яркость (WCAG) его цветов не выше порога: #333 - 0.03, #808080 - 0.22
+DARK_LUMINANCE_MAX = 0.2
+# Именованные цвета, которые модели чаще всего пишут в фоне
+CSS_COLOR_NAMES = {
+    'black': (0, 0, 0), 'navy': (0, 0, 128), 'midnightblue': (25, 25, 112), 'darkslategray': (47, 79, 79),
+    'darkslategrey': (47, 79, 79), 'indigo': (75, 0, 130), 'maroon': (128, 0, 0), 'darkblue': (0, 0, 139),
+    'darkgreen': (0, 100, 0), 'purple': (128, 0, 128), 'darkred': (139, 0, 0), 'dimgray': (105, 105, 105),
+    'dimgrey': (105, 105, 105), 'white': (255, 255, 255), 'whitesmoke': (245, 245, 245),
+    'ivory': (255, 255, 240), 'snow': (255, 250, 250), 'lightgray': (211, 211, 211),
+    'lightgrey': (211, 211, 211), 'silver': (192, 192, 192), 'gray': (128, 128, 128), 'grey': (128, 128, 128),
+}
+
+
+def is_html_task(task):
+    lower = task.lower()
+    return "сайт" in lower or "html" in lower or "страниц" in lower
+
+
+def _is_html(result_text):
+    lower = result_text.lower()
+    return "<html" in lower or "!doctype" in lower
+
+
+def _css_rgb(color):
+    """(r, g, b) цвета CSS: #hex, rgb()/rgba(), hsl()/hsla() или имя из CSS_COLOR_NAMES; None - не разобрать"""
+    color = color.strip().lower()
+    if color.startswith("#"):
+        digits = color[1:]
+        if len(digits) in (3, 4):
+            digits = "".join(c * 2 for c in digits[:3])
+        if len(digits) not in (6, 8):
+            return None
+        return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+
+    numbers = re.findall(r"-?[\d.]+%?", color)
+    try:
+        if color.startswith("rgb") and len(numbers) >= 3:
+            return tuple(float(n[:-1]) * 2.55 if n.endswith("%") else float(n) for n in numbers[:3])
+        if color.startswith("hsl") and len(numbers) >= 3:
+            hue, saturation, lightness = (float(n.rstrip("%")) for n in numbers[:3])
+            rgb = colorsys.hls_to_rgb(hue / 360 % 1, lightness / 100, saturation / 100)
+            return tuple(channel * 255 for channel in rgb)
+    except ValueError:
+        return None
+    return CSS_COLOR_NAMES.get(color)
+
+
+def _luminance(rgb):
+    """Относительная яркость sRGB-цвета по WCAG, 0 - чёрный, 1 - белый"""
+    def linear(channel):
+        channel = min(255.0, max(0.0, channel)) / 255
+        return channel / 12.92 if channel <= 0.03928 else ((channel + 0.055) / 1.055) ** 2.4
+
+    r, g, b = (linear(channel) for channel in rgb)
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def has_dark_background(result_text):
+    """Есть ли background/background-color, все цвета которого тёмные (var(--x) раскрывается по объявлению)"""
+    variables = {name: value for name, value in CSS_VAR_RE.findall(result_text)}
+    for value in BACKGROUND_RE.findall(result_text):
+        value = re.sub(r"var\(\s*(--[\w-]+)[^)]*\)", lambda m: variables.get(m.group(1), ""), value)
+        colors = [rgb for rgb in map(_css_rgb, CSS_COLOR_RE.findall(value)) if rgb is not None]
+        if colors and all(_luminance(rgb) <= DARK_LUMINANCE_MAX for rgb in colors):
+            return True
+    return False
+
+
+def _task_issues(result_text, task):
+    """Проверки по содержанию задачи: анимация, тёмная тема"""
+    issues = []
+
+    # Есть ли анимация
+    if "анимац" in task.lower() or "движ" in task.lower():
+        if "@keyframes" not in result_text and "animation" not in result_text:
+            issues.append("❌ Нет анимации (нет @keyframes или animation)")
+
+    # Есть ли темная тема
+    if "темн" in task.lower() or "dark" in task.lower():
+        if not has_dark_background(result_text):
+            issues.append("❌ Нет темного фона")
+
+    return issues
+
+
 def validate_result(result_text, task):
     """Проверяет, действительно ли агенты что-то сделали"""
     issues = []
@@ -141,28 +584,124 @@ def validate_result(result_text, task):
     if len(result_text) < 50:
         issues.append(f"❌ Результат слишком короткий ({len(result_text)} символов)")
 
-    # Проверка 2: Есть ли реальный код
-    if "def " not in result_text and "class " not in result_text and "```" not in result_text:
-        issues.append("❌ В результате нет кода (нет def/class/```)")
+    # Проверка 2: Есть ли реальный код (HTML-документ тоже код)
+    if ("def " not in result_text and "class " not in result_text and "```" not in result_text
+            and not _is_html(result_text)):
+        issues.append("❌ В результате нет кода (нет def/class/```/HTML)")
 
     # Проверка 3: Есть ли HTML для сайта
-    if "сайт" in task.lower() or "html" in task.lower() or "страниц" in task.lower():
-        if "<html" not in result_text.lower() and "!doctype" not in result_text.lower():
-            issues.append("❌ Для сайта нет HTML кода")
+    if is_html_task(task) and not _is_html(result_text):
+        issues.append("❌ Для сайта нет HTML кода")
 
-    # Проверка 4: Есть ли анимация
-    if "анимац" in task.lower() or "движ" in task.lower():
-        if "@keyframes" not in result_text and "animation" not in result_text:
-            issues.append("❌ Нет анимации (нет @keyframes или animation)")
+    # Проверки 4-5: анимация и тёмная тема
+    issues += _task_issues(result_text, task)
 
-    # Проверка 5: Есть ли темная тема
-    if "темн" in task.lower() or "dark" in task.lower():
-        if "background-color: #" not in result_text and "background: #" not in result_text:
-            issues.append("❌ Нет темного фона")
+    return issues
+
+
+def _html_structure_issues(result_text):
+    """Структурные проверки HTML-документа"""
+    issues = []
+    text = result_text.strip()
+    lower = text.lower()
+
+    # Допускаем обёртку в markdown-блок
+    if lower.startswith("```"):
+        text = text.split("\n", 1)[-1]
+        lower = text.lower()
+
+    if not lower.lstrip().startswith("<!doctype html"):
+        issues.append("❌ Документ не начинается с <!DOCTYPE html>")
+    if "</html>" not in lower:
+        issues.append("❌ Нет закрывающего </html>")
+    if "<body" not in lower or "</body>" not in lower:
+        issues.append("❌ Нет <body>...</body>")
+    if "<style" not in lower:
+        issues.append("❌ Нет блока <style>")
+    if lower.count("<script") != lower.count("</script>"):
+        issues.append("❌ Незакрытый <script>")
 
     return issues
 
 
+def score_candidate(result_text, task):
+    """Оценивает кандидата разработчика: (оценка, проблемы), 0 - все проверки пройдены"""
+    if is_html_task(task) or _is_html(result_text):
+        # HTML: структура документа и содержание задачи, без требования def/class/```
+        issues = _html_structure_issues(result_text) + _task_issues(result_text, task)
+    else:
+        issues = validate_result(result_text, task)
+    return -len(issues), issues
+
+
+def candidate_seed(manifest, index):
+    """Seed кандидата: свой для каждого запуска (от task_timestamp), тот же при продолжении запуска.
+
+    Seed входит в ключ кэша этапов, поэтому ответы кандидатов с seed в кэш этапов не попадают.
+    """
+    return (zlib.crc32(manifest['task_timestamp'].encode()) + index) % 2 ** 31
+
+
+def run_developer_candidates(description, task, count, max_tokens=None, use_cache=True, on_event=None,
+                             model=None, seeds=None):
+    """Параллельно генерирует count вариантов разработчика и возвращает лучший.
+
+    Кандидаты отличаются temperature и seed (seeds - по кандидату, см. candidate_seed). Как только один проходит все проверки,
+    остальным выставляется флаг отмены и их потоки больше не читаются. С seeds кэш этапов не используется:
+    ключ с seed запуска другой раз не совпадёт.
+    """
+    base_temperature = float(os.environ["OPENAI_TEMPERATURE"])
+    cancel_event = threading.Event()
+    use_cache = use_cache and not seeds
+
+    def run_candidate(index):
+        agent = create_agent(
+            *AGENT_SPECS["developer"],
+            max_tokens=max_tokens,
+            temperature=min(1.0, base_temperature + index * 0.2),
+            seed=seeds[index] if seeds else None,
+            model=model,
+        )
+        candidate_task = build_stage_task("developer", agent, description)
+        return _run_stage(f"developer#{index + 1}", agent, candidate_task, use_cache, on_event, cancel_event)
+
+    emit("candidates.start", f"🎲 Запуск {count} кандидатов разработчика параллельно...", count=count)
+    best_text, best_score, best_index = None, None, None
+
+    executor = ThreadPoolExecutor(max_workers=count)
+    try:
+        # Копия контекста на поток - события кандидатов получают task_id запуска
+        futures = {executor.submit(contextvars.copy_context().run, run_candidate, i): i for i in range(count)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                emit("candidate.error", f"⚠️ Кандидат {index + 1} упал: {e}", level=WARNING,
+                     stage=f"developer#{index + 1}", error=str(e))
+                continue
+            if text is None:
+                continue
+
+            score, issues = score_candidate(text, task)
+            emit("candidate.scored", f"🎲 Кандидат {index + 1}: {len(issues)} проблем",
+                 stage=f"developer#{index + 1}", issues=len(issues))
+            if best_score is None or score > best_score:
+                best_text, best_score, best_index = text, score, index
+
+            if score == 0:
+                emit("candidate.accepted", f"✅ Кандидат {index + 1} прошёл все проверки, остальные отменяются",
+                     stage=f"developer#{index + 1}")
+                cancel_event.set()
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if best_index is not None:
+        emit("candidates.selected", f"🏆 Выбран кандидат {best_index + 1}", stage=f"developer#{best_index + 1}")
+    return best_text
+
+
 def save_agent_outputs(planner_output, developer_output, reviewer_output, task, temp_dir):
     """Сохраняет результаты каждого агента"""
     timestamp = datetime.now().strftime("%H%M%S")
@@ -174,7 +713,7 @@ def save_agent_outputs(planner_output, developer_output, reviewer_output, task,
             f.write("# План выполнения\n\n")
             f.write(f"**Задача:** {task}\n\n")
             f.write(str(planner_output))
-        log_step(f"📋 План сохранен: {plan_file}")
+        emit("artifact.saved", f"📋 План сохранен: {plan_file}", stage="planner", path=str(plan_file))
 
     # Сохраняем код разработчика
     if developer_output:
@@ -183,7 +722,7 @@ def save_agent_outputs(planner_output, developer_output, reviewer_output, task,
             f.write("# Код разработчика\n\n")
             f.write(f"# Задача: {task}\n\n")
             f.write(str(developer_output))
-        log_step(f"💻 Код разработчика сохранен: {dev_file}")
+        emit("artifact.saved", f"💻 Код разработчика сохранен: {dev_file}", stage="developer", path=str(dev_file))
 
     # Сохраняем ревью
     if reviewer_output:
@@ -191,7 +730,7 @@ def save_agent_outputs(planner_output, developer_output, reviewer_output, task,
         with open(review_file, 'w', encoding='utf-8') as f:
             f.write("# Результат проверки\n\n")
             f.write(str(reviewer_output))
-        log_step(f"🔍 Ревью сохранено: {review_file}")
+        emit("artifact.saved", f"🔍 Ревью сохранено: {review_file}", stage="reviewer", path=str(review_file))
 
 
 def generate_project_name(user_task: str, requirements=None):
@@ -219,127 +758,49 @@ def generate_project_name(user_task: str, requirements=None):
     return "Project"
 
 
-def run_crew(user_task: str, technical_spec: str = None, requirements=None):
-    """Запускает агентов с задачей и опциональным ТЗ"""
-
-    # Запускаем автоочистку в фоне
-    auto_cleanup()
-
-    # Если есть ТЗ от менеджера, используем его
-    if technical_spec:
-        final_task = f"""
+def build_final_task(user_task: str, technical_spec: str = None) -> str:
+    """Склеивает задачу пользователя с ТЗ от менеджера"""
+    if not technical_spec:
+        return user_task
+    return f"""
         ОСНОВНАЯ ЗАДАЧА:
         {user_task}
 
         ТЕХНИЧЕСКОЕ ЗАДАНИЕ (строго соблюдать):
         {technical_spec}
         """
-        log_step("📋 Используется детальное ТЗ от менеджера")
-    else:
-        final_task = user_task
-
-    log_step(f"📥 Получена задача: {final_task[:100]}...")
 
-    # Создаём временную папку с уникальным именем
-    task_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    task_temp_dir = TEMP_PATH / f"task_{task_timestamp}"
-    task_temp_dir.mkdir(parents=True, exist_ok=True)
-    log_step(f"📂 Рабочая папка: {task_temp_dir}")
 
-    # Создаем отчет о выполнении
-    report_file = task_temp_dir / "execution_report.md"
-    with open(report_file, 'w', encoding='utf-8') as f:
-        f.write(f"# Отчет о выполнении задачи\n\n")
-        f.write(f"**Задача:** {final_task}\n")
-        f.write(f"**Начало:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        f.write("## Этапы выполнения\n\n")
-
-    try:
-        # Создаём агентов
-        planner = create_agent(
-            "Planner",
-            "Create detailed technical plan. Must include specific steps and requirements.",
-            "You are Ася - senior technical planner. Always provide detailed plans."
-        )
-
-        developer = create_agent(
-            "Developer",
-            "Write complete, working code. Include all necessary HTML, CSS, JavaScript.",
-            "You are Джун-и - full-stack developer. Always provide runnable code."
-        )
-
-        reviewer = create_agent(
-            "Reviewer",
-            "Check code thoroughly. Verify it works and meets requirements.",
-            "You are Кай - strict code reviewer. Never approve incomplete code."
-        )
-
-        # Новый агент - Переводчик
-        translator = create_agent(
-            "Translator",
-            """You are a prompt engineer. Your ONLY task is to convert user requests into EXACT technical specifications.
-
-            Rules:
-            1. Remove all natural language, keep only technical requirements
-            2. Specify EXACT output format (HTML, CSS, JS)
-            3. Forbid frameworks and libraries
-            4. Require single file output
-            5. Demand specific features
-
-            Example input: "Сделай красивый сайт с анимацией"
-            Example output: "Create ONE HTML file with: CSS animations, dark theme, grayscale effect. NO frameworks, NO external libraries. All code in one file."
-            """,
-            "You are a strict technical translator. You convert vague requests into precise specifications."
-        )
-
-        # Задача переводчика
-        translate_task = Task(
-            description=f"""
+def stage_input(stage, outputs, final_task):
+    """Входные данные этапа: результат ближайшего выполненного предыдущего этапа"""
+    if stage == "translator":
+        return final_task
+    if stage == "planner":
+        return outputs.get("translator") or final_task
+    if stage == "developer":
+        # Без планировщика разработчик работает прямо по ТЗ
+        return outputs.get("planner") or outputs.get("translator") or final_task
+    if stage == "reviewer":
+        return outputs.get("developer")
+    raise ValueError(f"Неизвестный этап: {stage}")
+
+
+def stage_prompt(stage, text):
+    """Описание Task для этапа"""
+    if stage == "translator":
+        return f"""
             Convert this user request into EXACT technical specifications:
 
-            {final_task}
+            {text}
 
             Your response MUST be ONLY the technical spec. No explanations, no comments.
             The spec must specify: file format, required features, forbidden elements.
-            """,
-            agent=translator,
-            expected_output="Technical specification with exact requirements",
-        )
-
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write(f"### 🔤 Переводчик\n\n")
-            f.write(f"**Начало:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-
-        # === ШАГ 1: ПЕРЕВОДЧИК ===
-        log_step("🔄 Запуск переводчика...")
-        translate_crew = Crew(
-            agents=[translator],
-            tasks=[translate_task],
-            verbose=False
-        )
-        translate_result = translate_crew.kickoff()
-
-        # Проверяем, что результат не пустой
-        if translate_result is None:
-            log_step("❌ Переводчик вернул пустой результат")
-            translate_result = final_task  # запасной вариант
-
-        log_step(f"📝 Техническое задание: {str(translate_result)[:100]}...")
-
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write(f"**Результат:**\n```\n{translate_result}\n```\n\n")
-            f.write(f"**Завершение:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-            f.write("---\n\n")
-            f.write(f"### 📋 Планировщик (Ася)\n\n")
-            f.write(f"**Начало:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-
-        # === ШАГ 2: ПЛАНИРОВЩИК ===
-        log_step("📋 Запуск планировщика...")
-        plan_task = Task(
-            description=f"""
+            """
+    if stage == "planner":
+        return f"""
             Create a DETAILED TECHNICAL PLAN based on this specification:
 
-            {translate_result}
+            {text}
 
             Your plan MUST include:
             1. EXACT HTML structure
@@ -348,33 +809,13 @@ def run_crew(user_task: str, technical_spec: str = None, requirements=None):
             4. Color scheme (dark theme)
 
             The plan should be IMPLEMENTATION-READY.
-            """,
-            agent=planner,
-            expected_output="Detailed technical plan with specific code structure",
-        )
-
-        planner_crew = Crew(
-            agents=[planner],
-            tasks=[plan_task],
-            verbose=False
-        )
-        planner_result = planner_crew.kickoff()
-
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write(f"**Результат:**\n```\n{planner_result}\n```\n\n")
-            f.write(f"**Завершение:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-            f.write("---\n\n")
-            f.write(f"### 💻 Разработчик (Джун-и)\n\n")
-            f.write(f"**Начало:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-
-        # === ШАГ 3: РАЗРАБОТЧИК ===
-        log_step("💻 Запуск разработчика...")
-        dev_task = Task(
-            description=f"""
+            """
+    if stage == "developer":
+        return f"""
             WRITE COMPLETE HTML CODE based on this plan.
 
             Plan:
-            {planner_result}
+            {text}
 
             CRITICAL REQUIREMENTS:
             - Output MUST be ONLY the HTML code
@@ -387,57 +828,12 @@ def run_crew(user_task: str, technical_spec: str = None, requirements=None):
             - JUST THE CODE, nothing else
 
             The code must work when saved as .html and opened in browser.
-            """,
-            agent=developer,
-            expected_output="Complete HTML code with CSS and JavaScript",
-            timeout=180,
-        )
-
-        dev_crew = Crew(
-            agents=[developer],
-            tasks=[dev_task],
-            verbose=False
-        )
-        developer_result = dev_crew.kickoff()
-
-        # Проверяем, что разработчик выдал код, а не текст
-        dev_result_str = str(developer_result)
-        if "<!DOCTYPE" not in dev_result_str and "<html" not in dev_result_str:
-            log_step("⚠️ Разработчик не выдал HTML, пробую еще раз...")
-
-            dev_task_retry = Task(
-                description=f"""
-                YOU MUST OUTPUT ONLY HTML CODE. NO TEXT. NO EXPLANATIONS.
-                START YOUR RESPONSE WITH: <!DOCTYPE html>
-                Create a dark-themed page with moving abstract pattern.
-                YOUR ENTIRE RESPONSE MUST BE THE HTML CODE.
-                """,
-                agent=developer,
-                expected_output="<!DOCTYPE html> ... </html>",
-                timeout=120,
-            )
-
-            dev_crew_retry = Crew(
-                agents=[developer],
-                tasks=[dev_task_retry],
-                verbose=False
-            )
-            developer_result = dev_crew_retry.kickoff()
-
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write(f"**Результат:**\n```html\n{developer_result}\n```\n\n")
-            f.write(f"**Завершение:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-            f.write("---\n\n")
-            f.write(f"### 🔍 Ревьюер (Кай)\n\n")
-            f.write(f"**Начало:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-
-        # === ШАГ 4: РЕВЬЮЕР ===
-        log_step("🔍 Запуск ревьюера...")
-        review_task = Task(
-            description=f"""
+            """
+    if stage == "reviewer":
+        return f"""
             REVIEW this HTML code:
 
-            {developer_result}
+            {text}
 
             CHECK:
             1. Does it start with <!DOCTYPE>?
@@ -448,71 +844,161 @@ def run_crew(user_task: str, technical_spec: str = None, requirements=None):
             If ANY requirement is missing, FIX THE CODE.
             OUTPUT THE FINAL, WORKING HTML CODE ONLY.
             NO EXPLANATIONS. JUST THE CODE.
-            """,
-            agent=reviewer,
-            expected_output="Fixed and working HTML code",
-            timeout=120,
-        )
+            """
+    raise ValueError(f"Неизвестный этап: {stage}")
 
-        review_crew = Crew(
-            agents=[reviewer],
-            tasks=[review_task],
-            verbose=False
-        )
-        reviewer_result = review_crew.kickoff()
-
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write(f"**Результат:**\n```html\n{reviewer_result}\n```\n\n")
-            f.write(f"**Завершение:** {datetime.now().strftime('%H:%M:%S')}\n\n")
-
-        # Сохраняем результаты всех агентов
-        save_agent_outputs(planner_result, developer_result, reviewer_result, final_task, task_temp_dir)
-
-        # Берем финальный результат (от ревьюера)
-        final_result = reviewer_result
-
-        # Проверяем результат
-        result_text = str(final_result)
-        issues = validate_result(result_text, final_task)
-
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write("## ✅ Итоговая проверка\n\n")
-            if issues:
-                f.write("### ❌ Найденные проблемы:\n\n")
-                for issue in issues:
-                    f.write(f"- {issue}\n")
-                f.write("\n⚠️ Требуется доработка!\n")
-                log_step("⚠️ Обнаружены проблемы в результате:")
-                for issue in issues:
-                    log_step(f"  {issue}")
-            else:
-                f.write("✅ Все проверки пройдены! Код готов.\n")
-                log_step("✅ Все проверки пройдены!")
-
-        # Сохраняем финальный результат в разных форматах
-        html_file = task_temp_dir / "index.html"
-        with open(html_file, 'w', encoding='utf-8') as f:
-            # Извлекаем HTML если он есть в markdown
-            html_content = result_text
-            if "```html" in result_text:
-                html_content = re.findall(r'```html\n(.*?)```', result_text, re.DOTALL)
-                if html_content:
-                    html_content = html_content[0]
-            elif "```" in result_text:
-                code_blocks = re.findall(r'```\n(.*?)```', result_text, re.DOTALL)
-                if code_blocks:
-                    html_content = code_blocks[0]
-
-            f.write(html_content)
-
-        log_step(f"✅ HTML файл сохранен: {html_file}")
-        log_step(f"✅ Отчет сохранен: {report_file}")
-
-        # Если есть HTML, создаем превью
-        if html_file.exists():
-            preview_file = task_temp_dir / "preview.html"
-            with open(preview_file, 'w', encoding='utf-8') as f:
-                f.write("""<!DOCTYPE html>
+
+def agent_system_prompt(role, goal, backstory):
+    """Системный промпт из role/goal/backstory (для прямых запросов без CrewAI)"""
+    return f"You are {role}. {backstory}\nYour personal goal is: {goal}"
+
+
+def stage_system_prompt(stage):
+    """Системный промпт агента этапа"""
+    return agent_system_prompt(*AGENT_SPECS[stage])
+
+
+def stage_messages(system_prompt, description, expected_output):
+    """Сообщения прямого запроса: та же постановка, что CrewAI даёт агенту, без обвязки ReAct"""
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': f"{description}\n\nThis is the expected criteria for your final answer: "
+                                    f"{expected_output}"},
+    ]
+
+
+def needs_developer_retry(developer_result):
+    """Разработчик выдал текст вместо HTML"""
+    text = str(developer_result)
+    return "<!DOCTYPE" not in text and "<html" not in text
+
+
+def build_stage_task(stage, agent, description):
+    """Создаёт Task этапа"""
+    task_kwargs = {}
+    if stage in STAGE_TIMEOUTS:
+        task_kwargs['timeout'] = STAGE_TIMEOUTS[stage]
+    return Task(
+        description=description,
+        agent=agent,
+        expected_output=STAGE_EXPECTED_OUTPUT[stage],
+        **task_kwargs,
+    )
+
+
+def start_run(user_task: str, technical_spec: str = None):
+    """Готовит рабочую папку и заголовок отчёта: (final_task, task_timestamp, task_dir, report_file)"""
+    # Запускаем автоочистку в фоне
+    auto_cleanup()
+
+    final_task = build_final_task(user_task, technical_spec)
+    if technical_spec:
+        emit("run.spec", "📋 Используется детальное ТЗ от менеджера")
+
+    emit("run.task", f"📥 Получена задача: {final_task[:100]}...")
+
+    # Создаём временную папку с уникальным именем
+    task_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    task_temp_dir = TEMP_PATH / f"task_{task_timestamp}"
+    task_temp_dir.mkdir(parents=True, exist_ok=True)
+    emit("run.start", f"📂 Рабочая папка: {task_temp_dir}", task_id=task_timestamp, path=str(task_temp_dir))
+
+    # Создаем отчет о выполнении
+    report_file = task_temp_dir / "execution_report.md"
+    with open(report_file, 'w', encoding='utf-8') as f:
+        f.write(f"# Отчет о выполнении задачи\n\n")
+        f.write(f"**Задача:** {final_task}\n")
+        f.write(f"**Начало:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        f.write("## Этапы выполнения\n\n")
+
+    return final_task, task_timestamp, task_temp_dir, report_file
+
+
+def report_resume(report_file):
+    """Заголовок продолжения прерванного запуска в отчёте"""
+    with open(report_file, 'a', encoding='utf-8') as f:
+        f.write(f"\n## ♻️ Продолжение после сбоя ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})\n\n")
+
+
+def report_stage_start(report_file, stage):
+    """Заголовок этапа в отчёте"""
+    with open(report_file, 'a', encoding='utf-8') as f:
+        f.write(f"### {STAGE_TITLES[stage]}\n\n")
+        f.write(f"**Начало:** {datetime.now().strftime('%H:%M:%S')}\n\n")
+
+
+def report_stage_result(report_file, stage, result):
+    """Результат этапа в отчёте"""
+    lang = "html" if stage in ("developer", "reviewer") else ""
+    with open(report_file, 'a', encoding='utf-8') as f:
+        f.write(f"**Результат:**\n```{lang}\n{result}\n```\n\n")
+        f.write(f"**Завершение:** {datetime.now().strftime('%H:%M:%S')}\n\n")
+        f.write("---\n\n")
+
+
+def report_error(report_file, title="❌ ОШИБКА"):
+    """Записывает текущее исключение в отчёт"""
+    emit("run.traceback", f"📝 Детали: {traceback.format_exc()}", level=ERROR)
+    with open(report_file, 'a', encoding='utf-8') as f:
+        f.write(f"\n## {title}\n\n")
+        f.write(f"```\n{traceback.format_exc()}\n```\n")
+
+
+def finish_run(outputs, final_task, user_task, requirements, task_temp_dir, report_file, task_timestamp,
+               project_base_name=None):
+    """Проверяет итог, сохраняет артефакты и копирует проект; возвращает финальный результат"""
+    planner_result = outputs.get("planner")
+    developer_result = outputs.get("developer")
+    reviewer_result = outputs.get("reviewer")
+
+    # Сохраняем результаты всех агентов
+    save_agent_outputs(planner_result, developer_result, reviewer_result, final_task, task_temp_dir)
+
+    # Берем финальный результат (от ревьюера, а если его не было - от разработчика)
+    final_result = final_output(outputs)
+
+    # Проверяем результат
+    result_text = str(final_result)
+    issues = validate_result(result_text, final_task)
+
+    with open(report_file, 'a', encoding='utf-8') as f:
+        f.write("## ✅ Итоговая проверка\n\n")
+        if issues:
+            f.write("### ❌ Найденные проблемы:\n\n")
+            for issue in issues:
+                f.write(f"- {issue}\n")
+            f.write("\n⚠️ Требуется доработка!\n")
+            emit("validation.failed", "⚠️ Обнаружены проблемы в результате:", level=WARNING, issues=issues)
+            for issue in issues:
+                emit("validation.issue", f"  {issue}", level=WARNING)
+        else:
+            f.write("✅ Все проверки пройдены! Код готов.\n")
+            emit("validation.passed", "✅ Все проверки пройдены!")
+
+    # Сохраняем финальный результат в разных форматах
+    html_file = task_temp_dir / "index.html"
+    with open(html_file, 'w', encoding='utf-8') as f:
+        # Извлекаем HTML если он есть в markdown
+        html_content = result_text
+        if "```html" in result_text:
+            html_content = re.findall(r'```html\n(.*?)```', result_text, re.DOTALL)
+            if html_content:
+                html_content = html_content[0]
+        elif "```" in result_text:
+            code_blocks = re.findall(r'```\n(.*?)```', result_text, re.DOTALL)
+            if code_blocks:
+                html_content = code_blocks[0]
+
+        f.write(html_content)
+
+    emit("artifact.saved", f"✅ HTML файл сохранен: {html_file}", path=str(html_file))
+    emit("artifact.saved", f"✅ Отчет сохранен: {report_file}", path=str(report_file))
+
+    # Если есть HTML, создаем превью
+    if html_file.exists():
+        preview_file = task_temp_dir / "preview.html"
+        with open(preview_file, 'w', encoding='utf-8') as f:
+            f.write("""<!DOCTYPE html>
 <html>
 <head>
     <title>Preview</title>
@@ -525,40 +1011,208 @@ def run_crew(user_task: str, technical_spec: str = None, requirements=None):
     <h2>Preview generated code:</h2>
     <iframe srcdoc='""")
 
-                # Экранируем содержимое для iframe
-                with open(html_file, 'r', encoding='utf-8') as src:
-                    content = src.read().replace("'", "\\'").replace("\n", " ")
-                    f.write(content)
+            # Экранируем содержимое для iframe
+            with open(html_file, 'r', encoding='utf-8') as src:
+                content = src.read().replace("'", "\\'").replace("\n", " ")
+                f.write(content)
 
-                f.write("'></iframe>\n</body>\n</html>")
+            f.write("'></iframe>\n</body>\n</html>")
 
-            log_step(f"👁️ Превью доступно: {preview_file}")
+        emit("artifact.saved", f"👁️ Превью доступно: {preview_file}", path=str(preview_file))
 
-        # Генерируем имя проекта
+    # Генерируем имя проекта
+    if project_base_name is None:
         project_base_name = generate_project_name(user_task, requirements)
-        project_name = f"{project_base_name}_{task_timestamp}"
+    project_name = f"{project_base_name}_{task_timestamp}"
 
-        # Копируем в общую папку projects
-        project_dir = PROJECTS_PATH / project_name
-        project_dir.mkdir(parents=True, exist_ok=True)
+    # Копируем в общую папку projects
+    project_dir = PROJECTS_PATH / project_name
+    project_dir.mkdir(parents=True, exist_ok=True)
 
-        for file in task_temp_dir.glob("*"):
+    for file in task_temp_dir.glob("*"):
+        if file.is_file():
             shutil.copy2(file, project_dir)
 
-        log_step(f"📁 Проект сохранен: {project_dir}")
-
-        return final_result
-
-    except Exception as e:
-        log_step(f"❌ КРИТИЧЕСКАЯ ОШИБКА: {str(e)}")
-        log_step(f"📝 Детали: {traceback.format_exc()}")
-
-        # Сохраняем ошибку в отчет
-        with open(report_file, 'a', encoding='utf-8') as f:
-            f.write(f"\n## ❌ ОШИБКА\n\n")
-            f.write(f"```\n{traceback.format_exc()}\n```\n")
+    emit("project.saved", f"📁 Проект сохранен: {project_dir}", path=str(project_dir))
+
+    cache_stats = _stage_cache.stats()
+    emit("cache.stats", f"⚡ Кэш этапов: {cache_stats['hits']} попаданий, {cache_stats['misses']} промахов",
+         hits=cache_stats['hits'], misses=cache_stats['misses'])
+
+    return final_result
+
+
+def new_run(user_task: str, technical_spec: str = None, requirements=None, pipeline: str = "full",
+            developer_candidates: int = 1) -> dict:
+    """Создаёт папку задачи и манифест run.json, по которому запуск можно продолжить после сбоя"""
+    final_task, task_timestamp, task_temp_dir, report_file = start_run(user_task, technical_spec)
+    stages, stage_max_tokens = plan_stages(pipeline, requirements)
+
+    manifest = {
+        'user_task': user_task,
+        'technical_spec': technical_spec,
+        'final_task': final_task,
+        'requirements': _requirements_dict(requirements),
+        'project_base_name': generate_project_name(user_task, requirements),
+        'pipeline': pipeline,
+        'stages': stages,
+        'stage_max_tokens': stage_max_tokens,
+        'stage_llm': stage_llm_plan(stages, stage_max_tokens),
+        'developer_candidates': developer_candidates,
+        'task_timestamp': task_timestamp,
+        'task_dir': str(task_temp_dir),
+        'created_at': datetime.now().isoformat(),
+        'completed': False,
+    }
+    CheckpointStore(task_temp_dir).save_manifest(manifest)
+    return manifest
+
+
+def render_stage_prompt(manifest, stage, outputs):
+    """Описание Task этапа с учётом переопределённых шаблонов (prompt_overrides, плейсхолдер {input})"""
+    text = stage_input(stage, outputs, manifest['final_task'])
+    template = (manifest.get('prompt_overrides') or {}).get(stage)
+    if template:
+        return template.replace("{input}", str(text))
+    return stage_prompt(stage, text)
+
+
+def load_run(task_dir):
+    """Читает манифест и восстанавливает результаты этапов из валидных чекпоинтов.
+
+    Возвращает (manifest, outputs); этапы после первого отсутствующего или устаревшего
+    чекпоинта считаются незавершёнными.
+    """
+    store = CheckpointStore(task_dir)
+    manifest = store.load_manifest()
+    manifest['task_dir'] = str(Path(task_dir))
+
+    outputs = {}
+    for stage in manifest['stages']:
+        description = render_stage_prompt(manifest, stage, outputs)
+        if not store.is_valid(stage, description):
+            break
+        outputs[stage] = store.load(stage)['output']
+    return manifest, outputs
+
+
+def ensure_not_running(task_dir):
+    """RuntimeError, если запуск уже выполняется (свежий run.lock) - второй процесс испортил бы чекпоинты"""
+    if CheckpointStore(task_dir).is_running():
+        emit("run.busy", f"⚠️ Запуск {task_dir} уже выполняется, продолжение отклонено", level=WARNING)
+        raise RuntimeError(f"Запуск {Path(task_dir).name} уже выполняется")
+
+
+def final_output(outputs):
+    """Финальный результат конвейера: ревьюер, а если его не было - разработчик"""
+    return outputs.get("reviewer") if outputs.get("reviewer") is not None else outputs.get("developer")
+
+
+def _execute_run(manifest, outputs, use_cache=True, on_event=None):
+    """Выполняет незавершённые этапы через CrewAI, сохраняя чекпоинт после каждого"""
+    final_task = manifest['final_task']
+    stages = manifest['stages']
+    developer_candidates = manifest['developer_candidates']
+    task_temp_dir = Path(manifest['task_dir'])
+    report_file = task_temp_dir / "execution_report.md"
+    checkpoints = CheckpointStore(task_temp_dir)
 
-        raise e
+    run_started = time.time()
+    with task_context(manifest['task_timestamp']), checkpoints.running():
+        try:
+            # Создаём только тех агентов, чьи этапы будут выполняться
+            agents = {}
+            for stage in stages:
+                if stage not in outputs:
+                    model, max_tokens = stage_llm(manifest, stage)
+                    agents[stage] = create_agent(*AGENT_SPECS[stage], max_tokens=max_tokens, model=model)
+
+            for stage in stages:
+                if stage in outputs:
+                    emit("stage.checkpoint", f"♻️ {stage}: результат взят из чекпоинта", stage=stage)
+                    continue
+
+                report_stage_start(report_file, stage)
+                emit("stage.begin", STAGE_START_LOGS[stage], stage=stage)
+                started = time.time()
+
+                agent = agents[stage]
+                task = build_stage_task(stage, agent, render_stage_prompt(manifest, stage, outputs))
+
+                if stage == "developer" and developer_candidates > 1:
+                    model, max_tokens = stage_llm(manifest, stage)
+                    result = run_developer_candidates(
+                        task.description, final_task, developer_candidates,
+                        max_tokens, use_cache, on_event, model,
+                        seeds=[candidate_seed(manifest, i) for i in range(developer_candidates)],
+                    )
+                else:
+                    result = _run_stage(stage, agent, task, use_cache, on_event)
+
+                if stage == "translator":
+                    # Проверяем, что результат не пустой
+                    if result is None:
+                        emit("stage.empty", "❌ Переводчик вернул пустой результат", level=WARNING, stage=stage)
+                        result = final_task  # запасной вариант
+                    emit("stage.spec", f"📝 Техническое задание: {str(result)[:100]}...", stage=stage)
+
+                # Проверяем, что разработчик выдал код, а не текст
+                if stage == "developer" and needs_developer_retry(result):
+                    emit("stage.retry", "⚠️ Разработчик не выдал HTML, пробую еще раз...", level=WARNING, stage=stage)
+                    retry_task = Task(
+                        description=DEVELOPER_RETRY_PROMPT,
+                        agent=agent,
+                        expected_output="<!DOCTYPE html> ... </html>",
+                        timeout=120,
+                    )
+                    # Промпт повтора не зависит от задачи - из кэша пришёл бы ответ на чужую задачу
+                    result = _run_stage("developer_retry", agent, retry_task, False, on_event)
+
+                outputs[stage] = result
+                checkpoints.save(stage, task.description, result, started, time.time(), _llm_settings(agent)[0])
+                report_stage_result(report_file, stage, result)
+
+            final_result = finish_run(
+                outputs, final_task, manifest['user_task'], manifest['requirements'],
+                task_temp_dir, report_file, manifest['task_timestamp'], manifest['project_base_name']
+            )
+            checkpoints.mark_completed()
+            emit("run.end", None, duration=round(time.time() - run_started, 3), stages=stages)
+            return final_result
+
+        except Exception as e:
+            emit("run.error", f"❌ КРИТИЧЕСКАЯ ОШИБКА: {str(e)}", level=ERROR, error=str(e))
+            # Сохраняем ошибку в отчет
+            report_error(report_file)
+            checkpoints.set_status('failed', str(e))
+            raise e
+
+
+def run_crew(user_task: str, technical_spec: str = None, requirements=None, use_cache: bool = True,
+             on_event=None, pipeline: str = "full", developer_candidates: int = 1):
+    """Запускает агентов с задачей и опциональным ТЗ.
+
+    use_cache=False - мимо кэша этапов, on_event(event_type, data) - потоковые события этапов,
+    pipeline="auto" - набор этапов и лимит токенов по сложности требований,
+    developer_candidates > 1 - несколько параллельных вариантов разработчика, в ревью идёт лучший.
+    После каждого этапа пишется чекпоинт, прерванный запуск продолжается через resume_crew.
+    """
+    manifest = new_run(user_task, technical_spec, requirements, pipeline, developer_candidates)
+    return _execute_run(manifest, {}, use_cache, on_event)
+
+
+def resume_crew(task_dir, use_cache: bool = True, on_event=None):
+    """Продолжает прерванный запуск с первого незавершённого этапа"""
+    manifest, outputs = load_run(task_dir)
+    if manifest.get('completed'):
+        emit("run.completed", f"✅ Запуск {task_dir} уже завершён", task_id=manifest['task_timestamp'])
+        return final_output(outputs)
+    ensure_not_running(task_dir)
+
+    emit("run.resume", f"♻️ Продолжение {task_dir}: готово этапов {len(outputs)}/{len(manifest['stages'])}",
+         task_id=manifest['task_timestamp'], done=len(outputs), total=len(manifest['stages']))
+    report_resume(Path(manifest['task_dir']) / "execution_report.md")
+    return _execute_run(manifest, outputs, use_cache, on_event)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+# Сколько символов задачи хранится для списка диалогов
+TASK_PREVIEW_CHARS = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogs (
+    session_id TEXT PRIMARY KEY,
+    created_at TEXT,
+    updated_at TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    task_preview TEXT NOT NULL DEFAULT '',
+    task_search TEXT NOT NULL DEFAULT '',
+    ready INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS dialogs_updated ON dialogs (updated_at DESC);
+"""
+
+COLUMNS = ('session_id', 'created_at', 'updated_at', 'message_count', 'task_preview', 'ready', 'completed')
+
+
+class DialogCatalog:
+    """Каталог диалогов менеджера в SQLite: метаданные для списка «История» без чтения самих диалогов.
+
+    Страница списка берётся по индексу updated_at, поиск - по задаче без учёта регистра
+    (task_search хранит задачу в нижнем регистре: LOWER в SQLite понимает только ASCII).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def upsert(self, session_id: str, created_at=None, updated_at=None, message_count: int = 0,
+               initial_task: str = "", ready: bool = False, completed: bool = False):
+        """Добавляет или обновляет запись диалога (created_at не перезаписывается)"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                """INSERT INTO dialogs (session_id, created_at, updated_at, message_count, task_preview, task_search,
+                                        ready, completed)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(session_id) DO UPDATE SET
+                       updated_at = excluded.updated_at,
+                       message_count = excluded.message_count,
+                       task_preview = excluded.task_preview,
+                       task_search = excluded.task_search,
+                       ready = excluded.ready,
+                       completed = MAX(completed, excluded.completed)""",
+                (session_id, created_at or updated_at, updated_at, message_count,
+                 initial_task[:TASK_PREVIEW_CHARS], initial_task.lower(), int(ready), int(completed)),
+            )
+
+    def is_empty(self) -> bool:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM dialogs LIMIT 1").fetchone() is None
+
+    def page(self, page: int = 0, page_size: int = 10, query: str = None) -> list:
+        """Страница диалогов, новые первыми; query - подстрока задачи"""
+        sql = f"SELECT {', '.join(COLUMNS)} FROM dialogs"
+        params = []
+        if query:
+            sql += " WHERE instr(task_search, ?) > 0"
+            params.append(query.lower())
+        sql += " ORDER BY updated_at DESC LIMIT ? OFFSET ?"
+        params += [page_size, page * page_size]
+        with closing(self._connect()) as conn:
+            return [dict(zip(COLUMNS, row)) for row in conn.execute(sql, params)]
+
+    def count(self, query: str = None) -> int:
+        with closing(self._connect()) as conn:
+            if query:
+                return conn.execute("SELECT COUNT(*) FROM dialogs WHERE instr(task_search, ?) > 0",
+                                    (query.lower(),)).fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM dialogs").fetchone()[0]
+
+    def remove(self, session_id: str):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM dialogs WHERE session_id = ?", (session_id,))
@@ -0,0 +1,171 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+# Подписчики: [(sink, минимальный уровень)]; _min_level = None - событие никому не нужно
+_sinks = []
+_min_level = None
+_lock = threading.Lock()
+
+# Идентификатор задачи (task_timestamp) текущего запуска - наследуется корутинами
+_task_id = contextvars.ContextVar("ai_office_task_id", default=None)
+
+
+def _recompute():
+    global _min_level
+    _min_level = min((level for _, level in _sinks), default=None)
+
+
+def add_sink(sink, level=INFO):
+    """Подключает приёмник событий: sink(record) вызывается для событий не ниже level"""
+    with _lock:
+        _sinks.append((sink, level))
+        _recompute()
+    return sink
+
+
+def remove_sink(sink):
+    with _lock:
+        _sinks[:] = [(s, level) for s, level in _sinks if s is not sink]
+        _recompute()
+
+
+def enabled(level=INFO) -> bool:
+    """Есть ли приёмник для уровня - чтобы не собирать дорогие поля зря"""
+    return _min_level is not None and level >= _min_level
+
+
+@contextlib.contextmanager
+def task_context(task_id):
+    """Все события внутри блока получают task_id"""
+    token = _task_id.set(task_id)
+    try:
+        yield
+    finally:
+        _task_id.reset(token)
+
+
+def current_task_id():
+    return _task_id.get()
+
+
+def emit(event: str, message: str = None, level: int = INFO, **fields):
+    """Структурное событие: тип (stage.end, run.start, ...), текст для человека и поля
+    (stage, duration, prompt_tokens, completion_tokens, ...). Поля со значением None отбрасываются.
+    """
+    if _min_level is None or level < _min_level:
+        return
+
+    record = {
+        'ts': time.time(),
+        'event': event,
+        'level': LEVEL_NAMES.get(level, str(level)),
+        'task_id': fields.pop('task_id', None) or _task_id.get(),
+    }
+    if message is not None:
+        record['message'] = message
+    record.update({key: value for key, value in fields.items() if value is not None})
+
+    for sink, sink_level in list(_sinks):
+        if level >= sink_level:
+            try:
+                sink(record)
+            except Exception:
+                pass
+
+
+class StdoutSink:
+    """Печатает текст события в консоль: [ЧЧ:ММ:СС] текст; события без текста пропускаются"""
+
+    def __call__(self, record):
+        message = record.get('message')
+        if message is None:
+            return
+        timestamp = datetime.fromtimestamp(record['ts']).strftime("%H:%M:%S")
+        print(f"[{timestamp}] {message}")
+
+
+class QueueSink:
+    """Кладёт события в очередь UI как ("event", record)"""
+
+    def __init__(self, log_queue):
+        self.log_queue = log_queue
+
+    def __call__(self, record):
+        self.log_queue.put(("event", record))
+
+
+class JsonlSink:
+    """Пишет события строками JSON; writer - фоновый писатель SessionLogger (LogWriter)"""
+
+    def __init__(self, path, writer=None):
+        self.path = path
+        self.writer = writer
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        if self.writer is not None:
+            self.writer.write(self.path, line)
+            return
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def read_events(path, event=None):
+    """События из JSONL-файла (опционально только одного типа); битые строки пропускаются"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if event is None or record.get('event') == event:
+                records.append(record)
+    return records
+
+
+def stage_timings(records):
+    """Сводка stage.end по этапам: запуски, попадания в кэш, суммарное/среднее время и токены"""
+    return finish_stage_timings(add_stage_timings({}, records))
+
+
+def add_stage_timings(totals, records):
+    """Досчитывает суммы stage.end в totals (без средних) - для инкрементального индекса"""
+    for record in records:
+        if record.get('event') != "stage.end":
+            continue
+        row = totals.setdefault(record.get('stage'), {
+            'runs': 0, 'cached': 0, 'total_sec': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0,
+        })
+        row['runs'] += 1
+        row['cached'] += 1 if record.get('cached') else 0
+        row['total_sec'] += record.get('duration') or 0.0
+        row['prompt_tokens'] += record.get('prompt_tokens') or 0
+        row['completion_tokens'] += record.get('completion_tokens') or 0
+    return totals
+
+
+def finish_stage_timings(totals):
+    """Суммы add_stage_timings -> сводка с округлённым и средним временем"""
+    summary = {}
+    for stage, row in totals.items():
+        summary[stage] = {**row, 'total_sec': round(row['total_sec'], 3),
+                          'mean_sec': round(row['total_sec'] / row['runs'], 3)}
+    return summary
+
+
+# Консоль по умолчанию (AI_OFFICE_LOG_LEVEL - порог, off - без вывода)
+_stdout_level = os.environ.get("AI_OFFICE_LOG_LEVEL", "info").lower()
+if _stdout_level != "off":
+    add_sink(StdoutSink(), LEVELS.get(_stdout_level, INFO))
@@ -0,0 +1,278 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from core.events import emit, WARNING
+from core.requirements import ProjectRequirements
+
+# Ниже этой уверенности (get_confidence_score, 0-100) сообщение уходит в LLMExtractor
+EXTRACTION_MIN_CONFIDENCE = float(os.environ.get("AI_OFFICE_EXTRACT_MIN_CONFIDENCE", "50"))
+# 0 - только ключевые слова, без обращений к LLM
+LLM_EXTRACTION_ENABLED = os.environ.get("AI_OFFICE_LLM_EXTRACTION", "1") != "0"
+# 0 - LLM вызывается синхронно, иначе в фоновом ExtractionService
+LLM_EXTRACTION_BACKGROUND = os.environ.get("AI_OFFICE_EXTRACT_BACKGROUND", "1") != "0"
+# Сколько результатов LLM по (сообщение, сводка требований) хранится в памяти
+EXTRACTION_CACHE_SIZE = 256
+
+# Латинские термины (библиотеки, технологии); ссылки вырезаются заранее
+TERM_RE = re.compile(r"(?<![\w.+#-])[a-z][a-z0-9.+#-]{2,}")
+URL_RE = re.compile(r"https?://\S+")
+# Служебные английские слова - не повод звать LLM
+COMMON_WORDS = {
+    'and', 'the', 'for', 'with', 'use', 'also', 'not', 'but', 'like', 'just', 'only', 'more', 'some', 'any',
+    'all', 'new', 'please', 'etc', 'e.g', 'i.e', 'www', 'com', 'org', 'page', 'site', 'web', 'app', 'style',
+}
+
+REQUIREMENT_FIELDS = ('project_type', 'technologies', 'forbidden', 'colors', 'style', 'mood',
+                      'animation_speed', 'features')
+
+
+def unknown_terms(text: str, is_known) -> list:
+    """Латинские слова сообщения, которых нет в таблицах ключевых слов (is_known(word) -> bool)"""
+    terms = []
+    for term in TERM_RE.findall(URL_RE.sub(" ", text.lower())):
+        term = term.rstrip(".-")
+        if len(term) >= 3 and term not in COMMON_WORDS and not is_known(term) and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def requirements_digest(requirements: dict) -> str:
+    """Короткая детерминированная сводка известных требований для промпта и ключа кэша"""
+    parts = []
+    for name in REQUIREMENT_FIELDS:
+        value = requirements.get(name)
+        if isinstance(value, list):
+            if value:
+                parts.append(f"{name}: {', '.join(sorted(str(item) for item in value))}")
+        elif value not in (None, "", "unknown"):
+            parts.append(f"{name}: {value}")
+    return "; ".join(parts)
+
+
+def extraction_key(message: str, digest: str) -> str:
+    return hashlib.sha256(f"{message}\n{digest}".encode('utf-8')).hexdigest()
+
+
+class ExtractionService:
+    """Фоновое LLM-извлечение: сообщения ставятся в очередь, вызывающий поток не ждёт.
+
+    В LLM уходит только новое сообщение и сводка requirements_digest. Результаты кэшируются
+    по хэшу (сообщение, сводка). Если для диалога уже ждёт необработанная задача, новое сообщение
+    её вытесняет: тексты объединяются в одну задачу со свежей сводкой. Готовые задачи забираются
+    через poll(dialog_id) или приходят в on_ready(job) из фонового потока.
+    """
+
+    def __init__(self, llm_extractor=None, cache_size: int = EXTRACTION_CACHE_SIZE):
+        self._llm_extractor = llm_extractor
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._queued = OrderedDict()  # dialog_id -> ещё не начатая задача
+        self._running = {}  # dialog_id -> выполняемая задача
+        self._done = {}  # dialog_id -> [готовые задачи]
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def llm_extractor(self):
+        if self._llm_extractor is None:
+            from core.llm_extractor import LLMExtractor
+            self._llm_extractor = LLMExtractor()
+        return self._llm_extractor
+
+    def submit(self, dialog_id, message: str, requirements: dict, keep=(), on_ready=None) -> dict:
+        """Ставит сообщение в очередь; keep - поля, которые результат не должен перезаписывать"""
+        digest = requirements_digest(requirements)
+        with self._cond:
+            stale = self._queued.pop(dialog_id, None)
+            if stale is not None:
+                message = f"{stale['message']}\n{message}"
+                keep = set(stale['keep']) | set(keep)
+                emit("extraction.superseded", None, dialog_id=dialog_id)
+
+            job = {
+                'dialog_id': dialog_id,
+                'message': message,
+                'digest': digest,
+                'key': extraction_key(message, digest),
+                'keep': sorted(keep),
+                'on_ready': on_ready,
+                'submitted': time.time(),
+                'extracted': None,
+                'cached': False,
+                'error': None,
+            }
+            cached = self._cache.get(job['key'])
+            if cached is not None:
+                self._cache.move_to_end(job['key'])
+                self.hits += 1
+                job.update(extracted=cached, cached=True)
+            else:
+                self.misses += 1
+                self._queued[dialog_id] = job
+                self._ensure_worker()
+                self._cond.notify()
+                return job
+
+        self._finish(job)
+        return job
+
+    def pending(self, dialog_id) -> bool:
+        with self._cond:
+            return dialog_id in self._queued or dialog_id in self._running
+
+    def poll(self, dialog_id) -> list:
+        """Забирает готовые задачи диалога (в порядке завершения)"""
+        with self._cond:
+            return self._done.pop(dialog_id, [])
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="llm-extraction", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queued:
+                    self._cond.wait()
+                dialog_id, job = self._queued.popitem(last=False)
+                self._running[dialog_id] = job
+
+            started = time.perf_counter()
+            try:
+                job['extracted'] = self.llm_extractor.extract(job['message'], digest=job['digest'])
+            except Exception as e:
+                job['error'] = str(e)
+                emit("extraction.llm_error", f"⚠️ LLM-извлечение не удалось: {e}", level=WARNING, error=str(e))
+            emit("extraction.llm", None, duration=round(time.perf_counter() - started, 3), dialog_id=dialog_id,
+                 background=True, failed=job['error'] is not None)
+
+            with self._cond:
+                self._running.pop(dialog_id, None)
+                if job['extracted'] is not None:
+                    self._cache[job['key']] = job['extracted']
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+            self._finish(job)
+
+    def _finish(self, job):
+        with self._cond:
+            self._done.setdefault(job['dialog_id'], []).append(job)
+        if job['on_ready']:
+            try:
+                job['on_ready'](job)
+            except Exception:
+                pass
+
+
+# Общий сервис процесса (создаётся при первом обращении)
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_extraction_service() -> ExtractionService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ExtractionService()
+        return _service
+
+
+class HybridExtractor:
+    """Извлечение требований: ключевые слова сразу, LLMExtractor - только когда их не хватает.
+
+    keyword_analyzer(message, requirements) обновляет словарь требований синхронно.
+    В LLM сообщение уходит, если уверенность ProjectRequirements ниже min_confidence
+    или в нём есть неизвестные латинские термины. Результат LLM дополняет найденное
+    ключевыми словами и не перезаписывает поля, которые они уже определили.
+    С service (ExtractionService) LLM работает в фоне: extract возвращает 'pending': True,
+    а готовый результат применяется через apply(job, requirements).
+    """
+
+    def __init__(self, keyword_analyzer, is_known, llm_extractor=None, min_confidence: float = None,
+                 use_llm: bool = None, service: ExtractionService = None):
+        self.keyword_analyzer = keyword_analyzer
+        self.is_known = is_known
+        self.min_confidence = EXTRACTION_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.use_llm = LLM_EXTRACTION_ENABLED if use_llm is None else use_llm
+        self._llm_extractor = llm_extractor
+        self.service = service
+
+    @property
+    def llm_extractor(self):
+        # HTTP-клиент LLMExtractor создаётся при первой эскалации
+        if self._llm_extractor is None:
+            from core.llm_extractor import LLMExtractor
+            self._llm_extractor = LLMExtractor()
+        return self._llm_extractor
+
+    def escalation_reason(self, message: str, requirements: dict):
+        """Почему нужен LLM: ('low_confidence', score) / ('unknown_terms', [...]) или None"""
+        terms = unknown_terms(message, self.is_known)
+        if terms:
+            return 'unknown_terms', terms
+        score = ProjectRequirements.from_dict(requirements).get_confidence_score()
+        if score < self.min_confidence:
+            return 'low_confidence', round(score, 1)
+        return None
+
+    def extract(self, message: str, requirements: dict, dialog_id=None) -> dict:
+        """Обновляет requirements на месте; возвращает {'escalated', 'pending', 'reason', 'detail', 'changed',
+        'confidence'}. dialog_id нужен для фонового режима: задачи одного диалога вытесняют друг друга.
+        """
+        started = time.perf_counter()
+        # Копии списков: анализатор ключевых слов дополняет их на месте
+        before = {}
+        for name in REQUIREMENT_FIELDS:
+            value = requirements.get(name)
+            before[name] = list(value) if isinstance(value, list) else value
+        self.keyword_analyzer(message, requirements)
+        keyword_fields = {name for name in REQUIREMENT_FIELDS if requirements.get(name) != before[name]}
+        emit("extraction.keywords", None, duration=round(time.perf_counter() - started, 6),
+             fields=sorted(keyword_fields))
+
+        result = {'escalated': False, 'pending': False, 'reason': None, 'detail': None,
+                  'changed': sorted(keyword_fields)}
+        escalation = self.escalation_reason(message, requirements) if self.use_llm else None
+        if escalation:
+            result.update(escalated=True, reason=escalation[0], detail=escalation[1])
+            if self.service is not None:
+                job = self.service.submit(dialog_id, message, requirements, keep=keyword_fields)
+                result['pending'] = not job['cached']
+            else:
+                llm_fields = self._escalate(message, requirements, keyword_fields, escalation)
+                result['changed'] = sorted(keyword_fields | set(llm_fields))
+
+        result['confidence'] = round(ProjectRequirements.from_dict(requirements).get_confidence_score(), 1)
+        return result
+
+    def _escalate(self, message, requirements, keyword_fields, escalation) -> list:
+        started = time.perf_counter()
+        try:
+            extracted = self.llm_extractor.extract(message, requirements)
+        except Exception as e:
+            # Без LLM остаётся результат ключевых слов - диалог не должен падать
+            emit("extraction.llm_error", f"⚠️ LLM-извлечение не удалось: {e}", level=WARNING, error=str(e))
+            return []
+
+        changed = self.apply({'extracted': extracted, 'keep': keyword_fields}, requirements)
+        emit("extraction.llm", None, duration=round(time.perf_counter() - started, 3), reason=escalation[0],
+             fields=changed, llm_confidence=extracted.get('confidence'))
+        return changed
+
+    @staticmethod
+    def apply(job: dict, requirements: dict) -> list:
+        """Сливает результат LLM-задачи в requirements на месте; возвращает изменённые поля"""
+        if not job.get('extracted'):
+            return []
+        merged = ProjectRequirements.from_dict(requirements)
+        changed = merged.merge_extracted(job['extracted'], keep=job.get('keep', ()))
+        for name in changed:
+            requirements[name] = getattr(merged, name)
+        return changed
@@ -0,0 +1,80 @@
+import json
+import re
+
+# Висячая запятая перед закрывающей скобкой - частая ошибка небольших моделей
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class JsonObjectStream:
+    """Собирает первый JSON-объект из потока фрагментов.
+
+    Текст до первой «{» пропускается, глубина скобок считается с учётом строк и экранирования,
+    поэтому complete становится True ровно на закрывающей скобке - генерацию можно обрывать.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._in_string = False
+        self._escape = False
+        self._stack = []
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk: str):
+        """Добавляет фрагмент; всё после закрывающей скобки объекта отбрасывается"""
+        if self.complete:
+            return
+        start = 0
+        if not self.started:
+            start = chunk.find("{")
+            if start < 0:
+                return
+            self.started = True
+
+        for index in range(start, len(chunk)):
+            char = chunk[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append("}" if char == "{" else "]")
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self._parts.append(chunk[start:index + 1])
+                    self.complete = True
+                    return
+        self._parts.append(chunk[start:])
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def parse(self) -> dict:
+        """Объект из собранного текста; оборванный хвост дозакрывается. ValueError - если объекта нет"""
+        if not self.started:
+            raise ValueError("в ответе нет JSON-объекта")
+        text = self.text
+        if not self.complete:
+            # Обрыв по лимиту токенов: закрываем строку и скобки, незаконченную пару отбрасываем
+            text = text + '"' if self._in_string else text
+            text = re.sub(r'[,:]\s*$|,\s*"[^"]*"\s*$', "", text.rstrip())
+            text += "".join(reversed(self._stack))
+        data = json.loads(TRAILING_COMMA_RE.sub(r"\1", text))
+        if not isinstance(data, dict):
+            raise ValueError("ответ - не JSON-объект")
+        return data
+
+
+def parse_json_object(text: str) -> dict:
+    """Первый JSON-объект в тексте (с допуском обрыва и висячих запятых)"""
+    stream = JsonObjectStream()
+    stream.feed(text)
+    return stream.parse()
@@ -0,0 +1,114 @@
+import re
+
+# Сколько разных слов помнит кэш KeywordMatcher, прежде чем начать заново
+WORD_CACHE_SIZE = 50000
+
+
+def _node_pattern(node) -> str:
+    """Регулярное выражение для узла префиксного дерева (ветки с разных символов, жадно)"""
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return f"(?:{body})?" if "" in node else body
+
+
+def trie_pattern(keywords) -> str:
+    """Одно выражение для всех ключей: из позиции совпадает самый длинный ключ"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = True
+    return _node_pattern(trie)
+
+
+class KeywordMatcher:
+    """Все вхождения ключевых слов нескольких таблиц за один проход по словам текста.
+
+    Ключ без пробелов входит в текст тогда и только тогда, когда входит в одно из слов text.split(),
+    поэтому текст делится на слова один раз, а ключи каждого нового слова ищутся одним выражением
+    (префиксное дерево в lookahead - с пересечениями) и кэшируются на процесс.
+    Ключи с пробелами ("не надо") ищутся по последовательности слов.
+    """
+
+    def __init__(self, tables: dict):
+        # tables: {категория: ключевые слова (порядок сохраняется)}
+        self.tables = {category: list(keywords) for category, keywords in tables.items()}
+        keywords = sorted({keyword for keywords in self.tables.values() for keyword in keywords})
+        self._categories = {
+            keyword: [category for category, table in self.tables.items() if keyword in table]
+            for keyword in keywords
+        }
+
+        words = [keyword for keyword in keywords if len(keyword.split()) == 1 and keyword == keyword.strip()]
+        # Самое длинное совпадение в позиции подразумевает ключи, которые являются его префиксами
+        self._implied = {keyword: [other for other in words if keyword.startswith(other)] for keyword in words}
+        self._pattern = re.compile(f"(?=({trie_pattern(words)}))")
+
+        # Фразы: первое слово -> [(фраза, её слова)]
+        self._phrases = {}
+        for keyword in keywords:
+            parts = keyword.split()
+            if len(parts) > 1:
+                self._phrases.setdefault(parts[0], []).append((keyword, parts))
+        self._cache = {}
+
+    def _word_hits(self, word: str):
+        """(ключи внутри слова, фразы, которые могут начинаться в конце слова)"""
+        keywords = []
+        for match in self._pattern.finditer(word):
+            for keyword in self._implied[match.group(1)]:
+                if keyword not in keywords:
+                    keywords.append(keyword)
+        phrases = [phrase for first, items in self._phrases.items() if word.endswith(first) for phrase in items]
+        return keywords, phrases
+
+    def known(self, word: str) -> bool:
+        """Есть ли в слове хотя бы один ключ"""
+        entry = self._cache.get(word)
+        if entry is None:
+            entry = self._cache[word] = self._word_hits(word)
+        return bool(entry[0])
+
+    def scan(self, words: list) -> dict:
+        """{категория: {ключ: [номера слов]}} - только найденные ключи; words - text.split()"""
+        cache = self._cache
+        if len(cache) > WORD_CACHE_SIZE:
+            cache.clear()
+
+        # Ключи ищутся по разным словам, номера слов собираются одним проходом
+        found = {}
+        for word in dict.fromkeys(words):
+            entry = cache.get(word)
+            if entry is None:
+                entry = cache[word] = self._word_hits(word)
+            if entry[0] or entry[1]:
+                found[word] = entry
+        positions = {word: [] for word in found}
+        for index, word in enumerate(words):
+            indices = positions.get(word)
+            if indices is not None:
+                indices.append(index)
+
+        hits = {category: {} for category in self.tables}
+        for word, (keywords, phrases) in found.items():
+            for keyword in keywords:
+                for category in self._categories[keyword]:
+                    hits[category].setdefault(keyword, []).extend(positions[word])
+            for phrase, parts in phrases:
+                matched = [
+                    index for index in positions[word]
+                    if index + len(parts) <= len(words)
+                    and words[index + 1:index + len(parts) - 1] == parts[1:-1]
+                    and words[index + len(parts) - 1].startswith(parts[-1])
+                ]
+                if matched:
+                    for category in self._categories[phrase]:
+                        hits[category].setdefault(phrase, []).extend(matched)
+
+        for table in hits.values():
+            for indices in table.values():
+                indices.sort()
+        return hits
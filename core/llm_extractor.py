@@ -1,92 +1,114 @@
 import os
-from crewai import Agent, Task, Crew
-from datetime import datetime
 import json
 
+from core.json_stream import JsonObjectStream
+from core.ollama_client import OllamaClient
+
+# Ответ - маленький объект: лимит токенов (num_predict) с запасом на длинные списки
+EXTRACTION_MAX_TOKENS = int(os.environ.get("AI_OFFICE_EXTRACT_MAX_TOKENS", "256"))
+# schema - ответ по JSON-схеме (Ollama 0.5+), json - просто JSON-объект (старые версии)
+EXTRACTION_FORMAT = os.environ.get("AI_OFFICE_EXTRACT_FORMAT", "schema")
+# Сколько элементов списка просить у модели
+EXTRACTION_MAX_ITEMS = 10
+
+ENUM_FIELDS = {
+    'project_type': ["website", "parser", "bot", "script", "animation"],
+    'style': ["abstract", "geometric", "organic", "minimal", "dark"],
+    'animation_speed': ["slow", "medium", "fast"],
+    'mood': ["dark", "light", "mysterious"],
+}
+LIST_FIELDS = ('technologies', 'forbidden', 'colors', 'features')
+
+EXTRACTION_SCHEMA = {
+    'type': "object",
+    'properties': {
+        **{name: {'type': ["string", "null"], 'enum': values + [None]} for name, values in ENUM_FIELDS.items()},
+        **{name: {'type': "array", 'items': {'type': "string"}, 'maxItems': EXTRACTION_MAX_ITEMS}
+           for name in LIST_FIELDS},
+        'confidence': {'type': "number", 'minimum': 0, 'maximum': 1},
+    },
+    'required': list(ENUM_FIELDS) + list(LIST_FIELDS) + ['confidence'],
+    'additionalProperties': False,
+}
+
+SYSTEM_PROMPT = """You extract structured requirements from user messages.
+Extract ONLY what the user explicitly said, never add your own interpretations.
+Answer with a single JSON object and nothing else."""
+
+
+def _response_format(kind: str) -> dict:
+    if kind == "schema":
+        return {'type': "json_schema", 'json_schema': {'name': "requirements", 'schema': EXTRACTION_SCHEMA}}
+    return {'type': "json_object"}
+
+
+def normalize_extracted(data: dict) -> dict:
+    """Приводит ответ модели к схеме: неизвестные значения - None, списки - только строки"""
+    result = {}
+    for name, values in ENUM_FIELDS.items():
+        value = data.get(name)
+        result[name] = value.lower() if isinstance(value, str) and value.lower() in values else None
+    for name in LIST_FIELDS:
+        value = data.get(name)
+        if isinstance(value, str):
+            value = [value]
+        result[name] = [item.strip() for item in value or [] if isinstance(item, str) and item.strip()]
+    try:
+        result['confidence'] = min(1.0, max(0.0, float(data.get('confidence') or 0.0)))
+    except (TypeError, ValueError):
+        result['confidence'] = 0.0
+    return result
+
 
 class LLMExtractor:
-    """Использует LLM для извлечения требований из текста"""
-
-    def __init__(self):
-        self.extractor_agent = Agent(
-            role="Requirement Extractor",
-            goal="Extract structured requirements from user messages",
-            backstory="""You are an expert at understanding user requests and 
-            converting them into structured, technical requirements. You NEVER 
-            add your own opinions, just extract what the user said.""",
-            verbose=False,
-            allow_delegation=False,
-        )
+    """Использует LLM для извлечения требований из текста.
+
+    Запрос идёт напрямую в Ollama со структурным ответом (response_format) и коротким лимитом токенов;
+    поток обрывается на закрывающей скобке объекта.
+    """
+
+    def __init__(self, client: OllamaClient = None, model: str = None, max_tokens: int = None,
+                 response_format: str = None):
+        self.client = client or OllamaClient()
+        self.model = model
+        self.max_tokens = max_tokens or EXTRACTION_MAX_TOKENS
+        self.response_format = response_format or EXTRACTION_FORMAT
 
-    def extract(self, user_message: str, current_requirements: dict = None) -> dict:
-        """Извлекает требования из сообщения пользователя"""
+    def extract(self, user_message: str, current_requirements: dict = None, digest: str = None) -> dict:
+        """Извлекает требования из сообщения пользователя.
+
+        digest - короткая сводка уже известных требований (requirements_digest) вместо полного JSON.
+        ValueError - если модель не вернула JSON-объект.
+        """
 
         # Формируем контекст
         context = ""
-        if current_requirements:
-            context = f"\nCurrent requirements (update these based on new message):\n{json.dumps(current_requirements, indent=2, ensure_ascii=False)}"
-
-        extract_task = Task(
-            description=f"""
-            Extract structured requirements from this user message:
-
-            "{user_message}"
-            {context}
-
-            Return ONLY a JSON object with these fields (use null if not mentioned):
-            {{
-                "project_type": null or "website"|"parser"|"bot"|"script"|"animation",
-                "technologies": [],  // list of mentioned technologies
-                "forbidden": [],      // list of things user doesn't want
-                "colors": [],         // list of colors mentioned
-                "style": null or "abstract"|"geometric"|"organic"|"minimal"|"dark",
-                "animation_speed": null or "slow"|"medium"|"fast",
-                "features": [],       // list of specific features requested
-                "mood": null or "dark"|"light"|"mysterious",
-                "has_examples": false,  // whether user provided examples
-                "confidence": 0.0,     // 0-1 how clear is the requirement
-                "missing_info": []      // what's clearly missing
-            }}
-
-            IMPORTANT: 
-            - Extract ONLY what the user explicitly said
-            - Do NOT add interpretations
-            - If something is unclear, note it in missing_info
-            - Return ONLY the JSON, no other text
-            """,
-            agent=self.extractor_agent,
-            expected_output="JSON object with extracted requirements",
-        )
+        if digest:
+            context = f"\nAlready known (only report what this message adds or changes): {digest}"
+        elif current_requirements:
+            context = f"\nCurrent requirements (update these based on new message):\n{json.dumps(current_requirements, ensure_ascii=False)}"
 
-        crew = Crew(
-            agents=[self.extractor_agent],
-            tasks=[extract_task],
-            verbose=False
-        )
+        prompt = f"""Extract structured requirements from this user message:
+
+"{user_message}"
+{context}
 
-        result = crew.kickoff()
-
-        try:
-            # Пробуем распарсить JSON из ответа
-            if hasattr(result, 'raw'):
-                # Ищем JSON в ответе
-                import re
-                json_match = re.search(r'\{.*\}', result.raw, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group())
-            return json.loads(str(result))
-        except:
-            # Если не получилось, возвращаем пустой словарь
-            return {
-                "project_type": None,
-                "technologies": [],
-                "forbidden": [],
-                "colors": [],
-                "style": None,
-                "animation_speed": None,
-                "features": [],
-                "mood": None,
-                "has_examples": False,
-                "confidence": 0.1,
-                "missing_info": ["Could not parse requirements"]
-            }
\ No newline at end of file
+Fields (null or [] if not mentioned):
+- project_type: {" | ".join(ENUM_FIELDS['project_type'])}
+- technologies, forbidden, colors, features: lists of short strings
+- style: {" | ".join(ENUM_FIELDS['style'])}
+- animation_speed: {" | ".join(ENUM_FIELDS['animation_speed'])}
+- mood: {" | ".join(ENUM_FIELDS['mood'])}
+- confidence: 0-1, how clear the requirement is"""
+
+        stream = JsonObjectStream()
+        self.client.chat(
+            [{'role': "system", 'content': SYSTEM_PROMPT}, {'role': "user", 'content': prompt}],
+            model=self.model,
+            temperature=0.0,
+            max_tokens=self.max_tokens,
+            on_token=stream.feed,
+            should_stop=lambda: stream.complete,
+            response_format=_response_format(self.response_format),
+        )
+        return normalize_extracted(stream.parse())
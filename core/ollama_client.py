@@ -0,0 +1,138 @@
+import json
+import os
+
+import httpx
+
+
+def _chat_payload(messages, model, temperature, max_tokens, seed, stream, response_format=None):
+    """Тело запроса /chat/completions; max_tokens Ollama переводит в num_predict, response_format - в format"""
+    payload = {
+        'model': model or os.environ.get("OPENAI_MODEL_NAME", "tinyllama"),
+        'messages': messages,
+        'stream': stream,
+    }
+    if stream:
+        # Последний чанк потока несёт usage (prompt_tokens, completion_tokens)
+        payload['stream_options'] = {'include_usage': True}
+    if temperature is not None:
+        payload['temperature'] = temperature
+    if max_tokens:
+        payload['max_tokens'] = max_tokens
+    if seed is not None:
+        payload['seed'] = seed
+    if response_format is not None:
+        payload['response_format'] = response_format
+    return payload
+
+
+def _parse_sse_line(line):
+    """Разбирает строку SSE-потока: (текст, usage); текст None - конец потока"""
+    if not line.startswith("data:"):
+        return "", None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None, None
+    chunk = json.loads(data)
+    choices = chunk.get('choices') or [{}]
+    return (choices[0].get('delta') or {}).get('content') or "", chunk.get('usage')
+
+
+def _base_url(base_url):
+    return (base_url or os.environ.get("OPENAI_API_BASE", "http://localhost:11434/v1")).rstrip("/")
+
+
+class OllamaClient:
+    """Синхронный клиент OpenAI-совместимого API Ollama - быстрый путь этапов без CrewAI.
+
+    Потокобезопасен: один экземпляр держит пул соединений для всех потоков.
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, timeout: float = 180.0):
+        self.base_url = _base_url(base_url)
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY", "ollama")
+        self._client = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            headers={'Authorization': f"Bearer {self.api_key}"},
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._client.close()
+
+    def chat(self, messages, model: str = None, temperature: float = None, max_tokens: int = None,
+             seed: int = None, on_token=None, should_stop=None, on_usage=None, response_format=None) -> str:
+        """Потоковый chat completion; should_stop() == True закрывает соединение и обрывает генерацию.
+
+        on_usage(usage) получает счётчики токенов, если сервер их прислал.
+        response_format - {'type': 'json_object'} или {'type': 'json_schema', ...} для структурного ответа.
+        """
+        payload = _chat_payload(messages, model, temperature, max_tokens, seed, stream=True,
+                                response_format=response_format)
+        parts = []
+
+        with self._client.stream("POST", f"{self.base_url}/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if should_stop is not None and should_stop():
+                    break
+                text, usage = _parse_sse_line(line)
+                if usage and on_usage:
+                    on_usage(usage)
+                if text is None:
+                    break
+                if text:
+                    parts.append(text)
+                    if on_token:
+                        on_token(text)
+
+        return "".join(parts)
+
+
+class AsyncOllamaClient:
+    """Асинхронный клиент OpenAI-совместимого API Ollama (OPENAI_API_BASE).
+
+    Отмена корутины закрывает HTTP-соединение, и Ollama сразу прекращает генерацию.
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, timeout: float = 180.0):
+        self.base_url = _base_url(base_url)
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY", "ollama")
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            headers={'Authorization': f"Bearer {self.api_key}"},
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def chat(self, messages, model: str = None, temperature: float = None, max_tokens: int = None,
+                   seed: int = None, on_token=None, on_usage=None) -> str:
+        """Потоковый chat completion; on_token(text) вызывается на каждый фрагмент, on_usage(usage) - счётчики токенов"""
+        payload = _chat_payload(messages, model, temperature, max_tokens, seed, stream=True)
+        parts = []
+
+        async with self._client.stream("POST", f"{self.base_url}/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                text, usage = _parse_sse_line(line)
+                if usage and on_usage:
+                    on_usage(usage)
+                if text is None:
+                    break
+                if text:
+                    parts.append(text)
+                    if on_token:
+                        on_token(text)
+
+        return "".join(parts)
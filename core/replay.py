@@ -0,0 +1,239 @@
+import argparse
+import json
+import re
+import shutil
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from core.checkpoints import CheckpointStore
+from core.events import emit
+from core.crew_runner import (
+    PIPELINE_STAGES,
+    STAGE_TITLES,
+    _execute_run,
+    generate_project_name,
+    load_run,
+    render_stage_prompt,
+)
+
+
+def _read_artifact(task_dir, pattern, header):
+    """Содержимое последнего артефакта save_agent_outputs без служебного заголовка"""
+    files = sorted(Path(task_dir).glob(pattern))
+    if not files:
+        return None
+    with open(files[-1], 'r', encoding='utf-8') as f:
+        content = f.read()
+    return content[len(header):] if content.startswith(header) else content
+
+
+def load_legacy_run(task_dir):
+    """Восстанавливает запуск без run.json по execution_report.md и файлам plan_/developer_code_/review_"""
+    task_dir = Path(task_dir)
+    with open(task_dir / "execution_report.md", 'r', encoding='utf-8') as f:
+        report = f.read()
+
+    task_match = re.search(r'\*\*Задача:\*\* (.*?)\n\*\*Начало:\*\*', report, re.DOTALL)
+    final_task = task_match.group(1) if task_match else ""
+
+    outputs = {}
+    translator_match = re.search(
+        re.escape(f"### {STAGE_TITLES['translator']}") + r'.*?\*\*Результат:\*\*\n```\w*\n(.*?)\n```',
+        report, re.DOTALL
+    )
+    if translator_match:
+        outputs['translator'] = translator_match.group(1)
+
+    artifacts = {
+        'planner': ("plan_*.md", f"# План выполнения\n\n**Задача:** {final_task}\n\n"),
+        'developer': ("developer_code_*.py", f"# Код разработчика\n\n# Задача: {final_task}\n\n"),
+        'reviewer': ("review_*.md", "# Результат проверки\n\n"),
+    }
+    for stage, (pattern, header) in artifacts.items():
+        output = _read_artifact(task_dir, pattern, header)
+        if output is not None:
+            outputs[stage] = output
+
+    timestamp = task_dir.name.replace("task_", "")
+    manifest = {
+        'user_task': final_task,
+        'technical_spec': None,
+        'final_task': final_task,
+        'requirements': {},
+        'project_base_name': generate_project_name(final_task),
+        'pipeline': "full",
+        'stages': list(PIPELINE_STAGES),
+        'stage_max_tokens': None,
+        'developer_candidates': 1,
+        'task_timestamp': timestamp,
+        'task_dir': str(task_dir),
+        'completed': 'reviewer' in outputs,
+    }
+    return manifest, outputs
+
+
+def load_source(task_dir):
+    """Манифест и результаты этапов исходного запуска (чекпоинты или старые артефакты)"""
+    if CheckpointStore(task_dir).exists():
+        return load_run(task_dir)
+    return load_legacy_run(task_dir)
+
+
+def prepare_replay(task_dir, from_stage, model=None, prompt_overrides=None):
+    """Создаёт соседнюю папку повтора с результатами этапов до from_stage.
+
+    Возвращает (manifest, outputs) для _execute_run.
+    """
+    source = Path(task_dir)
+    manifest, outputs = load_source(source)
+    stages = manifest['stages']
+    if from_stage not in stages:
+        raise ValueError(f"Этап {from_stage} не выполнялся в {source} (этапы: {', '.join(stages)})")
+
+    keep = stages[:stages.index(from_stage)]
+    missing = [stage for stage in keep if stage not in outputs]
+    if missing:
+        raise ValueError(f"Нет сохранённых результатов этапов: {', '.join(missing)}")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    replay_dir = source.parent / f"{source.name}_replay_{from_stage}_{timestamp}"
+    replay_dir.mkdir(parents=True)
+
+    replay_manifest = dict(manifest)
+    # Статус и ошибка исходного запуска к повтору не относятся
+    for key in ('status', 'error', 'finished_at'):
+        replay_manifest.pop(key, None)
+    replay_manifest.update({
+        'task_timestamp': timestamp,
+        'task_dir': str(replay_dir),
+        'created_at': datetime.now().isoformat(),
+        'completed': False,
+        'replay_of': str(source),
+        'replay_from': from_stage,
+        'model': model or manifest.get('model'),
+        'prompt_overrides': {**(manifest.get('prompt_overrides') or {}), **(prompt_overrides or {})},
+    })
+    store = CheckpointStore(replay_dir)
+    store.save_manifest(replay_manifest)
+
+    # Переносим чекпоинты предыдущих этапов, чтобы папка повтора была самодостаточной
+    kept = {}
+    source_store = CheckpointStore(source)
+    for stage in keep:
+        kept[stage] = outputs[stage]
+        source_checkpoint = source_store.checkpoint_dir / f"{stage}.json"
+        if source_checkpoint.exists():
+            store.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source_checkpoint, store.checkpoint_dir / f"{stage}.json")
+        else:
+            now = time.time()
+            store.save(stage, render_stage_prompt(replay_manifest, stage, kept), outputs[stage], now, now)
+
+    with open(replay_dir / "execution_report.md", 'w', encoding='utf-8') as f:
+        f.write(f"# Повтор этапов с «{from_stage}»\n\n")
+        f.write(f"**Источник:** {source}\n")
+        f.write(f"**Задача:** {manifest['final_task']}\n")
+        f.write(f"**Начало:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+        f.write("## Этапы выполнения\n\n")
+
+    return replay_manifest, kept
+
+
+def timing_diff(source_dir, replay_dir, stages):
+    """Сравнение длительности этапов исходного запуска и повтора"""
+    source_store = CheckpointStore(source_dir)
+    replay_store = CheckpointStore(replay_dir)
+    rows = []
+    for stage in stages:
+        source = source_store.load(stage) or {}
+        replay = replay_store.load(stage) or {}
+        source_sec = source.get('duration')
+        replay_sec = replay.get('duration') if replay.get('finished_at') != source.get('finished_at') else None
+        rows.append({
+            'stage': stage,
+            'source_sec': source_sec,
+            'replay_sec': replay_sec,
+            'delta_sec': round(replay_sec - source_sec, 3) if source_sec is not None and replay_sec is not None else None,
+            'source_model': source.get('model'),
+            'replay_model': replay.get('model'),
+        })
+    return rows
+
+
+def write_timing_diff(replay_dir, rows):
+    """Сохраняет timing_diff.json и timing_diff.md в папке повтора"""
+    replay_dir = Path(replay_dir)
+    with open(replay_dir / "timing_diff.json", 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2, ensure_ascii=False)
+
+    def fmt(value):
+        return "—" if value is None else f"{value:.2f}"
+
+    lines = [
+        "| Этап | Исходный, сек | Повтор, сек | Δ, сек | Модель |",
+        "|------|---------------|-------------|--------|--------|",
+    ]
+    for row in rows:
+        model = row['replay_model'] or row['source_model'] or "—"
+        lines.append(f"| {row['stage']} | {fmt(row['source_sec'])} | {fmt(row['replay_sec'])} | "
+                     f"{fmt(row['delta_sec'])} | {model} |")
+    table = "\n".join(lines) + "\n"
+
+    with open(replay_dir / "timing_diff.md", 'w', encoding='utf-8') as f:
+        f.write("# Сравнение времени этапов\n\n")
+        f.write(table)
+    return table
+
+
+def replay_crew(task_dir, from_stage, model=None, prompt_overrides=None, use_cache=False, on_event=None,
+                direct=False):
+    """Повторяет этапы начиная с from_stage на результатах сохранённого запуска.
+
+    Результат пишется в соседнюю папку <task_dir>_replay_<stage>_<время> вместе с timing_diff.
+    direct=True - этапы идут прямыми запросами к Ollama (arun_crew), иначе через CrewAI.
+    """
+    manifest, outputs = prepare_replay(task_dir, from_stage, model, prompt_overrides)
+    emit("replay.start", f"🔁 Повтор с этапа {from_stage}: {manifest['task_dir']}", task_id=manifest['task_timestamp'],
+         stage=from_stage, source=str(task_dir))
+
+    if direct:
+        from core.async_runner import _aexecute_run, run_cancellable
+        result = run_cancellable(_aexecute_run(manifest, outputs, use_cache, on_event))
+    else:
+        result = _execute_run(manifest, outputs, use_cache, on_event)
+
+    table = write_timing_diff(manifest['task_dir'], timing_diff(task_dir, manifest['task_dir'], manifest['stages']))
+    print(table)
+    return result, manifest['task_dir']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Повтор этапов сохранённого запуска AI Office")
+    parser.add_argument("task_dir", help="Папка задачи (workspace/temp/task_...)")
+    parser.add_argument("--from", dest="from_stage", required=True, choices=PIPELINE_STAGES,
+                        help="С какого этапа выполнить заново")
+    parser.add_argument("--model", help="Другая модель для повторяемых этапов")
+    parser.add_argument("--prompt", action="append", default=[], metavar="STAGE=FILE",
+                        help="Свой шаблон промпта этапа из файла ({input} - вход этапа)")
+    parser.add_argument("--cache", action="store_true", help="Разрешить ответы из кэша этапов")
+    parser.add_argument("--direct", action="store_true", help="Прямые запросы к Ollama вместо CrewAI")
+    args = parser.parse_args()
+
+    prompt_overrides = {}
+    for item in args.prompt:
+        stage, _, path = item.partition("=")
+        with open(path, 'r', encoding='utf-8') as f:
+            prompt_overrides[stage] = f.read()
+
+    _, replay_dir = replay_crew(args.task_dir, args.from_stage, args.model, prompt_overrides,
+                                use_cache=args.cache, direct=args.direct)
+    print(f"📁 Результат повтора: {replay_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -166,6 +166,30 @@ class ProjectRequirements:
 
         return (score / total) * 100 if total > 0 else 0
 
+    def merge_extracted(self, extracted: dict, keep=()) -> list:
+        """Добавляет результат LLMExtractor, не теряя уже найденного.
+
+        Списки объединяются (существующие значения первыми), скалярные поля заменяются
+        значением LLM, если оно задано и поле не входит в keep (например, найдено ключевыми словами).
+        Возвращает список изменившихся полей.
+        """
+        changed = []
+        for name in ('technologies', 'forbidden', 'colors', 'features'):
+            current = getattr(self, name)
+            added = [item for item in extracted.get(name) or [] if isinstance(item, str) and item not in current]
+            if added:
+                current.extend(added)
+                changed.append(name)
+        for name in ('project_type', 'style', 'mood', 'animation_speed'):
+            value = extracted.get(name)
+            if name in keep or not isinstance(value, str) or not value or value == getattr(self, name):
+                continue
+            setattr(self, name, value)
+            changed.append(name)
+        if changed:
+            self.update()
+        return changed
+
     def is_ready(self, min_confidence: float = 70.0) -> bool:
         """Проверяет, достаточно ли информации для запуска"""
         return self.get_confidence_score() >= min_confidence
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+class StageCache:
+    """Дисковый кэш ответов этапов run_crew (ключ - хэш промпта, агента и настроек модели)"""
+
+    def __init__(self, cache_dir: Path, max_entries: int = 500, max_bytes: int = 200 * 1024 * 1024,
+                 enabled: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+        # Счётчики попаданий/промахов за время жизни процесса
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Текущие число записей и объём: каталог обходится один раз, дальше счётчики ведёт put
+        self._count = None
+        self._bytes = 0
+
+    @staticmethod
+    def make_key(description: str, agent_spec: dict, model: str, settings: dict) -> str:
+        """Строит content-addressed ключ из отрендеренного Task, агента, модели и сэмплинга"""
+        payload = json.dumps({
+            'description': description,
+            'agent': agent_spec,
+            'model': model,
+            'settings': settings,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        # Раскладываем по подпапкам, чтобы не держать тысячи файлов в одной директории
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        """Возвращает сохранённый ответ или None"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Обновляем mtime - по нему работает LRU
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry.get('output')
+
+    def put(self, key: str, output: str, meta: dict = None):
+        """Сохраняет ответ этапа и при необходимости вытесняет старые записи"""
+        if not self.enabled:
+            return
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            old_size = path.stat().st_size
+        except OSError:
+            old_size = None
+
+        entry = {
+            'key': key,
+            'output': output,
+            'meta': meta or {},
+            'created_at': datetime.now().isoformat(),
+        }
+
+        # Пишем через временный файл, чтобы не оставить битую запись при падении
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._count is None:
+                self._recount()
+            else:
+                self._count += 1 if old_size is None else 0
+                self._bytes += size - (old_size or 0)
+            if self._count > self.max_entries or self._bytes > self.max_bytes:
+                self._evict()
+
+    def _recount(self):
+        entries = self._entries()
+        self._count = len(entries)
+        self._bytes = sum(size for _, size, _ in entries)
+        return entries
+
+    def _entries(self):
+        """Список (mtime, size, path) всех записей кэша"""
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        """LRU-вытеснение по количеству записей и суммарному размеру (вызывается под self._lock,
+        только когда счётчики превысили лимит; каталог перечитывается - его могли менять другие процессы)"""
+        entries = sorted(self._recount())
+        while entries and (self._count > self.max_entries or self._bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self._count -= 1
+            self._bytes -= size
+
+    def clear(self):
+        """Полностью очищает кэш"""
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self._count, self._bytes = 0, 0
+
+    def stats(self) -> dict:
+        """Статистика кэша: число записей и объём - из счётчиков put/_evict, каталог обходится
+        только при первом вызове (записи других процессов учитываются при следующем вытеснении)"""
+        with self._lock:
+            if self._count is None:
+                self._recount()
+            count, size = self._count, self._bytes
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            'entries': count,
+            'bytes': size,
+        }
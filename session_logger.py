@@ -1,8 +1,341 @@
 import os
+import sys
+import atexit
+import queue
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
 import traceback
 import json
+import re
+
+# Через сколько записей состояния обновлять снапшот журнала
+STATE_COMPACT_EVERY = 200
+# Сколько ждать дозаписи журнала перед снапшотом (сек); не успел - снапшот пропускается
+STATE_FLUSH_TIMEOUT = 10.0
+
+# Пакетная запись: размер очереди, порог сброса в байтах и по времени, политика при переполнении
+LOG_QUEUE_SIZE = int(os.environ.get("AI_OFFICE_LOG_QUEUE", "10000"))
+LOG_FLUSH_BYTES = 64 * 1024
+LOG_FLUSH_INTERVAL = 0.5
+LOG_OVERFLOW = os.environ.get("AI_OFFICE_LOG_OVERFLOW", "block")  # block - ждать, drop - отбросить
+
+# Индекс каталога логов и размер страницы при постраничном чтении
+SESSION_INDEX_FILE = "index.json"
+LOG_PAGE_BYTES = 64 * 1024
+# Файлы сессии: префикс_<сессия>.расширение -> вид файла в индексе
+SESSION_FILE_RE = re.compile(r'^(session|chat|errors|state|events)_(.+)\.(log|md|jsonl|json)$')
+SESSION_FILE_KINDS = {
+    ('session', 'log'): 'log',
+    ('chat', 'md'): 'chat',
+    ('errors', 'log'): 'errors',
+    ('state', 'json'): 'state',
+    ('state', 'jsonl'): 'state_journal',
+    ('events', 'jsonl'): 'events',
+}
+
+
+class LogWriter:
+    """Фоновый поток записи логов: строки копятся по файлам и пишутся пачками.
+
+    Вызывающий поток только кладёт строку в очередь. Сброс - при LOG_FLUSH_BYTES накопленных байт,
+    раз в LOG_FLUSH_INTERVAL сек и по flush(). path=None - вывод в консоль.
+    При переполнении очереди overflow="block" ждёт, "drop" отбрасывает строку и считает потери.
+    """
+
+    def __init__(self, max_queue=LOG_QUEUE_SIZE, flush_bytes=LOG_FLUSH_BYTES, flush_interval=LOG_FLUSH_INTERVAL,
+                 overflow=LOG_OVERFLOW):
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="session-log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path, text):
+        if self._closed:
+            self._write_batch({path: [text]})
+            return
+        if self.overflow == "drop":
+            try:
+                self._queue.put_nowait((path, text))
+            except queue.Full:
+                self.dropped += 1
+        else:
+            self._queue.put((path, text))
+
+    def flush_marker(self):
+        """Ставит в очередь метку сброса; событие выставится, когда всё, что было до неё, записано"""
+        done = threading.Event()
+        if self._closed:
+            done.set()
+        else:
+            self._queue.put(done)
+        return done
+
+    def flush(self, timeout=10.0):
+        """Дожидается записи всего, что уже в очереди; False - не дождался за timeout"""
+        return self.flush_marker().wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=10.0)
+
+    def _write_batch(self, pending):
+        for path, parts in pending.items():
+            text = "".join(parts)
+            try:
+                if path is None:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                else:
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(text)
+            except Exception as e:
+                sys.stderr.write(f"⚠️ Не удалось записать лог {path}: {e}\n")
+
+    def _run(self):
+        pending, size = {}, 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ...
+
+            stop = item is None
+            if isinstance(item, tuple):
+                path, text = item
+                pending.setdefault(path, []).append(text)
+                size += len(text)
+
+            flush_requested = isinstance(item, threading.Event) or stop
+            if pending and (flush_requested or size >= self.flush_bytes
+                            or time.monotonic() - last_flush >= self.flush_interval):
+                if self.dropped:
+                    pending.setdefault(None, []).append(f"⚠️ Отброшено строк лога: {self.dropped}\n")
+                    self.dropped = 0
+                self._write_batch(pending)
+                pending, size = {}, 0
+                last_flush = time.monotonic()
+
+            if isinstance(item, threading.Event):
+                item.set()
+            if stop:
+                return
+
+
+def _write_json_atomic(path: Path, data: dict):
+    """Пишет JSON через временный файл - при падении остаётся предыдущая версия"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_state(snapshot_file, journal_file=None):
+    """Восстанавливает состояние сессии: снапшот + хвост журнала после него.
+
+    Возвращает {'session_name', 'session_start', 'count', 'current': {key: запись}, 'tail': [записи после снапшота]}.
+    Недописанная последняя строка журнала (падение во время записи) пропускается.
+    """
+    snapshot_file = Path(snapshot_file)
+    journal_file = Path(journal_file) if journal_file else snapshot_file.with_suffix(".jsonl")
+
+    state = {'session_name': None, 'session_start': None, 'count': 0, 'current': {}, 'offset': 0}
+    if snapshot_file.exists():
+        try:
+            with open(snapshot_file, 'r', encoding='utf-8') as f:
+                state.update(json.load(f))
+        except ValueError:
+            pass
+        # Старый формат: весь список состояний в одном JSON
+        for entry in state.pop('states', None) or []:
+            state['current'][entry['key']] = entry
+            state['count'] += 1
+
+    tail = []
+    if journal_file.exists():
+        with open(journal_file, 'rb') as f:
+            f.seek(state['offset'])
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                tail.append(entry)
+                state['current'][entry['key']] = entry
+                state['count'] += 1
+
+    state['tail'] = tail
+    return state
+
+
+def read_page(path, end=None, page_bytes=LOG_PAGE_BYTES):
+    """Страница файла с конца: байты [start, end), start выровнен на начало строки.
+
+    end=None - последняя страница. Возвращает {'text', 'start', 'end', 'size'};
+    start > 0 - есть более ранние страницы, следующая читается как read_page(path, end=start).
+    """
+    size = os.path.getsize(path)
+    end = size if end is None else max(0, min(end, size))
+    start = max(0, end - page_bytes)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    if start > 0:
+        # Обрезанную первую строку отдаём следующей странице (если строка не длиннее страницы)
+        newline = data.find(b"\n")
+        if 0 <= newline < len(data) - 1:
+            start += newline + 1
+            data = data[newline + 1:]
+    return {'text': data.decode('utf-8', errors='replace'), 'start': start, 'end': end, 'size': size}
+
+
+def _read_head(path, size):
+    with open(path, 'rb') as f:
+        return f.read(size).decode('utf-8', errors='replace')
+
+
+def _count_occurrences(path, needle: bytes, start=0, chunk_size=1024 * 1024):
+    """Число вхождений needle в файле начиная с байта start, файл читается кусками"""
+    count, tail = 0, b""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return count
+            data = tail + chunk
+            count += data.count(needle)
+            # Хвост короче needle не может содержать целого вхождения - совпадения не задваиваются
+            tail = data[-(len(needle) - 1):] if len(needle) > 1 else b""
+
+
+def _read_new_events(path, start, event):
+    """События типа event из строк после байта start: (записи, позиция после последней целой строки)"""
+    needle = f'"event": "{event}"'.encode('utf-8')
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for line in f:
+            # Недописанную строку прочитаем при следующем обновлении
+            if not line.endswith(b"\n"):
+                break
+            start += len(line)
+            if needle not in line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records, start
+
+
+class SessionIndex:
+    """Индекс каталога логов (index.json): файлы каждой сессии, размеры, число ошибок, время этапов.
+
+    refresh() обходит каталог одним os.scandir и перечитывает только изменившиеся файлы:
+    ошибки и суммы stage.end досчитываются с прошлой позиции в файле,
+    начало и конец сессии берутся из краёв лога.
+    """
+
+    def __init__(self, log_dir, index_file=None):
+        self.log_dir = Path(log_dir)
+        self.index_file = Path(index_file) if index_file else self.log_dir / SESSION_INDEX_FILE
+
+    def load(self) -> dict:
+        if not self.index_file.exists():
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('sessions', {})
+        except ValueError:
+            return {}
+
+    def path(self, session: dict, kind: str):
+        """Путь к файлу сессии данного вида или None"""
+        info = session['files'].get(kind)
+        return self.log_dir / info['name'] if info else None
+
+    def refresh(self) -> dict:
+        """Обновляет индекс по текущему содержимому каталога и возвращает {сессия: метаданные}"""
+        sessions = self.load()
+        seen = set()
+        changed = False
+
+        with os.scandir(self.log_dir) as entries:
+            for entry in entries:
+                match = SESSION_FILE_RE.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                prefix, session_id, ext = match.groups()
+                kind = SESSION_FILE_KINDS.get((prefix, ext))
+                if kind is None:
+                    continue
+                seen.add((session_id, kind))
+
+                stat = entry.stat()
+                session = sessions.setdefault(session_id, {'files': {}, 'errors': 0})
+                known = session['files'].get(kind)
+                # Индексы старого формата ещё не знают позиции в events-файле
+                fresh = kind != 'events' or 'events_offset' in session
+                if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime and fresh:
+                    continue
+
+                self._update_file(session, kind, entry.path, known, stat.st_size)
+                session['files'][kind] = {'name': entry.name, 'size': stat.st_size, 'mtime': stat.st_mtime}
+                changed = True
+
+        # Удалённые файлы и сессии
+        for session_id in list(sessions):
+            files = sessions[session_id]['files']
+            for kind in [kind for kind in files if (session_id, kind) not in seen]:
+                del files[kind]
+                if kind == 'events':
+                    sessions[session_id].pop('stage_totals', None)
+                    sessions[session_id].pop('events_offset', None)
+                changed = True
+            if not files:
+                del sessions[session_id]
+
+        for session in sessions.values():
+            session['size'] = sum(info['size'] for info in session['files'].values())
+            session['updated'] = max(info['mtime'] for info in session['files'].values())
+
+        if changed:
+            _write_json_atomic(self.index_file, {'sessions': sessions})
+        return sessions
+
+    @staticmethod
+    def _update_file(session, kind, path, known, size):
+        if kind == 'errors':
+            # Файл только дописывается: считаем записи после прошлого размера
+            if known and size >= known['size']:
+                session['errors'] += _count_occurrences(path, b"ERROR at ", known['size'])
+            else:
+                session['errors'] = _count_occurrences(path, b"ERROR at ")
+        elif kind == 'events':
+            from core.events import add_stage_timings
+            offset = session.get('events_offset', 0)
+            if size < offset:
+                session['stage_totals'], offset = {}, 0
+            records, session['events_offset'] = _read_new_events(path, offset, "stage.end")
+            session['stage_totals'] = add_stage_timings(session.get('stage_totals', {}), records)
+        elif kind == 'log':
+            if not known:
+                started = re.search(r'SESSION START: (.+)', _read_head(path, 256))
+                session['started'] = started.group(1).strip() if started else None
+            tail = read_page(path, page_bytes=256)['text']
+            ended = re.search(r'SESSION END: (.+)', tail)
+            session['ended'] = ended.group(1).strip() if ended else None
 
 
 class SessionLogger:
@@ -22,7 +355,25 @@ class SessionLogger:
         self.log_file = self.log_dir / f"session_{session_name}.log"
         self.chat_file = self.log_dir / f"chat_{session_name}.md"
         self.errors_file = self.log_dir / f"errors_{session_name}.log"
+        # Структурные события core.events (по строке JSON на событие)
+        self.events_file = self.log_dir / f"events_{session_name}.jsonl"
+        # Состояние: журнал только на дозапись + периодический снапшот текущих значений
         self.state_file = self.log_dir / f"state_{session_name}.json"
+        self.state_journal = self.log_dir / f"state_{session_name}.jsonl"
+        self._state_current = {}
+        self._state_count = 0
+        self._state_compacted = 0
+        # Байт журнала в очереди писателя и на диске - позиция для снапшота без stat()
+        self._state_offset = 0
+        self._state_compacting = False
+        self._state_lock = threading.Lock()
+        self._session_start = datetime.now().isoformat()
+
+        # Все записи после старта сессии идут через фоновый поток
+        self._writer = LogWriter()
+        # Подключённый приёмник core.events (один на логгер)
+        self._event_sink = None
+        atexit.register(self._writer.close)
 
         # Начинаем сессию
         self._start_session()
@@ -44,94 +395,134 @@ class SessionLogger:
             f.write(f"# Ошибки сессии {self.session_name}\n\n")
             f.write(f"**Начало:** {datetime.now()}\n\n")
 
-        # Инициализируем state файл
-        with open(self.state_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'session_start': datetime.now().isoformat(),
-                'session_name': self.session_name,
-                'states': []
-            }, f, indent=2, ensure_ascii=False)
+        # Инициализируем журнал состояния и пустой снапшот
+        open(self.state_journal, 'w', encoding='utf-8').close()
+        self._compact_state()
 
     def log(self, message, category="INFO"):
         """Запись обычного лога"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         log_entry = f"[{timestamp}] [{category}] {message}\n"
 
-        # В файл
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(log_entry)
-
-        print(f"📝 {log_entry.strip()}")
+        self._writer.write(self.log_file, log_entry)
+        self._writer.write(None, f"📝 {log_entry}")
 
     def log_chat(self, speaker, message):
         """Запись сообщения в чат-формате"""
         timestamp = datetime.now().strftime("%H:%M:%S")
 
-        with open(self.chat_file, 'a', encoding='utf-8') as f:
-            f.write(f"### [{timestamp}] {speaker}\n\n")
-            f.write(f"{message}\n\n")
-            f.write("---\n\n")
-
-        print(f"💬 [{speaker}] {message[:50]}...")
+        self._writer.write(self.chat_file, f"### [{timestamp}] {speaker}\n\n{message}\n\n---\n\n")
+        self._writer.write(None, f"💬 [{speaker}] {message[:50]}...\n")
 
     def log_error(self, error, context=None):
         """Запись ошибки с контекстом"""
         timestamp = datetime.now().strftime("%H:%M:%S")
 
-        with open(self.errors_file, 'a', encoding='utf-8') as f:
-            f.write(f"\n{'=' * 40}\n")
-            f.write(f"ERROR at {timestamp}\n")
-            f.write(f"{'=' * 40}\n")
-            f.write(f"Type: {type(error).__name__}\n")
-            f.write(f"Message: {str(error)}\n")
-            if context:
-                f.write(f"Context: {context}\n")
-            f.write(f"Traceback:\n{traceback.format_exc()}\n")
+        # Трейсбек берётся здесь - в фоновом потоке его уже нет
+        entry = (f"\n{'=' * 40}\n"
+                 f"ERROR at {timestamp}\n"
+                 f"{'=' * 40}\n"
+                 f"Type: {type(error).__name__}\n"
+                 f"Message: {str(error)}\n")
+        if context:
+            entry += f"Context: {context}\n"
+        entry += f"Traceback:\n{traceback.format_exc()}\n"
+        self._writer.write(self.errors_file, entry)
 
         self.log(f"❌ ERROR: {str(error)}", category="ERROR")
 
     def log_state(self, key, value):
-        """Запись состояния в JSON"""
+        """Запись состояния: одна строка в журнал, время записи не растёт с длиной сессии"""
         try:
-            # Читаем существующий файл
-            if self.state_file.exists():
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    state_data = json.load(f)
-            else:
-                state_data = {'states': []}
-
-            # Добавляем новое состояние
-            state_data['states'].append({
+            entry = {
                 'timestamp': datetime.now().isoformat(),
                 'key': key,
                 'value': str(value),
                 'type': str(type(value).__name__)
-            })
-
-            # Сохраняем
-            with open(self.state_file, 'w', encoding='utf-8') as f:
-                json.dump(state_data, f, indent=2, ensure_ascii=False)
+            }
+            line = json.dumps(entry, ensure_ascii=False) + "\n"
+            with self._state_lock:
+                self._writer.write(self.state_journal, line)
+                self._state_current[key] = entry
+                self._state_count += 1
+                self._state_offset += len(line.encode('utf-8'))
+                compact = self._state_count - self._state_compacted >= STATE_COMPACT_EVERY
+            if compact:
+                self._compact_state()
 
         except Exception as e:
             self.log_error(e, f"Failed to log state: {key}")
 
+    def _compact_state(self, timeout=STATE_FLUSH_TIMEOUT):
+        """Снапшот текущих значений и позиции в журнале - читателю остаётся только хвост.
+
+        Под _state_lock берётся только копия состояния, запись на диск идёт без блокировки.
+        Снапшот пишется, когда журнал дописан до его позиции; не дописан за timeout - пропускается
+        (следующая попытка - через STATE_COMPACT_EVERY записей). Возвращает True, если снапшот записан.
+        """
+        with self._state_lock:
+            if self._state_compacting:
+                return False
+            self._state_compacting = True
+            self._state_compacted = self._state_count
+            snapshot = {
+                'session_start': self._session_start,
+                'session_name': self.session_name,
+                'count': self._state_count,
+                'offset': self._state_offset,
+                'current': dict(self._state_current),
+            }
+            flushed = self._writer.flush_marker()
+        try:
+            if not flushed.wait(timeout):
+                return False
+            _write_json_atomic(self.state_file, snapshot)
+            return True
+        finally:
+            with self._state_lock:
+                self._state_compacting = False
+
+    def event_sink(self):
+        """Приёмник core.events: события пишутся в events_<сессия>.jsonl через фоновый поток"""
+        from core.events import JsonlSink
+        return JsonlSink(self.events_file, self._writer)
+
+    def attach_events(self):
+        """Подключает event_sink к core.events один раз на логгер - повторные вызовы ничего не добавляют"""
+        from core.events import add_sink
+        if self._event_sink is None:
+            self._event_sink = add_sink(self.event_sink())
+        return self._event_sink
+
+    def detach_events(self):
+        from core.events import remove_sink
+        if self._event_sink is not None:
+            remove_sink(self._event_sink)
+            self._event_sink = None
+
+    def flush(self):
+        """Дожидается записи всех накопленных логов"""
+        self._writer.flush()
+
     def end_session(self):
         """Завершение сессии"""
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(f"\n{'=' * 60}\n")
-            f.write(f"SESSION END: {datetime.now()}\n")
-            f.write(f"{'=' * 60}\n")
-
-        with open(self.chat_file, 'a', encoding='utf-8') as f:
-            f.write(f"\n**Конец:** {datetime.now()}\n")
+        self._writer.write(self.log_file, f"\n{'=' * 60}\nSESSION END: {datetime.now()}\n{'=' * 60}\n")
+        self._writer.write(self.chat_file, f"\n**Конец:** {datetime.now()}\n")
 
+        self._compact_state()
         self.log(f"✅ Сессия {self.session_name} завершена")
+        # После закрытия писателя события в этот файл больше не идут
+        self.detach_events()
+        self._writer.close()
+        atexit.unregister(self._writer.close)
 
         return {
             'session': str(self.log_file),
             'chat': str(self.chat_file),
             'errors': str(self.errors_file),
+            'events': str(self.events_file),
             'state': str(self.state_file),
+            'state_journal': str(self.state_journal),
             'dir': str(self.log_dir)
         }
 
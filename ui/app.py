@@ -10,7 +10,7 @@ import subprocess
 from datetime import datetime
 from io import StringIO
 import contextlib
-import json
+import asyncio
 
 # Отключаем обработку сигналов в CrewAI (для Streamlit)
 import os
@@ -22,7 +22,10 @@ os.environ["CREWAI_DISABLE_SIGNALS"] = "true"
 ROOT = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT))
 
-from core.crew_runner import run_crew, create_backup, cleanup_temp_files
+from core.crew_runner import create_backup, cleanup_temp_files
+from core.async_runner import arun_crew, aresume_crew, run_cancellable
+from core.checkpoints import find_incomplete_runs
+from core.events import QueueSink, add_sink, remove_sink
 from session_logger import get_logger, end_session
 
 # Настройка страницы
@@ -33,6 +36,9 @@ BACKUP_PATH = Path("C:/Users/Aki/Desktop/Need/Need/MyProject_AI-office/Backup")
 PROJECTS_PATH = ROOT / "workspace" / "projects"
 TEMP_PATH = ROOT / "workspace" / "temp"
 
+# Диалогов на странице «История»
+DIALOG_HISTORY_PAGE_SIZE = 10
+
 # Инициализация session state
 DEFAULT_STATE = {
     'logs': [],
@@ -55,9 +61,14 @@ DEFAULT_STATE = {
     'waiting_for_response': False,
     'final_spec': None,
     'show_dialog_history': False,
+    'dialog_history_page': 0,
     'task_from_spec': None,
     'start_time': None,
-    'log_queue': None
+    'log_queue': None,
+    'current_stage': None,
+    'stream_text': {},
+    'stop_flag_ref': None,
+    'resume_dir': None
 }
 
 for key, value in DEFAULT_STATE.items():
@@ -69,6 +80,10 @@ if st.session_state.session_logger is None:
     st.session_state.session_logger = get_logger()
     st.session_state.session_logger.log("🚀 Streamlit UI запущен")
 
+# Структурные события конвейера - в events_<сессия>.jsonl; логгер общий на процесс,
+# приёмник подключается к нему один раз, сколько бы вкладок ни открылось
+get_logger().attach_events()
+
 
 # Кэш для проверки здоровья (обновляется раз в 30 секунд)
 @st.cache_data(ttl=30)
@@ -116,17 +131,49 @@ def auto_recover():
         return False
 
 
-def run_agents_with_logs(task, log_queue, status_dict, project_files_list, stop_flag_ref):
-    """Оптимизированная версия с меньшим количеством логов"""
+# Этапы run_crew -> карточки прогресса в UI
+STAGE_TO_AGENT = {
+    'translator': 'planner',
+    'planner': 'planner',
+    'developer': 'developer',
+    'developer_retry': 'developer',
+    'reviewer': 'reviewer',
+}
+
+
+def stage_agent(stage):
+    """Карточка UI для этапа (кандидаты developer#N относятся к разработчику)"""
+    return STAGE_TO_AGENT.get((stage or '').split('#')[0])
+
+
+def run_agents_with_logs(task, log_queue, status_dict, project_files_list, stop_flag_ref, resume_dir=None,
+                         spec=None, requirements=None, pipeline="full", candidates=1):
+    """Запускает arun_crew в фоне и пробрасывает потоковые события этапов в log_queue.
+
+    resume_dir - продолжить прерванный запуск из его чекпоинтов вместо нового.
+    spec, requirements, pipeline и candidates читаются из st.session_state в потоке скрипта: у фонового потока
+    нет контекста Streamlit, и session_state в нём пустой.
+    """
 
     def heartbeat():
         log_queue.put(("heartbeat", time.time()))
 
+    def on_event(event_type, data):
+        # stage_start / token / stage_end уходят в очередь как есть
+        agent = stage_agent(data.get('stage'))
+        if agent and event_type == "stage_start":
+            status_dict[agent] = 'working'
+            log_queue.put(("status", status_dict.copy()))
+        log_queue.put((event_type, data))
+
     heartbeat()
 
     temp_dir = TEMP_PATH / f"project_{int(time.time())}"
     temp_dir.mkdir(parents=True, exist_ok=True)
 
+    # События конвейера (core.events) идут в ту же очередь как ("event", record)
+    event_sink = add_sink(QueueSink(log_queue))
+
     try:
         # Минимальная проверка здоровья
         health = check_ollama_health()
@@ -134,44 +181,41 @@ def run_agents_with_logs(task, log_queue, status_dict, project_files_list, stop_
             log_queue.put(("log", "❌ Ollama не отвечает"))
             return
 
-        # Планировщик
         if stop_flag_ref[0]: return
-        status_dict['planner'] = 'working'
-        log_queue.put(("status", status_dict.copy()))
-        log_queue.put(("progress", {'planner': 30, 'total': 10}))
 
-        # ИСПРАВЛЕНИЕ 1: Безопасная проверка final_spec
-        try:
-            has_spec = st.session_state.get('final_spec', None) is not None
-        except:
-            has_spec = False
+        def run_pipeline(spec=None):
+            # Стоп-флаг отменяет корутину и обрывает текущий запрос к Ollama
+            return run_cancellable(
+                arun_crew(task, spec, requirements=requirements, on_event=on_event,
+                          pipeline=pipeline, developer_candidates=candidates),
+                should_stop=lambda: stop_flag_ref[0],
+            )
 
         # ИСПРАВЛЕНИЕ 2: result объявляем до использования
         result = None
 
-        if has_spec:
+        if resume_dir:
+            log_queue.put(("log", f"♻️ Продолжение запуска {Path(resume_dir).name}"))
+            result = run_cancellable(
+                aresume_crew(resume_dir, on_event=on_event),
+                should_stop=lambda: stop_flag_ref[0],
+            )
+        elif spec is not None:
             try:
-                spec = st.session_state.final_spec
-                result = run_crew(task, spec)
+                result = run_pipeline(spec)
             except Exception as e:
                 log_queue.put(("log", f"⚠️ Ошибка с ТЗ: {str(e)[:50]}, запускаю без ТЗ"))
-                result = run_crew(task)
+                result = run_pipeline()
         else:
-            result = run_crew(task)
+            result = run_pipeline()
 
         if stop_flag_ref[0]: return
 
         # Проверяем, что result не пустой
         if result is None:
-            log_queue.put(("log", "❌ run_crew вернул None"))
+            log_queue.put(("log", "❌ arun_crew вернул None"))
             return
 
-        # Разработчик
-        status_dict['planner'] = 'done'
-        status_dict['developer'] = 'working'
-        log_queue.put(("status", status_dict.copy()))
-        log_queue.put(("progress", {'developer': 30, 'total': 50}))
-
         # Сохраняем результат
         code_file = temp_dir / "output.py"
         with open(code_file, 'w', encoding='utf-8') as f:
@@ -185,15 +229,8 @@ def run_agents_with_logs(task, log_queue, status_dict, project_files_list, stop_
 
         if stop_flag_ref[0]: return
 
-        # Ревьюер
-        status_dict['developer'] = 'done'
-        status_dict['reviewer'] = 'working'
-        log_queue.put(("status", status_dict.copy()))
-        log_queue.put(("progress", {'reviewer': 30, 'total': 80}))
-
-        time.sleep(0.5)  # Минимальная задержка
-
-        status_dict['reviewer'] = 'done'
+        for agent in ('planner', 'developer', 'reviewer'):
+            status_dict[agent] = 'done'
         log_queue.put(("status", status_dict.copy()))
         log_queue.put(("progress", {'total': 100}))
         log_queue.put(("result", result_text))
@@ -206,10 +243,53 @@ def run_agents_with_logs(task, log_queue, status_dict, project_files_list, stop_
             for file_path in project_files_list:
                 shutil.copy2(Path(file_path), project_dir)
 
+    except asyncio.CancelledError:
+        log_queue.put(("log", "⛔ Остановлено, генерация прервана"))
     except Exception as e:
         log_queue.put(("log", f"❌ Ошибка: {str(e)[:100]}"))
         import traceback
         log_queue.put(("log", f"📋 Детали: {traceback.format_exc()[:200]}"))
+    finally:
+        remove_sink(event_sink)
+
+
+def handle_queue_message(msg_type, msg_data):
+    """Применяет одно сообщение из log_queue к session_state"""
+    if msg_type == "log":
+        st.session_state.logs.append(msg_data)
+    elif msg_type == "event":
+        if msg_data.get('message'):
+            st.session_state.logs.append(msg_data['message'])
+    elif msg_type == "status":
+        st.session_state.status = msg_data
+    elif msg_type == "progress":
+        for key in ('planner', 'developer', 'reviewer', 'total'):
+            if key in msg_data:
+                st.session_state.progress[key] = msg_data[key]
+    elif msg_type == "stage_start":
+        st.session_state.current_stage = msg_data['stage']
+        st.session_state.stream_text[msg_data['stage']] = ""
+        st.session_state.logs.append(f"▶️ Этап {msg_data['stage']}")
+    elif msg_type == "token":
+        stage = msg_data['stage']
+        st.session_state.stream_text[stage] = st.session_state.stream_text.get(stage, "") + msg_data['text']
+        # Грубая оценка прогресса этапа по объёму сгенерированного текста (~4 символа на токен)
+        agent = stage_agent(stage)
+        if agent:
+            expected_chars = int(os.environ.get("OPENAI_MAX_TOKENS", "2000")) * 4
+            done = len(st.session_state.stream_text[stage]) * 100 // expected_chars
+            st.session_state.progress[agent] = max(st.session_state.progress[agent], min(95, 5 + done))
+    elif msg_type == "stage_end":
+        agent = stage_agent(msg_data['stage'])
+        if agent:
+            st.session_state.progress[agent] = 100
+        cached = " (кэш)" if msg_data.get('cached') else ""
+        st.session_state.logs.append(f"✅ Этап {msg_data['stage']}: {msg_data['duration']:.1f} сек{cached}")
+    elif msg_type == "result":
+        st.session_state.result = msg_data
+        st.session_state.is_running = False
+        st.session_state.session_logger.log_chat("Агенты", str(msg_data)[:200])
+        st.success("✅ Готово!")
 
 
 def update_progress_bars():
@@ -222,9 +302,12 @@ def update_progress_bars():
         'stopped': 0
     }
 
-    st.session_state.progress['planner'] = status_to_progress.get(st.session_state.status['planner'], 0)
-    st.session_state.progress['developer'] = status_to_progress.get(st.session_state.status['developer'], 0)
-    st.session_state.progress['reviewer'] = status_to_progress.get(st.session_state.status['reviewer'], 0)
+    for agent in ('planner', 'developer', 'reviewer'):
+        status = st.session_state.status[agent]
+        # Во время работы прогресс приходит из потока токенов
+        if status == 'working':
+            continue
+        st.session_state.progress[agent] = status_to_progress.get(status, 0)
 
     total = (st.session_state.progress['planner'] +
              st.session_state.progress['developer'] +
@@ -235,6 +318,9 @@ def update_progress_bars():
 def stop_process():
     """Быстрая остановка процесса"""
     st.session_state.stop_flag = True
+    # Флаг, который видит фоновый поток - по нему отменяется текущая генерация
+    if st.session_state.stop_flag_ref is not None:
+        st.session_state.stop_flag_ref[0] = True
     st.session_state.status = {'planner': 'stopped', 'developer': 'stopped', 'reviewer': 'stopped'}
     st.session_state.is_running = False
     if st.session_state.current_project_files:
@@ -353,6 +439,17 @@ with st.sidebar:
                 if auto_recover():
                     st.rerun()
 
+    # Запуски, прерванные падением процесса или перезагрузкой Streamlit
+    incomplete_runs = find_incomplete_runs(TEMP_PATH, limit=5) if not st.session_state.is_running else []
+    if incomplete_runs:
+        with st.expander(f"♻️ Незавершённые запуски ({len(incomplete_runs)})", expanded=False):
+            for run in incomplete_runs:
+                st.caption(f"📅 {run['task_timestamp'][:15]} | {run['user_task'][:40]}")
+                if st.button("▶️ Продолжить", key=f"resume_{run['task_timestamp']}", use_container_width=True):
+                    st.session_state.resume_dir = run['task_dir']
+                    st.session_state.start_agents = True
+                    st.rerun()
+
     with st.expander("💾 Бекапы", expanded=False):
         if st.button("📦 Создать бекап", use_container_width=True):
             with st.spinner("..."):
@@ -368,6 +465,8 @@ with st.sidebar:
 
     if st.button("🛑 Завершить сессию", use_container_width=True):
         end_session()
+        # Следующий перезапуск начнёт новую сессию логов
+        st.session_state.session_logger = None
         st.success("✅ Логи сохранены")
 
     if st.button("📋 Показать логи сессии", use_container_width=True):
@@ -404,6 +503,13 @@ with col1:
     # ===== ВЫБОР РЕЖИМА =====
     st.divider()
 
+    st.checkbox("⚡ Пропускать лишние этапы по сложности задачи",
+                key="auto_pipeline",
+                help="Простые задачи идут сразу к разработчику, лимит токенов берётся из уровня сложности")
+    st.number_input("🎲 Вариантов разработчика", min_value=1, max_value=4, value=1,
+                    key="developer_candidates",
+                    help="Несколько параллельных генераций (OLLAMA_NUM_PARALLEL), в ревью идёт лучшая")
+
     # Кнопки выбора режима
     mode_col1, mode_col2 = st.columns(2)
 
@@ -439,6 +545,11 @@ with col1:
     # ===== ДИАЛОГ С МЕНЕДЖЕРОМ =====
     if st.session_state.dialog_active and st.session_state.project_manager:
 
+        # Готовые результаты фонового LLM-извлечения дополняют требования
+        refined = st.session_state.project_manager.apply_pending_extraction()
+        if refined:
+            st.caption(f"🧠 Требования уточнены: {', '.join(refined)}")
+
         # Контейнер для сообщений
         chat_container = st.container()
 
@@ -493,7 +604,7 @@ with col1:
 
         with col_b:
             if st.button("🚀 Запуск", use_container_width=True):
-                final_spec = st.session_state.project_manager._generate_final_spec()
+                final_spec = st.session_state.project_manager.finish_dialog()
                 st.session_state.final_spec = final_spec
                 st.session_state.dialog_active = False
                 st.session_state.waiting_for_response = False
@@ -508,38 +619,58 @@ with col1:
 
         with col_d:
             if st.button("📋 История", use_container_width=True):
-                dialog_dir = Path("dialog_history")
-                if dialog_dir.exists():
-                    dialogs = list(dialog_dir.glob("*.json"))
-                    st.session_state.show_dialog_history = True
-                    st.rerun()
+                st.session_state.show_dialog_history = True
+                st.session_state.dialog_history_page = 0
+                st.rerun()
+
+        # Пока LLM уточняет требования, страница опрашивает результат
+        if st.session_state.project_manager.extraction_pending():
+            st.caption("🧠 Уточняю требования в фоне...")
+            time.sleep(1)
+            st.rerun()
 
     # ===== ОТОБРАЖЕНИЕ ИСТОРИИ ДИАЛОГОВ =====
     if st.session_state.get('show_dialog_history', False):
         with st.expander("📚 История диалогов", expanded=True):
-            dialog_dir = Path("dialog_history")
-            if dialog_dir.exists():
-                dialogs = sorted(dialog_dir.glob("*.json"), reverse=True)[:10]
-                for dialog_file in dialogs:
-                    with open(dialog_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                    col_x, col_y = st.columns([3, 1])
-                    with col_x:
-                        st.caption(f"📅 {data['timestamp'][:16]} | Сообщений: {data['message_count']}")
-                        st.write(f"**Задача:** {data['requirements']['initial_task'][:50]}...")
-                    with col_y:
-                        if st.button("📎 Загрузить", key=f"load_{dialog_file.stem}"):
-                            from agents.project_manager import ProjectManager
-
-                            pm = ProjectManager()
-                            pm.load_previous_dialog(dialog_file.stem.replace("dialog_", ""))
-                            st.session_state.project_manager = pm
-                            st.session_state.dialog_messages = pm.dialog_history
-                            st.session_state.dialog_active = True
-                            st.session_state.waiting_for_response = True
-                            st.session_state.show_dialog_history = False
-                            st.rerun()
-                    st.divider()
+            from agents.project_manager import ProjectManager, get_dialog_catalog
+
+            # Список берётся из каталога: одна страница метаданных, сами диалоги не читаются
+            catalog = get_dialog_catalog(ROOT / "dialog_history")
+            query = st.text_input("🔍 Поиск по задаче", key="dialog_history_query").strip() or None
+            page = st.session_state.dialog_history_page
+            total = catalog.count(query)
+            pages = max(1, (total + DIALOG_HISTORY_PAGE_SIZE - 1) // DIALOG_HISTORY_PAGE_SIZE)
+            page = min(page, pages - 1)
+
+            for row in catalog.page(page, DIALOG_HISTORY_PAGE_SIZE, query):
+                col_x, col_y = st.columns([3, 1])
+                with col_x:
+                    ready = " | ✅ ТЗ готово" if row['completed'] or row['ready'] else ""
+                    st.caption(f"📅 {(row['updated_at'] or '')[:16]} | Сообщений: {row['message_count']}{ready}")
+                    st.write(f"**Задача:** {row['task_preview'][:50]}...")
+                with col_y:
+                    if st.button("📎 Загрузить", key=f"load_{row['session_id']}"):
+                        pm = ProjectManager()
+                        pm.load_previous_dialog(row['session_id'])
+                        st.session_state.project_manager = pm
+                        st.session_state.dialog_messages = pm.dialog_history
+                        st.session_state.dialog_active = True
+                        st.session_state.waiting_for_response = True
+                        st.session_state.show_dialog_history = False
+                        st.rerun()
+                st.divider()
+
+            col_prev, col_info, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if page > 0 and st.button("⬅️ Назад", key="dialog_history_prev"):
+                    st.session_state.dialog_history_page = page - 1
+                    st.rerun()
+            with col_info:
+                st.caption(f"Страница {page + 1} из {pages} · диалогов: {total}")
+            with col_next:
+                if page + 1 < pages and st.button("Вперёд ➡️", key="dialog_history_next"):
+                    st.session_state.dialog_history_page = page + 1
+                    st.rerun()
 
     # ===== ОТОБРАЖЕНИЕ ФИНАЛЬНОГО ТЗ =====
     if st.session_state.final_spec:
@@ -572,16 +703,30 @@ with col1:
             st.session_state.current_project_files = []
             st.session_state.status = {'planner': 'idle', 'developer': 'idle', 'reviewer': 'idle'}
             st.session_state.progress = {'planner': 0, 'developer': 0, 'reviewer': 0, 'total': 0}
+            st.session_state.current_stage = None
+            st.session_state.stream_text = {}
             st.session_state.start_time = time.time()
 
             log_queue = queue.Queue()
             st.session_state.log_queue = log_queue
             stop_flag_ref = [st.session_state.stop_flag]
+            st.session_state.stop_flag_ref = stop_flag_ref
+
+            resume_dir = st.session_state.get('resume_dir')
+            st.session_state.resume_dir = None
 
+            # ТЗ, требования из диалога с менеджером и режим конвейера - здесь, в потоке скрипта
+            manager = st.session_state.get('project_manager')
             st.session_state.thread = threading.Thread(
                 target=run_agents_with_logs,
                 args=(task_input, log_queue, st.session_state.status,
-                      st.session_state.current_project_files, stop_flag_ref),
+                      st.session_state.current_project_files, stop_flag_ref, resume_dir),
+                kwargs={
+                    'spec': st.session_state.get('final_spec'),
+                    'requirements': manager.requirements if manager else None,
+                    'pipeline': "auto" if st.session_state.get('auto_pipeline', False) else "full",
+                    'candidates': int(st.session_state.get('developer_candidates', 1)),
+                },
                 daemon=True
             )
             st.session_state.thread.start()
@@ -618,35 +763,24 @@ with col1:
                 elapsed = int(time.time() - st.session_state.start_time)
                 st.info(f"⏱️ Прошло: {elapsed} сек")
 
+            # Живой вывод текущего этапа
+            current_stage = st.session_state.current_stage
+            if current_stage and st.session_state.stream_text.get(current_stage):
+                with st.expander(f"✍️ Генерация: {current_stage}", expanded=True):
+                    st.code(st.session_state.stream_text[current_stage][-2000:], language='html')
+
             # Последние логи
             if st.session_state.logs:
                 with st.expander("📋 Последние логи", expanded=True):
                     for log in st.session_state.logs[-5:]:
                         st.caption(log)
 
-        # Проверяем очередь
+        # Проверяем очередь - забираем всё, что накопилось (токены приходят пачками)
         if st.session_state.thread and hasattr(st.session_state, 'log_queue'):
             try:
-                msg_type, msg_data = st.session_state.log_queue.get(timeout=0.1)
-
-                if msg_type == "log":
-                    st.session_state.logs.append(msg_data)
-                elif msg_type == "status":
-                    st.session_state.status = msg_data
-                elif msg_type == "progress":
-                    if 'planner' in msg_data:
-                        st.session_state.progress['planner'] = msg_data['planner']
-                    if 'developer' in msg_data:
-                        st.session_state.progress['developer'] = msg_data['developer']
-                    if 'reviewer' in msg_data:
-                        st.session_state.progress['reviewer'] = msg_data['reviewer']
-                    if 'total' in msg_data:
-                        st.session_state.progress['total'] = msg_data['total']
-                elif msg_type == "result":
-                    st.session_state.result = msg_data
-                    st.session_state.is_running = False
-                    st.session_state.session_logger.log_chat("Агенты", str(msg_data)[:200])
-                    st.success("✅ Готово!")
+                while True:
+                    msg_type, msg_data = st.session_state.log_queue.get_nowait()
+                    handle_queue_message(msg_type, msg_data)
             except queue.Empty:
                 pass
 
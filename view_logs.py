@@ -3,6 +3,9 @@ from pathlib import Path
 from datetime import datetime
 import json
 
+from core.events import finish_stage_timings
+from session_logger import SessionIndex, read_page, read_state
+
 st.set_page_config(page_title="Session Logs Viewer", page_icon="📋", layout="wide")
 
 st.title("📋 Просмотр логов сессий")
@@ -12,123 +15,165 @@ if not log_dir.exists():
     st.warning("Нет сохранённых логов")
     st.stop()
 
-# Получаем все сессии
-sessions = {}
-for file in log_dir.glob("session_*.log"):
-    session_id = file.stem.replace("session_", "")
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'logs': [],
-            'chats': [],
-            'errors': [],
-            'states': []
-        }
-
-for file in log_dir.glob("*"):
-    if file.is_file():
-        for session_id in sessions.keys():
-            if session_id in file.name:
-                if 'chat' in file.name:
-                    sessions[session_id]['chats'].append(file)
-                elif 'errors' in file.name:
-                    sessions[session_id]['errors'].append(file)
-                elif 'state' in file.name:
-                    sessions[session_id]['states'].append(file)
-                else:
-                    sessions[session_id]['logs'].append(file)
+# Индекс обновляется инкрементально: перечитываются только изменившиеся файлы
+index = SessionIndex(log_dir)
+sessions = {session_id: session for session_id, session in index.refresh().items() if 'log' in session['files']}
+if not sessions:
+    st.warning("Нет сохранённых логов")
+    st.stop()
+
+
+def format_size(size):
+    return f"{size / 1024 / 1024:.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.1f} KB"
+
+
+def format_session(session_id):
+    session = sessions[session_id]
+    errors = f" · ❌ {session['errors']}" if session['errors'] else ""
+    return f"{session_id} · {format_size(session['size'])}{errors}"
+
+
+def show_paged(path, render):
+    """Показывает файл постранично с конца: в память попадает только текущая страница"""
+    key = f"page_end_{path.name}"
+    page = read_page(path, st.session_state.get(key))
+    st.caption(f"Байты {page['start']}–{page['end']} из {page['size']}")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if page['start'] > 0 and st.button("⬆️ Ранее", key=f"older_{path.name}"):
+            st.session_state[key] = page['start']
+            st.rerun()
+    with col2:
+        if page['end'] < page['size'] and st.button("⬇️ К концу", key=f"latest_{path.name}"):
+            st.session_state[key] = None
+            st.rerun()
+
+    render(page['text'])
+
 
 # Выбор сессии
 selected_session = st.selectbox(
     "Выберите сессию:",
-    sorted(sessions.keys(), reverse=True)
+    sorted(sessions.keys(), reverse=True),
+    format_func=format_session
 )
 
 if selected_session:
+    session = sessions[selected_session]
+    files = session['files']
     tab1, tab2, tab3, tab4 = st.tabs(["📊 Обзор", "📝 Логи", "💬 Чат", "❌ Ошибки"])
 
     with tab1:
         st.subheader("Файлы сессии")
-        files = sessions[selected_session]
 
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Лог-файлы", len(files['logs']))
-            st.metric("Чат-файлы", len(files['chats']))
+            st.metric("Файлов", len(files))
+            st.metric("Объём", format_size(session['size']))
         with col2:
-            st.metric("Файлы ошибок", len(files['errors']))
-            st.metric("State-файлы", len(files['states']))
+            st.metric("Ошибок", session['errors'])
+            st.metric("Начало", session.get('started') or "—")
+        if session.get('ended'):
+            st.caption(f"Завершена: {session['ended']}")
 
         # Показываем state если есть
-        if files['states']:
+        if 'state' in files:
             st.subheader("Последнее состояние")
-            with open(files['states'][0], 'r', encoding='utf-8') as f:
-                state = json.load(f)
-            st.json(state)
+            state = read_state(index.path(session, 'state'))
+            st.caption(f"Записей состояния: {state['count']}")
+            st.json({key: entry['value'] for key, entry in state['current'].items()})
+            if state['tail']:
+                with st.expander(f"Последние изменения ({len(state['tail'])})"):
+                    st.json(state['tail'])
+
+        # Время этапов: суммы stage.end индекс досчитывает по мере роста events-файла
+        if session.get('stage_totals'):
+            timings = finish_stage_timings(session['stage_totals'])
+            if timings:
+                st.subheader("Время этапов")
+                st.table([{'Этап': stage, **row} for stage, row in timings.items()])
 
     with tab2:
-        if files['logs']:
-            for log_file in files['logs']:
-                with st.expander(f"📄 {log_file.name}"):
-                    with open(log_file, 'r', encoding='utf-8') as f:
-                        st.text(f.read())
-        else:
-            st.info("Нет лог-файлов")
+        st.markdown(f"📄 {files['log']['name']}")
+        show_paged(index.path(session, 'log'), st.text)
 
     with tab3:
-        if files['chats']:
-            for chat_file in files['chats']:
-                with st.expander(f"💬 {chat_file.name}"):
-                    with open(chat_file, 'r', encoding='utf-8') as f:
-                        st.markdown(f.read())
+        if 'chat' in files:
+            st.markdown(f"💬 {files['chat']['name']}")
+            show_paged(index.path(session, 'chat'), st.markdown)
         else:
             st.info("Нет чат-файлов")
 
     with tab4:
-        if files['errors']:
-            for error_file in files['errors']:
-                with st.expander(f"❌ {error_file.name}"):
-                    with open(error_file, 'r', encoding='utf-8') as f:
-                        st.code(f.read(), language='text')
+        if session['errors']:
+            st.markdown(f"❌ {files['errors']['name']}")
+            show_paged(index.path(session, 'errors'), lambda text: st.code(text, language='text'))
         else:
             st.info("Нет ошибок")
 
+def build_report(session_id, session):
+    """Отчёт о сессии: сводка и время этапов из индекса, последние страницы чата и ошибок, состояние.
+
+    Файлы целиком не читаются - размер отчёта ограничен страницами read_page.
+    """
+    files = session['files']
+    parts = [f"# Отчет о сессии {session_id}\n\n", f"Создан: {datetime.now()}\n\n"]
+
+    parts.append("## Сводка\n\n")
+    parts.append(f"- Начало: {session.get('started') or '—'}\n")
+    parts.append(f"- Завершена: {session.get('ended') or '—'}\n")
+    parts.append(f"- Объём логов: {format_size(session['size'])}\n")
+    parts.append(f"- Ошибок: {session['errors']}\n\n")
+
+    timings = finish_stage_timings(session['stage_totals']) if session.get('stage_totals') else {}
+    if timings:
+        columns = list(next(iter(timings.values())))
+        parts.append("## Время этапов\n\n")
+        parts.append("| Этап | " + " | ".join(columns) + " |\n")
+        parts.append("|---" * (len(columns) + 1) + "|\n")
+        for stage, row in timings.items():
+            parts.append(f"| {stage} | " + " | ".join(str(row.get(column, "")) for column in columns) + " |\n")
+        parts.append("\n")
+
+    def last_page(kind):
+        page = read_page(index.path(session, kind))
+        note = f"_Последние {format_size(page['end'] - page['start'])} из {format_size(page['size'])}_\n\n" \
+            if page['start'] > 0 else ""
+        return note, page['text']
+
+    if 'chat' in files:
+        note, text = last_page('chat')
+        parts.append(f"## Чат\n\n{note}{text}\n")
+
+    if session['errors']:
+        note, text = last_page('errors')
+        parts.append(f"\n## Ошибки\n\n{note}```\n{text}\n```\n")
+
+    if 'state' in files:
+        state = read_state(index.path(session, 'state'))
+        parts.append("\n## Состояние\n\n```json\n")
+        parts.append(json.dumps({key: entry['value'] for key, entry in state['current'].items()},
+                                indent=2, ensure_ascii=False))
+        parts.append("\n```\n")
+
+    return "".join(parts)
+
+
 # Кнопка для создания отчета
 if st.button("📊 Создать отчет для отправки"):
-    # Собираем все логи последней сессии
+    # Отчёт по последней сессии
     latest_session = sorted(sessions.keys(), reverse=True)[0]
+    report = build_report(latest_session, sessions[latest_session])
     report_file = log_dir / f"report_{latest_session}.md"
-
-    with open(report_file, 'w', encoding='utf-8') as f:
-        f.write(f"# Отчет о сессии {latest_session}\n\n")
-        f.write(f"Создан: {datetime.now()}\n\n")
-
-        # Добавляем чат
-        if sessions[latest_session]['chats']:
-            f.write("## Чат\n\n")
-            with open(sessions[latest_session]['chats'][0], 'r', encoding='utf-8') as chat:
-                f.write(chat.read())
-
-        # Добавляем ошибки
-        if sessions[latest_session]['errors']:
-            f.write("\n## Ошибки\n\n")
-            with open(sessions[latest_session]['errors'][0], 'r', encoding='utf-8') as err:
-                f.write(f"```\n{err.read()}\n```")
-
-        # Добавляем состояние
-        if sessions[latest_session]['states']:
-            f.write("\n## Состояние\n\n")
-            f.write("```json\n")
-            with open(sessions[latest_session]['states'][0], 'r', encoding='utf-8') as state:
-                f.write(state.read())
-            f.write("\n```\n")
+    report_file.write_text(report, encoding='utf-8')
 
     st.success(f"✅ Отчет создан: {report_file}")
 
     # Кнопка для скачивания
-    with open(report_file, 'r', encoding='utf-8') as f:
-        st.download_button(
-            "📥 Скачать отчет",
-            f.read(),
-            file_name=f"session_report_{latest_session}.md",
-            mime="text/markdown"
-        )
\ No newline at end of file
+    st.download_button(
+        "📥 Скачать отчет",
+        report,
+        file_name=f"session_report_{latest_session}.md",
+        mime="text/markdown"
+    )